@@ -1,97 +1,374 @@
 # backend/ai.py
+# transformers / dateparser / torch 都在用到时才导入：只跑 API 的进程不需要它们，启动不到一秒
 import os
-os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
+import re
+import time
+import threading
+from functools import lru_cache, partial
+from datetime import datetime
 
-from transformers import pipeline
-import dateparser 
-from dateparser.search import search_dates
+from cache import ResultCache, file_sha256, text_sha256
+import runtimes
+import metrics
+
+# 模型文件缓存在本地目录；缓存齐全后离线加载，不再每次启动都去 Hub 检查更新
+MODEL_CACHE_DIR = os.path.abspath(os.getenv("MODEL_CACHE_DIR", "models"))
+os.environ.setdefault("HF_HOME", MODEL_CACHE_DIR)
+os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")  # 首次下载走镜像，可用环境变量覆盖
+AI_PRELOAD = os.getenv("AI_PRELOAD", "1") == "1"  # 启动时后台加载模型；纯 API 进程设为 0，用到时再加载
+
+# 模型配置；换模型或改阈值时版本号随之变化，旧缓存自动失效
+SCENE_MODEL = "google/vit-base-patch16-224"
+OBJECT_MODEL = "facebook/detr-resnet-50"
+NER_MODEL = "uer/roberta-base-finetuned-cluener2020-chinese"
+OBJECT_THRESHOLD = 0.9
+IMAGE_MODEL_VERSION = f"{SCENE_MODEL}+{OBJECT_MODEL}@{OBJECT_THRESHOLD}/labels{runtimes.version_suffix()}"
+TEXT_MODEL_VERSION = f"{NER_MODEL}+dates4+dateparser{runtimes.version_suffix()}"
+# 语义检索用的图文双塔模型 (中文 CLIP，CPU 可跑)
+EMBED_MODEL = os.getenv("EMBED_MODEL", "OFA-Sys/chinese-clip-vit-base-patch16")
+
+image_cache = ResultCache("image", IMAGE_MODEL_VERSION)
+text_cache = ResultCache("text", TEXT_MODEL_VERSION)
 
 # 全局变量
 classifier_scene = None
 classifier_object = None
 extractor_ner = None
+embed_model = None
+embed_processor = None
+
+# 各模型的加载状态：idle / loading / ready / failed，供 /health 查询
+model_status = {"scene": "idle", "object": "idle", "ner": "idle", "embed": "idle"}
+load_seconds = {}
+load_errors = {}
+_load_lock = threading.Lock()  # 后台预加载和请求触发的加载不会重复加载同一个模型
+
+def _is_cached(model_name):
+    return os.path.isdir(os.path.join(os.environ["HF_HOME"], "hub", "models--" + model_name.replace("/", "--")))
+
+def _use_offline_cache():
+    """用到的模型都已在本地缓存时切到离线模式，省掉逐个文件的联网校验"""
+    if all(_is_cached(m) for m in (SCENE_MODEL, OBJECT_MODEL, NER_MODEL, EMBED_MODEL)):
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+def _load(name, build):
+    """加载单个模型并记录状态和耗时；失败返回 None"""
+    model_status[name] = "loading"
+    started = time.perf_counter()
+    try:
+        model = build()
+    except Exception as e:
+        model_status[name] = "failed"; load_errors[name] = str(e)
+        print(f"❌ 模型加载失败 ({name}): {e}")
+        return None
+    load_seconds[name] = round(time.perf_counter() - started, 2)
+    model_status[name] = "ready"; load_errors.pop(name, None)
+    return model
 
 def load_models():
     global classifier_scene, classifier_object, extractor_ner
-    print("🤖 正在加载 AI 混合引擎...")
-    try:
+    with _load_lock:
+        if classifier_scene is not None and classifier_object is not None and extractor_ner is not None: return
+        print(f"🤖 正在加载 AI 混合引擎 (后端: {runtimes.AI_BACKEND})...")
+        _use_offline_cache()
         # 1. 视觉模型
         if classifier_scene is None:
             print("   - [1/3] Loading Scene Model...")
-            classifier_scene = pipeline("image-classification", model="google/vit-base-patch16-224")
+            classifier_scene = _load("scene", lambda: runtimes.build_pipeline("image-classification", SCENE_MODEL))
         if classifier_object is None:
             print("   - [2/3] Loading Object Model...")
-            classifier_object = pipeline("object-detection", model="facebook/detr-resnet-50")
-        
+            classifier_object = _load("object", lambda: runtimes.build_pipeline("object-detection", OBJECT_MODEL))
+
         # 2. 文本模型
         if extractor_ner is None:
             print("   - [3/3] Loading Text NER Model...")
-            extractor_ner = pipeline("token-classification", model="uer/roberta-base-finetuned-cluener2020-chinese")
-            
-        print("✅ AI 引擎加载完成！")
+            extractor_ner = _load("ner", lambda: runtimes.build_pipeline("token-classification", NER_MODEL))
+
+        if is_ready(): print("✅ AI 引擎加载完成！")
+
+def is_ready():
+    """打标签和文本分析需要的模型都已加载 (语义向量模型不影响上传流程)"""
+    return all(model_status[name] == "ready" for name in ("scene", "object", "ner"))
+
+def _warm_up():
+    """用一张空白图和一句短文本各跑一遍，让首个真实请求不再承担算子初始化的开销"""
+    try:
+        from PIL import Image as PILImage
+        blank = PILImage.new("RGB", (224, 224))
+        if classifier_scene is not None: classifier_scene(blank)
+        if classifier_object is not None: classifier_object(blank)
+        if extractor_ner is not None: extractor_ner("杭州", aggregation_strategy="simple")
+        if embed_model is not None: embed_text("预热")
+        _date_search()("昨天")
     except Exception as e:
-        print(f"❌ 模型加载失败: {e}")
+        print(f"模型预热失败: {e}")
+
+def _preload():
+    started = time.perf_counter()
+    load_models()
+    load_embedder()
+    _warm_up()
+    load_seconds["total"] = round(time.perf_counter() - started, 2)
+    print(f"🤖 模型后台加载结束，用时 {load_seconds['total']}s")
+
+def start_background_loading():
+    """应用启动时调用：在后台线程加载并预热模型，不阻塞服务开始接收请求"""
+    threading.Thread(target=_preload, name="model-loader", daemon=True).start()
 
-def analyze_image(image_path):
-    """视觉分析 (保持不变)"""
-    global classifier_scene, classifier_object
-    if classifier_scene is None: load_models()
-    if classifier_scene is None: return None
+def _merge_tags(res_scene, res_objects):
+    """合并两个模型的输出：场景取 top-1，物体取高分框；同名标签保留最高置信度"""
+    labels = {}
+    def keep(name, score, source):
+        if name not in labels or labels[name]["confidence"] < score:
+            labels[name] = {"name": name, "confidence": round(float(score), 4), "source": source}
+    if res_scene:
+        keep(res_scene[0]['label'].split(',')[0].strip().lower(), res_scene[0]['score'], "scene")
+    for obj in res_objects:
+        if obj['score'] > OBJECT_THRESHOLD:
+            keep(obj['label'].strip().lower(), obj['score'], "object")
+    return list(labels.values())
+
+def format_tags(labels):
+    """兼容旧的 ai_tags 字段：逗号分隔的标签名"""
+    if labels is None: return None
+    return ", ".join(label["name"] for label in labels)
+
+def analyze_image(image, content_hash=None):
+    """视觉分析 (单张)，返回 [{name, confidence, source}, ...]，失败返回 None"""
+    return analyze_images([image], [content_hash])[0]
+
+def analyze_images(images, content_hashes=None):
+    """
+    批量视觉分析：按图片内容的 SHA-256 查缓存，只对未命中的图片推理。
+    images 可以是文件路径，也可以是上传流程里已解码好的预览图 (PIL Image，此时必须给出哈希，否则不走缓存)；
+    content_hashes 可由上传时边写边算的结果传入，省去再读一遍文件。
+    """
+    hashes = list(content_hashes or [None] * len(images))
+    for i, h in enumerate(hashes):
+        if h is None and isinstance(images[i], str): hashes[i] = file_sha256(images[i])
+    results = [image_cache.get(h) if h else None for h in hashes]
+    misses = [i for i, r in enumerate(results) if r is None]
+    if misses:
+        for i, tags in zip(misses, _infer_images([images[i] for i in misses])):
+            results[i] = tags
+            if tags is not None and hashes[i]: image_cache.put(hashes[i], tags)
+    return results
+
+def _infer_images(image_paths):
+    """
+    场景模型和物体模型对整批图片各跑一次 (同一份输入，路径只在没有预览图时才由 pipeline 自己读盘)。
+    整批失败时退回逐张推理，避免一张坏图拖垮同批的其它请求。
+    """
+    if classifier_scene is None or classifier_object is None: load_models()
+    if classifier_scene is None or classifier_object is None: return [None] * len(image_paths)
 
-    final_tags = set()
     try:
-        res_scene = classifier_scene(image_path)
-        if res_scene:
-            final_tags.add(res_scene[0]['label'].split(',')[0].lower())
-        res_objects = classifier_object(image_path)
-        for obj in res_objects:
-            if obj['score'] > 0.9:
-                final_tags.add(obj['label'].lower())
-        return ", ".join(list(final_tags))
+        batch_size = len(image_paths)
+        with metrics.timed("scene_model"): res_scene = classifier_scene(image_paths, batch_size=batch_size)
+        with metrics.timed("object_model"): res_objects = classifier_object(image_paths, batch_size=batch_size)
+        return [_merge_tags(s, o) for s, o in zip(res_scene, res_objects)]
     except Exception as e:
-        return None
+        if len(image_paths) == 1: return [None]
+        print(f"批量识别失败，逐张重试: {e}")
+        return [_infer_images([p])[0] for p in image_paths]
+
+# --- 时间解析：常见的公历写法用正则直接解析，只有写法不认识时才交给 dateparser (慢，且每次都要过一遍多语言规则) ---
+_CN_DIGITS = {c: i for i, c in enumerate("零一二三四五六七八九")} | {"〇": 0, "两": 2}
+_NUM = r"\d{1,2}|[零〇一二两三四五六七八九十]{1,3}"
+_MONTHS = r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?"
+_MONTH_NUMBERS = {name: i for i, name in enumerate(("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+_TIME = rf"(?:\s*(?P<period>凌晨|早上|早晨|上午|中午|下午|傍晚|晚上)?\s*(?P<hour>{_NUM})\s*[点时:：]\s*(?:(?P<minute>{_NUM}|半)\s*分?)?)?"
+_DATE_PATTERNS = [
+    # 2024-03-05、2024/3/5、2024.03.05，可带 14:30[:00]
+    re.compile(r"(?<!\d)(?P<year>\d{4})[-/.](?P<month>\d{1,2})[-/.](?P<day>\d{1,2})(?!\d)(?:[T\s]+(?P<hour>\d{1,2})[:：](?P<minute>\d{2})(?:[:：](?P<second>\d{2}))?)?"),
+    # 2024年3月5日、二〇二四年三月五号、2024年3月 (没写日按 1 号)，可带“下午3点半”这类时间
+    re.compile(rf"(?<!\d)(?P<year>\d{{4}}|[零〇一二三四五六七八九]{{4}})\s*年\s*(?P<month>{_NUM})\s*月(?:\s*(?P<day>{_NUM})\s*[日号]{_TIME})?"),
+    # 没写年份的 3月5日、十月一号，同样可带时间
+    re.compile(rf"(?<![\d年零〇一二两三四五六七八九十])(?P<month>{_NUM})\s*月\s*(?P<day>{_NUM})\s*[日号]{_TIME}"),
+    # March 5、Mar. 5th, 2024、5 March 2024
+    re.compile(rf"\b(?P<month_name>{_MONTHS})\.?\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s*(?P<year>\d{{4}})\b)?", re.IGNORECASE),
+    re.compile(rf"\b(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?P<month_name>{_MONTHS})\b\.?(?:,?\s*(?P<year>\d{{4}})\b)?", re.IGNORECASE),
+]
+_FULLWIDTH_DIGITS = str.maketrans("０１２３４５６７８９：", "0123456789:")
+# 正则没命中时，只有带这些字的文本才可能写了时间 (昨天、去年夏天、周六…)，其余直接跳过 dateparser
+_DATE_HINT = re.compile(r"\d|[零〇一二两三四五六七八九十年月日号天周星期礼拜点时午晚早春夏秋冬今昨明前后去]")
+
+def _number(text: str) -> int:
+    """阿拉伯数字或中文数字 (“二〇二四”逐位读，“二十三”按十进制读)"""
+    if text.isdigit(): return int(text)
+    if "十" not in text: return int("".join(str(_CN_DIGITS[c]) for c in text))
+    tens, _, ones = text.partition("十")
+    return (_CN_DIGITS[tens] if tens else 1) * 10 + (_CN_DIGITS[ones] if ones else 0)
+
+def _match_date(match) -> datetime:
+    """没写年份的取今年，还没到的日子算去年的 (照片不会拍在将来)"""
+    parts = match.groupdict()
+    hour = _number(parts["hour"]) if parts.get("hour") else 0
+    period = parts.get("period")
+    if period in ("下午", "傍晚", "晚上") and hour < 12: hour += 12
+    elif period == "中午" and hour < 11: hour += 12
+    elif period == "凌晨" and hour == 12: hour = 0
+    minute = parts.get("minute")
+    month = _MONTH_NUMBERS[parts["month_name"][:3].lower()] if parts.get("month_name") else _number(parts["month"])
+    fields = (
+        month, _number(parts["day"]) if parts.get("day") else 1,
+        hour, 30 if minute == "半" else _number(minute) if minute else 0, int(parts.get("second") or 0),
+    )
+    if parts.get("year"): return datetime(_number(parts["year"]), *fields)
+    now = datetime.now()
+    for year in range(now.year, now.year - 8, -1):  # 往前找，2月29日要落到最近的闰年
+        try: date = datetime(year, *fields)
+        except ValueError: continue
+        if date <= now: return date
+    raise ValueError(f"日期不存在: {match.group(0)}")
+
+@lru_cache(maxsize=1)
+def _date_search():
+    """
+    第一次用到时才导入 dateparser，返回固定了语言和设置的 search_dates：指定单一语言就不做语言检测，
+    设置对象在这里构造一次，不必每次调用都从 dict 重建。解析器本身 (语言数据) 是 dateparser 模块级的单例，导入后一直复用。
+    """
+    from dateparser.conf import settings
+    from dateparser.search import search_dates
+    return partial(search_dates, languages=['zh'], settings=settings.replace(PREFER_DATES_FROM="past"))
+
+def _extract_date(text: str):
+    """
+    返回 (时间, 是否与今天无关)：写明年月日的是绝对时间可以缓存；
+    没写年份的“3月5日”和 dateparser 解析出的“昨天”这类相对时间，换一天就可能不一样了
+    """
+    text = text.translate(_FULLWIDTH_DIGITS)
+    matches = sorted((m for pattern in _DATE_PATTERNS for m in pattern.finditer(text)), key=lambda m: m.start())
+    for match in matches:
+        try: return _match_date(match), match.groupdict().get("year") is not None
+        except (ValueError, KeyError): continue  # 2月30日之类不存在的日期
+    if matches or not _DATE_HINT.search(text): return None, True
+    # search_dates 会自动从句子里找时间，返回 [(字符串, datetime对象), ...]
+    with metrics.timed("dateparser"): dates = _date_search()(text)
+    return (dates[0][1], False) if dates else (None, True)
+
+def extract_date(text: str):
+    """文本里第一个时间，没有返回 None"""
+    return _extract_date(text)[0]
+
+def _location(entities):
+    # 只要是 地点(LOC)、地址(address)、机构(ORG) 都算进去
+    # 即使是单字（如“省”）也不过滤了，防止信息丢失
+    # 简单的拼接，不去重（因为有时候“浙江”和“大学”可能分开识别，去重会乱）
+    fragments = [entity['word'] for entity in entities if entity['entity_group'] in ['LOC', 'address', 'ORG']]
+    return "".join(fragments) or None
 
 def analyze_text(text):
+    """文本分析 (单条)：时间 + NER 提取的地点，返回 {location, date}"""
+    return analyze_texts([text])[0]
+
+def analyze_texts(texts):
     """
-    升级版文本分析：
-    1. 使用 dateparser 强力解析时间
-    2. 使用 NER 提取地点 (放宽限制)
+    批量文本分析：描述归一化后哈希，相同描述只分析一次、命中缓存的不必加载模型；
+    没命中的逐条解析时间，NER 对整批只跑一次。返回与 texts 等长的 [{location, date}, ...]。
+    缓存里只存地点和绝对时间；相对时间 (relative_date) 每次命中后重新解析。
     """
-    global extractor_ner
+    results = [{"location": None, "date": None} for _ in texts]
+    pending = {}  # 文本哈希 -> 下标列表
+    for i, text in enumerate(texts):
+        if not text: continue
+        text_hash = text_sha256(text)
+        cached = text_cache.get(text_hash)
+        if cached is not None:
+            if cached.get("relative_date"): date = extract_date(text)
+            else: date = datetime.fromisoformat(cached["date"]) if cached["date"] else None
+            results[i] = {"location": cached["location"], "date": date}
+        else:
+            pending.setdefault(text_hash, []).append(i)
+    if not pending: return results
+
     if extractor_ner is None: load_models()
-    
-    extracted = {"location": None, "date": None}
-    if not text: return extracted
-    
-    # --- 1. 强力时间解析 (优先使用 dateparser) ---
-    try:
-        # search_dates 会自动从句子里找时间，返回 [(字符串, datetime对象), ...]
-        # settings={'PREFER_DATES_FROM': 'future'} 也可以设置，这里用默认
-        dates = search_dates(text, languages=['zh'])
-        if dates:
-            # 取第一个找到的时间
-            print(f"⏰ 解析到时间: {dates[0]}")
-            extracted['date'] = dates[0][1] # 直接拿到 datetime 对象
-    except Exception as e:
-        print(f"时间解析失败: {e}")
+    hashes = list(pending)
+    unique = [texts[pending[h][0]] for h in hashes]
+    extracted = [{"location": None, "date": None} for _ in unique]
+    fixed = [True] * len(unique)
+    complete = [extractor_ner is not None] * len(unique)
+
+    # --- 1. 时间 ---
+    for k, text in enumerate(unique):
+        try:
+            extracted[k]["date"], fixed[k] = _extract_date(text)
+            if extracted[k]["date"]: print(f"⏰ 解析到时间: {extracted[k]['date']}")
+        except Exception as e:
+            print(f"时间解析失败: {e}")
+            complete[k] = False
 
-    # --- 2. 地点提取 (NER) ---
+    # --- 2. 地点 (NER，整批一次) ---
     if extractor_ner:
         try:
-            results = extractor_ner(text, aggregation_strategy="simple")
-            loc_fragments = []
-            
-            for entity in results:
-                # 只要是 地点(LOC)、地址(address)、机构(ORG) 都算进去
-                # 即使是单字（如“省”）也不过滤了，防止信息丢失
-                if entity['entity_group'] in ['LOC', 'address', 'ORG']:
-                    loc_fragments.append(entity['word'])
-            
-            # 简单的拼接，不去重（因为有时候“浙江”和“大学”可能分开识别，去重会乱）
-            if loc_fragments:
-                extracted['location'] = "".join(loc_fragments)
-                
+            with metrics.timed("ner"): entities = extractor_ner(unique, aggregation_strategy="simple", batch_size=len(unique))
+            for item, item_entities in zip(extracted, entities): item["location"] = _location(item_entities)
         except Exception as e:
             print(f"地点解析失败: {e}")
-            
-    return extracted
\ No newline at end of file
+            complete = [False] * len(unique)
+
+    # 模型没加载或中途出错的不完整结果不进缓存
+    for text_hash, item, ok, is_fixed in zip(hashes, extracted, complete, fixed):
+        if ok: text_cache.put(text_hash, {
+            "location": item["location"],
+            "date": item["date"].isoformat() if item["date"] and is_fixed else None,
+            "relative_date": not is_fixed,
+        })
+        for i in pending[text_hash]: results[i] = dict(item)
+    return results
+
+# --- 语义向量 ---
+def load_embedder():
+    global embed_model, embed_processor
+    with _load_lock:
+        if embed_model is not None: return
+        print("   - Loading Embedding Model...")
+        _use_offline_cache()
+        def build():
+            from transformers import AutoModel, AutoProcessor
+            runtimes.configure_threads()
+            return AutoProcessor.from_pretrained(EMBED_MODEL), AutoModel.from_pretrained(EMBED_MODEL).eval()
+        loaded = _load("embed", build)
+        if loaded: embed_processor, embed_model = loaded
+
+def _normalize(features):
+    features = features / features.norm(dim=-1, keepdim=True)
+    return features.cpu().numpy().astype("float32")
+
+def _open_rgb(image):
+    """预览图直接用；路径则让 JPEG 解码器按 1/2~1/8 缩放输出，CLIP 只需要 224"""
+    from PIL import Image as PILImage
+    if not isinstance(image, str): return image
+    with PILImage.open(image) as img:
+        img.draft("RGB", (224, 224))
+        return img.convert("RGB")
+
+def embed_images(image_paths):
+    """批量计算图片向量 (L2 归一化)，失败的位置返回 None；元素可以是路径或预览图"""
+    if embed_model is None: load_embedder()
+    if embed_model is None: return [None] * len(image_paths)
+    import torch
+    try:
+        images = [_open_rgb(p) for p in image_paths]
+        with torch.no_grad(), metrics.timed("embed_model"):
+            inputs = embed_processor(images=images, return_tensors="pt")
+            return list(_normalize(embed_model.get_image_features(**inputs)))
+    except Exception as e:
+        if len(image_paths) == 1: return [None]
+        print(f"批量向量计算失败，逐张重试: {e}")
+        return [embed_images([p])[0] for p in image_paths]
+
+def embed_text(text):
+    """计算查询文本的向量，与图片向量在同一空间"""
+    if embed_model is None: load_embedder()
+    if embed_model is None: return None
+    import torch
+    with torch.no_grad():
+        inputs = embed_processor(text=[text], padding=True, return_tensors="pt")
+        return _normalize(embed_model.get_text_features(**inputs))[0]
+
+if __name__ == "__main__":
+    # 预先下载并缓存全部模型 (如构建镜像时执行 python ai.py)，之后可离线启动
+    load_models()
+    load_embedder()
@@ -0,0 +1,61 @@
+# backend/auth.py
+# 鉴权热路径：token 里带用户 id (uid) 和 token 版本号 (ver)，用户对象放进程内短 TTL 缓存，
+# 命中时解完 JWT 就能返回，不访问数据库。
+# 吊销：token_version 加一后调用 invalidate()；多进程部署时其它进程最多在 USER_CACHE_TTL 秒后失效。
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from jose import JWTError, jwt
+
+import crud, database, security
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))      # 秒
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+class InvalidToken(Exception):
+    pass
+
+_users: OrderedDict[int, tuple[float, object]] = OrderedDict()
+_lock = threading.Lock()
+
+def create_token(user) -> str:
+    return security.create_access_token(
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version},
+        expires_delta=timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+
+def _cached(user_id: int):
+    with _lock:
+        entry = _users.get(user_id)
+        if entry is None: return None
+        if entry[0] < time.monotonic():
+            del _users[user_id]; return None
+        _users.move_to_end(user_id)
+        return entry[1]
+
+def _store(user):
+    with _lock:
+        _users[user.id] = (time.monotonic() + USER_CACHE_TTL, user)
+        _users.move_to_end(user.id)
+        while len(_users) > USER_CACHE_SIZE: _users.popitem(last=False)
+
+def invalidate(user_id: int):
+    with _lock: _users.pop(user_id, None)
+
+async def authenticate(token: str):
+    """校验 token 并返回用户；token 无效、过期、已吊销或用户不存在时抛 InvalidToken"""
+    try:
+        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+        user_id, version = int(payload["uid"]), payload["ver"]
+    except (JWTError, KeyError, TypeError, ValueError):
+        raise InvalidToken()
+    user = _cached(user_id)
+    if user is None:
+        user = await database.run_sync(crud.get_user, user_id)
+        if user is None: raise InvalidToken()
+        _store(user)
+    if user.token_version != version: raise InvalidToken()
+    return user
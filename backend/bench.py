@@ -0,0 +1,317 @@
+# backend/bench.py
+# 压测 / 回归基准：假模型 + 合成图片库，测上传入库、图库列表、搜索、地图/时间线，以及并发 WebSocket 客户端
+#   python bench.py                                       默认规模跑一遍，打印各项延迟分位数和各步骤平均耗时
+#   python bench.py --photos 500 --ws-clients 200 --out bench.json
+#   python bench.py --baseline bench.json --tolerance 0.2   与上次结果比，任一项 p95 变慢超过 20% 时退出码为 1
+# 服务端在子进程里启动 (python bench.py serve ...)，数据库、图片、向量都放在临时目录，不碰真实数据。
+# 模型换成固定输出、按 --model-ms 模拟每张耗时的假 pipeline，测的是模型以外的开销；dateparser 用真的。
+# 客户端需要 httpx 和 websockets (后者随 uvicorn[standard] 安装)。
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import itertools
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENES = ["seashore, coast", "alp", "valley", "library", "street sign", "lakeside", "volcano", "cliff"]
+OBJECTS = ["dog", "cat", "person", "car", "bicycle", "boat", "bird"]
+DESCRIPTIONS = [
+    "2023年5月1日在杭州西湖边拍的", "去年国庆节和家人在北京故宫", "上海外滩的夜景", "2022-08-15 成都大熊猫基地",
+    "周末在公园散步", "厦门鼓浪屿的海边", None, None,
+]
+PLACES = [(30.25, 120.16), (39.91, 116.40), (31.24, 121.49), (30.73, 104.14), (24.45, 118.07), (22.54, 114.06)]
+
+# --- 假模型 (服务端进程里替换 runtimes.build_pipeline 和语义向量函数) ---
+class StubPipeline:
+    """和 transformers pipeline 同样的调用方式：单个输入返回单个结果，列表返回列表；每个输入睡 seconds 秒"""
+    def __init__(self, task: str, seconds: float):
+        self.task, self.seconds = task, seconds
+        self._counter = itertools.count()
+
+    def _one(self):
+        n = next(self._counter)
+        if self.task == "image-classification":
+            return [{"label": SCENES[n % len(SCENES)], "score": 0.8}]
+        if self.task == "object-detection":
+            return [{"label": OBJECTS[n % len(OBJECTS)], "score": 0.95, "box": {"xmin": 0, "ymin": 0, "xmax": 10, "ymax": 10}}]
+        return [{"entity_group": "LOC", "word": "杭州", "score": 0.99, "start": 0, "end": 2}]
+
+    def __call__(self, inputs, **kwargs):
+        batch = inputs if isinstance(inputs, list) else [inputs]
+        time.sleep(self.seconds * len(batch))
+        outputs = [self._one() for _ in batch]
+        return outputs if isinstance(inputs, list) else outputs[0]
+
+def install_stub_models(model_ms: float):
+    import numpy as np
+    import ai, runtimes, vectors
+    seconds = model_ms / 1000.0
+    rng = np.random.default_rng(0)
+    def unit():
+        v = rng.standard_normal(vectors.EMBED_DIM).astype("float32")
+        return v / np.linalg.norm(v)
+    def embed_images(images):
+        time.sleep(seconds * len(images))
+        return [unit() for _ in images]
+    def load_embedder():
+        ai.model_status["embed"] = "ready"; ai.load_seconds["embed"] = 0.0
+    runtimes.build_pipeline = lambda task, model_name, backend=None: StubPipeline(task, seconds)
+    ai.embed_images, ai.embed_text, ai.load_embedder = embed_images, lambda text: unit(), load_embedder
+
+def serve(args):
+    """子进程：在临时目录里起服务 (所有相对路径都落在这里)，模型换成假的，必须在 import main 之前完成"""
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(args.data)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(args.data, 'photos.db')}")
+    os.environ.setdefault("MODEL_CACHE_DIR", os.path.join(args.data, "models"))
+    install_stub_models(args.model_ms)
+    import uvicorn
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+# --- 合成图片库 ---
+def _exif(place, date):
+    from PIL import Image as PILImage
+    exif = PILImage.Exif()
+    if place:
+        lat, lon = place
+        exif.get_ifd(0x8825).update({1: "N", 2: (lat, 0.0, 0.0), 3: "E", 4: (lon, 0.0, 0.0)})
+    if date: exif.get_ifd(0x8769)[36867] = date
+    return exif
+
+def make_corpus(n: int, size: tuple, burst_ratio: float, seed: int = 0) -> list[dict]:
+    """
+    随机色块放大成的 JPEG (内容有起伏，编码/解码开销接近真实照片)；
+    约 70% 带拍摄时间、50% 带 GPS，burst_ratio 的比例是前一张重新压缩的近似重复 (模拟连拍)。
+    """
+    import numpy as np
+    from PIL import Image as PILImage
+    rng = np.random.default_rng(seed)
+    pick = random.Random(seed)
+    corpus, previous = [], None
+    for i in range(n):
+        if previous is not None and pick.random() < burst_ratio:
+            img = previous
+        else:
+            img = PILImage.fromarray(rng.integers(0, 255, (12, 16, 3), dtype=np.uint8)).resize(size, PILImage.BICUBIC)
+        previous = img
+        date = f"20{pick.randint(18, 24)}:{pick.randint(1, 12):02d}:{pick.randint(1, 28):02d} 10:00:00" if pick.random() < 0.7 else None
+        place = pick.choice(PLACES) if pick.random() < 0.5 else None
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=pick.randint(75, 92), exif=_exif(place, date))
+        corpus.append({"name": f"bench_{i:05d}.jpg", "data": buf.getvalue(), "description": pick.choice(DESCRIPTIONS)})
+    return corpus
+
+# --- 统计 ---
+def summarize(samples: list[float]) -> dict:
+    if not samples: return {"count": 0}
+    ordered = sorted(samples)
+    at = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"count": len(ordered), "p50_ms": round(at(0.5), 2), "p95_ms": round(at(0.95), 2), "p99_ms": round(at(0.99), 2), "max_ms": round(ordered[-1] * 1000, 2)}
+
+def parse_stage_means(text: str) -> dict:
+    """从 /metrics 的 photo_stage_seconds 里取各步骤的次数和平均耗时"""
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f'photo_stage_seconds{suffix}{{stage="'
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split('"} ')
+                target[stage] = float(value)
+    return {s: {"count": int(counts[s]), "mean_ms": round(sums[s] / counts[s] * 1000, 2)} for s in sorted(counts) if counts[s]}
+
+def parse_batch_sizes(text: str) -> dict:
+    """从 /metrics 的 photo_inference_batch_size 里取各推理服务跑了几批、平均每批几张"""
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f'photo_inference_batch_size{suffix}{{worker="'
+            if line.startswith(prefix):
+                worker, value = line[len(prefix):].split('"} ')
+                target[worker] = float(value)
+    return {w: {"batches": int(counts[w]), "mean_size": round(sums[w] / counts[w], 2)} for w in sorted(counts) if counts[w]}
+
+# --- 各项场景 ---
+async def timed_request(samples, send):
+    started = time.perf_counter()
+    response = await send()
+    samples.append(time.perf_counter() - started)
+    response.raise_for_status()
+    return response
+
+async def bench_uploads(client, headers, corpus, concurrency, ws_clients):
+    samples, jobs = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+    async def upload(i, photo):
+        client_id = f"ws-{i % ws_clients}" if ws_clients else f"bench-{i}"
+        data = {"client_id": client_id}
+        if photo["description"]: data["description"] = photo["description"]
+        async with semaphore:
+            started = time.perf_counter()
+            for _ in range(100):
+                response = await client.post("/upload/", headers=headers, data=data, files={"file": (photo["name"], photo["data"], "image/jpeg")})
+                if response.status_code != 503: break
+                await asyncio.sleep(0.2)  # 处理队列满了：等一会儿重试，和真实客户端一样
+            samples.append(time.perf_counter() - started)
+            response.raise_for_status()
+        jobs.append(response.json()["job_id"])
+    started = time.perf_counter()
+    await asyncio.gather(*[upload(i, p) for i, p in enumerate(corpus)])
+    accepted = time.perf_counter() - started
+    # 等后台流水线全部处理完
+    pending, failed = set(jobs), 0
+    while pending:
+        await asyncio.sleep(0.2)
+        for job_id in list(pending):
+            status = (await client.get(f"/jobs/{job_id}", headers=headers)).json()["status"]
+            if status in ("done", "failed"):
+                pending.discard(job_id); failed += status == "failed"
+    total = time.perf_counter() - started
+    return {"request": summarize(samples), "accepted_s": round(accepted, 2), "total_s": round(total, 2),
+            "photos_per_sec": round(len(corpus) / total, 2), "failed": failed}
+
+async def bench_listing(client, headers, rounds):
+    samples, pages = [], 0
+    for _ in range(rounds):
+        for fields in ("lite", "full"):
+            cursor = None
+            while True:
+                params = {"limit": 100, "fields": fields, **({"cursor": cursor} if cursor else {})}
+                response = await timed_request(samples, lambda: client.get("/my-images/", headers=headers, params=params))
+                pages += 1
+                cursor = response.headers.get("x-next-cursor")
+                if not cursor: break
+    return {"page": summarize(samples), "pages": pages}
+
+async def bench_search(client, headers, rounds):
+    queries = [s.split(",")[0] for s in SCENES] + OBJECTS + ["杭州", "西湖", "北京", "海边", "do"]
+    samples = []
+    for _ in range(rounds):
+        for q in queries:
+            await timed_request(samples, lambda: client.get("/search/", headers=headers, params={"q": q}))
+    return {"query": summarize(samples)}
+
+async def bench_views(client, headers, rounds):
+    """地图瓦片、时间线、重复分组这类聚合视图"""
+    samples = {"timeline": [], "map_tile": [], "duplicates": []}
+    for _ in range(rounds):
+        await timed_request(samples["timeline"], lambda: client.get("/timeline", headers=headers))
+        for z, x, y in ((0, 0, 0), (2, 3, 1), (6, 53, 26)):
+            await timed_request(samples["map_tile"], lambda: client.get(f"/map/tiles/{z}/{x}/{y}", headers=headers))
+        await timed_request(samples["duplicates"], lambda: client.get("/duplicates/", headers=headers))
+    return {name: summarize(s) for name, s in samples.items()}
+
+async def open_websockets(base_url, n):
+    """n 个并发 WebSocket 客户端，统计连接耗时和收到的消息数"""
+    import websockets
+    connect_samples, received, sockets = [], {"messages": 0}, []
+    async def one(i):
+        started = time.perf_counter()
+        ws = await websockets.connect(f"{base_url.replace('http', 'ws', 1)}/ws/ws-{i}")
+        connect_samples.append(time.perf_counter() - started)
+        sockets.append(ws)
+        try:
+            async for _ in ws: received["messages"] += 1
+        except websockets.ConnectionClosed: pass
+    tasks = [asyncio.create_task(one(i)) for i in range(n)]
+    while len(sockets) + sum(t.done() for t in tasks) < n: await asyncio.sleep(0.05)
+    async def close():
+        for ws in sockets: await ws.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {"clients": n, "connect": summarize(connect_samples), "messages": received["messages"]}
+    return close
+
+async def run(args):
+    import httpx
+    data_dir = tempfile.mkdtemp(prefix="photo-bench-")
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--data", data_dir, "--port", str(args.port), "--model-ms", str(args.model_ms)])
+    report = {"config": {k: v for k, v in vars(args).items() if k not in ("command", "baseline", "out")}}
+    try:
+        print(f"生成 {args.photos} 张合成图片...")
+        corpus = make_corpus(args.photos, (args.width, args.height), args.burst_ratio)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            for _ in range(600):
+                try:
+                    if (await client.get("/health/ready")).status_code == 200: break
+                except httpx.TransportError: pass
+                if server.poll() is not None: sys.exit("服务端启动失败")
+                await asyncio.sleep(0.1)
+            await client.post("/register", json={"username": "bench", "email": "bench@example.com", "password": "bench-password"})
+            token = (await client.post("/token", data={"username": "bench", "password": "bench-password"})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            close_websockets = await open_websockets(base_url, args.ws_clients) if args.ws_clients else None
+            print("上传...")
+            report["upload"] = await bench_uploads(client, headers, corpus, args.concurrency, args.ws_clients)
+            if close_websockets: report["websocket"] = await close_websockets()
+            print("列表 / 搜索 / 聚合视图...")
+            report["listing"] = await bench_listing(client, headers, args.rounds)
+            report["search"] = await bench_search(client, headers, args.rounds)
+            report["views"] = await bench_views(client, headers, args.rounds)
+            metrics_text = (await client.get("/metrics")).text
+            report["stages"] = parse_stage_means(metrics_text)
+            report["batches"] = parse_batch_sizes(metrics_text)
+    finally:
+        server.terminate(); server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return report
+
+def latencies(report: dict, path: str = "") -> dict:
+    """报告里所有的 p95 和整体耗时 (*_s)，按 "场景.项目" 展平；都是越小越好"""
+    found = {}
+    for key, value in report.items():
+        if key in ("config", "stages"): continue
+        if isinstance(value, dict):
+            if "p95_ms" in value: found[f"{path}{key}"] = value["p95_ms"]
+            else: found.update(latencies(value, f"{path}{key}."))
+        elif key.endswith("_s"): found[f"{path}{key}"] = value
+    return found
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    current, previous = latencies(report), latencies(baseline)
+    return [f"{name}: {previous[name]} -> {value}" for name, value in current.items()
+            if name in previous and value > previous[name] * (1 + tolerance)]
+
+def main():
+    parser = argparse.ArgumentParser(description="假模型 + 合成图片的压测/回归基准")
+    sub = parser.add_subparsers(dest="command")
+    server = sub.add_parser("serve", help="(内部使用) 在临时目录里启动带假模型的服务")
+    server.add_argument("--data", required=True)
+    server.add_argument("--port", type=int, default=8765)
+    server.add_argument("--model-ms", type=float, default=20)
+    parser.add_argument("--photos", type=int, default=200)
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    parser.add_argument("--burst-ratio", type=float, default=0.2, help="近似重复 (连拍) 的比例")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的上传请求数")
+    parser.add_argument("--ws-clients", type=int, default=50, help="并发 WebSocket 客户端数")
+    parser.add_argument("--rounds", type=int, default=3, help="列表/搜索/聚合视图各跑几轮")
+    parser.add_argument("--model-ms", type=float, default=20, help="假模型每张图/每段文本的耗时")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--out", help="结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前 --out 的结果对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 允许变慢的比例")
+    args = parser.parse_args()
+    if args.command == "serve": return serve(args)
+
+    report = asyncio.run(run(args))
+    print(json.dumps({k: v for k, v in report.items() if k != "config"}, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f: regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions: print(f"⚠️ 变慢: {line}")
+        if regressions: sys.exit(1)
+        print("✅ 与基准相比没有明显变慢")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# backend/cache.py
+# AI 结果缓存：内存 LRU 在前，数据库 ai_cache 表在后，按内容哈希寻址
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import database, models
+
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "2048"))  # 每类结果在内存里保留的条数
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""): h.update(chunk)
+    return h.hexdigest()
+
+def text_sha256(text: str) -> str:
+    """全角/半角、首尾空白、连续空白都不影响哈希"""
+    normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """
+    kind 区分结果类型 (image / text)，model_version 记录产出结果的模型。
+    版本不一致的旧条目视为未命中，重新计算后原地覆盖，其它类型的条目不受影响。
+    """
+    def __init__(self, kind: str, model_version: str, maxsize: int = AI_CACHE_SIZE):
+        self.kind = kind
+        self.model_version = model_version
+        self.maxsize = maxsize
+        self._lru: OrderedDict[str, object] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content_hash: str):
+        with self._lock:
+            if content_hash in self._lru:
+                self._lru.move_to_end(content_hash)
+                return self._lru[content_hash]
+        db = database.SessionLocal()
+        try:
+            row = db.get(models.AICache, f"{self.kind}:{content_hash}")
+            if row is None or row.model_version != self.model_version: return None
+            value = json.loads(row.value)
+        except Exception as e:
+            print(f"读取缓存失败: {e}")
+            return None
+        finally:
+            db.close()
+        self._remember(content_hash, value)
+        return value
+
+    def put(self, content_hash: str, value):
+        self._remember(content_hash, value)
+        db = database.SessionLocal()
+        try:
+            db.merge(models.AICache(key=f"{self.kind}:{content_hash}", kind=self.kind, model_version=self.model_version, value=json.dumps(value, ensure_ascii=False)))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"写入缓存失败: {e}")
+        finally:
+            db.close()
+
+    def purge_stale(self) -> int:
+        """删除本类型下其它模型版本产出的条目"""
+        db = database.SessionLocal()
+        try:
+            n = db.query(models.AICache).filter(models.AICache.kind == self.kind, models.AICache.model_version != self.model_version).delete()
+            db.commit()
+            return n
+        finally:
+            db.close()
+
+    def _remember(self, content_hash: str, value):
+        with self._lock:
+            self._lru[content_hash] = value
+            self._lru.move_to_end(content_hash)
+            while len(self._lru) > self.maxsize: self._lru.popitem(last=False)
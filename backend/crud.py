@@ -1,9 +1,12 @@
 # backend/crud.py
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import or_, func, tuple_
 from datetime import datetime
 import os
-import models, schemas, security
+import json
+import base64
+import models, schemas, security, imaging
+import fts, vectors, storage
 
 # --- 用户相关 ---
 def get_user_by_email(db: Session, email: str):
@@ -12,6 +15,18 @@ def get_user_by_email(db: Session, email: str):
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
+def get_user(db: Session, user_id: int):
+    return db.get(models.User, user_id)
+
+def update_password_hash(db: Session, user_id: int, password_hash: str):
+    db.query(models.User).filter(models.User.id == user_id).update({"password_hash": password_hash})
+    db.commit()
+
+def bump_token_version(db: Session, user_id: int):
+    """吊销该用户已签发的全部 token"""
+    db.query(models.User).filter(models.User.id == user_id).update({"token_version": models.User.token_version + 1})
+    db.commit()
+
 def create_user(db: Session, user: schemas.UserCreate):
     hashed_password = security.get_password_hash(user.password)
     db_user = models.User(
@@ -25,12 +40,13 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 # --- 图片相关 ---
-def create_user_image(db: Session, image: schemas.ImageBase, user_id: int, filename: str, thumbnail: str, resolution: str, capture_date: datetime = None, ai_tags: str = None, location: str = "Unknown"):
+def create_user_image(db: Session, image: schemas.ImageBase, user_id: int, filename: str, thumbnail: str, resolution: str, capture_date: datetime = None, ai_tags: str = None, location: str = "Unknown", content_hash: str = None):
     db_image = models.Image(
         **image.dict(),
         user_id=user_id,
         filename=filename,
         thumbnail=thumbnail,
+        content_hash=content_hash,
         resolution=resolution,
         capture_date=capture_date,
         location=location,
@@ -41,12 +57,83 @@ def create_user_image(db: Session, image: schemas.ImageBase, user_id: int, filen
     db.refresh(db_image)
     return db_image
 
-def get_images_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Image).filter(models.Image.user_id == user_id).offset(skip).limit(limit).all()
+# 图库列表可选的排序列 (均为倒序，最新的在前)
+SORT_COLUMNS = {"upload_time": models.Image.upload_time, "capture_date": models.Image.capture_date, "id": models.Image.id}
+# 网格视图只需要这几列
+LITE_COLUMNS = (models.Image.id, models.Image.thumbnail, models.Image.upload_time, models.Image.capture_date)
+
+def encode_cursor(value, image_id: int) -> str:
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value, image_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str):
+    """非法游标抛 ValueError"""
+    value, image_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    if value is not None and sort != "id": value = datetime.fromisoformat(value)
+    return value, int(image_id)
+
+def get_images_by_user(db: Session, user_id: int, sort: str = "upload_time", cursor: str = None, limit: int = 100, lite: bool = False):
+    """
+    游标 (keyset) 分页：用上一页最后一行的 (排序值, id) 定位，不用 OFFSET，翻到多深都只走一次索引范围扫描。
+    排序值为空的行 (如没有拍摄时间) 排在最后，单独用 id 续翻。
+    返回 (本页数据, 下一页游标)，没有下一页时游标为 None。
+    """
+    col = SORT_COLUMNS[sort]
+    last = decode_cursor(cursor, sort) if cursor else None
+    base = db.query(*LITE_COLUMNS) if lite else db.query(models.Image)
+    base = base.filter(models.Image.user_id == user_id)
+
+    rows = []
+    if last is None or last[0] is not None:
+        q = base.filter(col.isnot(None))
+        if last is not None: q = q.filter(tuple_(col, models.Image.id) < tuple_(*last))
+        rows = q.order_by(col.desc(), models.Image.id.desc()).limit(limit).all()
+    if len(rows) < limit and sort != "id":
+        q = base.filter(col.is_(None))
+        if last is not None and last[0] is None: q = q.filter(models.Image.id < last[1])
+        rows += q.order_by(models.Image.id.desc()).limit(limit - len(rows)).all()
+
+    next_cursor = encode_cursor(getattr(rows[-1], sort), rows[-1].id) if len(rows) == limit else None
+    return rows, next_cursor
+
+def create_user_images_bulk(db: Session, user_id: int, rows: list[dict]):
+    """
+    批量导入：一个事务插入整批图片和它们的标签，只提交一次。
+    rows 里每项是 Image 的字段，另带 labels (识别结果列表，可为空)。
+    """
+    db_images = []
+    for row in rows:
+        labels = row.pop("labels", None) or []
+        db_image = models.Image(user_id=user_id, **row)
+        db_image.tags = [models.Tag(user_id=user_id, tag_name=l["name"], confidence=l["confidence"], source=l["source"]) for l in labels]
+        db_images.append(db_image)
+    db.add_all(db_images)
+    db.flush()
+    ids = [img.id for img in db_images]  # 提交后属性会过期，先在 flush 之后取 id
+    db.commit()
+    return ids
+
+def get_images_by_ids(db: Session, user_id: int, ids: list[int]):
+    """按给定 id 顺序返回图片 (用于按相关度排好序的检索结果)"""
+    if not ids: return []
+    by_id = {img.id: img for img in db.query(models.Image).filter(models.Image.user_id == user_id, models.Image.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+def get_image_by_filename(db: Session, filename: str):
+    return db.query(models.Image).filter(models.Image.filename == filename).first()
 
 def get_image_by_id(db: Session, image_id: int, user_id: int):
     return db.query(models.Image).filter(models.Image.id == image_id, models.Image.user_id == user_id).first()
 
+def update_image_fields(db: Session, image_id: int, fields: dict):
+    """后台流水线回填分析结果；图片已被删除时直接忽略"""
+    db_image = db.query(models.Image).filter(models.Image.id == image_id).first()
+    if db_image is None: return None
+    for key, value in fields.items():
+        setattr(db_image, key, value)
+    db.commit()
+    return db_image
+
 # 更新图片元数据
 def update_image_metadata(db: Session, db_image: models.Image, update_data: schemas.ImageUpdate):
     if update_data.description is not None:
@@ -61,20 +148,33 @@ def update_image_metadata(db: Session, db_image: models.Image, update_data: sche
     return db_image
 
 def delete_image_by_id(db: Session, db_image: models.Image):
-    try:
-        original_path = os.path.join("static", "originals", db_image.filename)
-        thumbnail_path = os.path.join("static", "thumbnails", db_image.thumbnail)
-        if os.path.exists(original_path):
-            os.remove(original_path)
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
-    except Exception as e:
-        print(f"删除文件失败: {e}")
+    user_id, image_id, name, content_hash = db_image.user_id, db_image.id, db_image.filename, db_image.content_hash
+    if not content_hash:
+        # 存储改造前的老图片：文件只属于这一张图片，直接删
+        try:
+            for path in (storage.original_path(db_image.filename), storage.thumbnail_path(db_image.thumbnail)):
+                if os.path.exists(path): os.remove(path)
+            imaging.remove_derivatives(json.loads(db_image.variants or "{}"))
+        except Exception as e:
+            print(f"删除文件失败: {e}")
     db.delete(db_image)
     db.commit()
+    # 内容寻址的文件可能被别的图片共用，引用数归零才真正删除
+    if content_hash: storage.collect(db, [name])
+    vectors.remove(user_id, image_id)
     return True
 
-def search_images(db: Session, user_id: int, query_str: str):
+def get_processed_duplicate(db: Session, filename: str, exclude_id: int):
+    """同一份原图已经处理过的另一张图片 (有衍生图)，可以直接复用它的 EXIF 和衍生图"""
+    return db.query(models.Image).filter(
+        models.Image.filename == filename, models.Image.id != exclude_id,
+        models.Image.content_hash.isnot(None), models.Image.variants.isnot(None), models.Image.variants != "{}",
+    ).first()
+
+def search_images(db: Session, user_id: int, query_str: str, skip: int = 0, limit: int = 50):
+    if fts.enabled:
+        return get_images_by_ids(db, user_id, fts.search_ids(db.connection(), user_id, query_str, skip, limit))
+    # 没有全文索引时 (如非 SQLite 数据库) 退回子串匹配
     return db.query(models.Image).filter(
         models.Image.user_id == user_id,
         or_(
@@ -83,4 +183,76 @@ def search_images(db: Session, user_id: int, query_str: str):
             models.Image.location.contains(query_str),
             models.Image.filename.contains(query_str)
         )
-    ).all()
\ No newline at end of file
+    ).order_by(models.Image.id.desc()).offset(skip).limit(limit).all()
+
+# --- 标签相关 ---
+AI_TAG_SOURCES = ("scene", "object", "legacy")
+
+def set_ai_tags(db: Session, image_id: int, labels: list[dict], ai_tags: str):
+    """用新的识别结果替换图片的 AI 标签，用户手动加的标签保留；同时更新兼容字段 ai_tags"""
+    db_image = db.query(models.Image).filter(models.Image.id == image_id).first()
+    if db_image is None: return None
+    db.query(models.Tag).filter(models.Tag.image_id == image_id, models.Tag.source.in_(AI_TAG_SOURCES)).delete(synchronize_session=False)
+    user_names = {name for (name,) in db.query(models.Tag.tag_name).filter(models.Tag.image_id == image_id)}
+    db.add_all([
+        models.Tag(image_id=image_id, user_id=db_image.user_id, tag_name=label["name"], confidence=label["confidence"], source=label["source"])
+        for label in labels if label["name"] not in user_names
+    ])
+    db_image.ai_tags = ai_tags
+    db.commit()
+    return db_image
+
+def get_image_tags(db: Session, image_id: int):
+    return db.query(models.Tag).filter(models.Tag.image_id == image_id).order_by(models.Tag.confidence.desc()).all()
+
+def add_user_tag(db: Session, db_image: models.Image, tag_name: str):
+    tag_name = tag_name.strip().lower()
+    existing = db.query(models.Tag).filter(models.Tag.image_id == db_image.id, models.Tag.tag_name == tag_name).first()
+    if existing: return existing
+    db_tag = models.Tag(image_id=db_image.id, user_id=db_image.user_id, tag_name=tag_name, source="user")
+    db.add(db_tag)
+    db.commit()
+    db.refresh(db_tag)
+    return db_tag
+
+def remove_tag(db: Session, db_image: models.Image, tag_name: str):
+    """删标签行，同一事务里把它从兼容字段 ai_tags 里去掉 (全文索引随 ai_tags 更新)，否则搜索还能搜到、从字符串重建标签时又回来"""
+    tag_name = tag_name.strip().lower()
+    n = db.query(models.Tag).filter(models.Tag.image_id == db_image.id, models.Tag.tag_name == tag_name).delete(synchronize_session=False)
+    if db_image.ai_tags:
+        names = [t.strip() for t in db_image.ai_tags.split(",") if t.strip()]
+        kept = [t for t in names if t.lower() != tag_name]
+        if len(kept) != len(names): db_image.ai_tags = ", ".join(kept)
+    db.commit()
+    return n > 0
+
+def get_tag_facets(db: Session, user_id: int, limit: int = 100):
+    """每个标签下的图片数，按数量从多到少"""
+    count = func.count(models.Tag.image_id)
+    return db.query(models.Tag.tag_name, count.label("count")).filter(models.Tag.user_id == user_id).group_by(models.Tag.tag_name).order_by(count.desc(), models.Tag.tag_name).limit(limit).all()
+
+def get_images_by_tag(db: Session, user_id: int, tag_name: str, skip: int = 0, limit: int = 100):
+    """精确匹配标签名 (搜 dog 不会命中 hotdog)"""
+    return db.query(models.Image).join(models.Tag, models.Tag.image_id == models.Image.id).filter(
+        models.Tag.user_id == user_id, models.Tag.tag_name == tag_name.strip().lower()
+    ).order_by(models.Image.id.desc()).offset(skip).limit(limit).all()
+
+# --- 后台任务 ---
+JOB_FIELDS = ("job_id", "user_id", "image_id", "status", "stage", "error", "created_at")
+
+def save_job(db: Session, job: dict):
+    """写入任务的当前状态 (只取可序列化的字段，流水线挂在 job 上的预览图等不入库)"""
+    report = job.get("report")
+    db.merge(models.Job(**{k: job.get(k) for k in JOB_FIELDS}, report=json.dumps(report, ensure_ascii=False) if report else None, updated_at=datetime.now()))
+    db.commit()
+
+def get_job(db: Session, job_id: str):
+    row = db.get(models.Job, job_id)
+    if row is None: return None
+    return {**{k: getattr(row, k) for k in JOB_FIELDS}, "report": json.loads(row.report) if row.report else None}
+
+def prune_jobs(db: Session, before: datetime) -> int:
+    """删除早于 before 就已结束的任务"""
+    n = db.query(models.Job).filter(models.Job.status.in_(("done", "failed")), models.Job.updated_at < before).delete(synchronize_session=False)
+    db.commit()
+    return n
@@ -0,0 +1,212 @@
+# backend/events.py
+# 进度推送：上传/入库流程只把消息放进每个连接自己的发送队列就返回，不等 WebSocket 真正发出去。
+#   - 每个连接一个有界队列 + 一个发送协程：队列满了丢最旧的；带 key 的消息 (如某个任务的当前状态)
+#     还没发出去时被同 key 的新消息原地替换，慢客户端只会少看到过时的状态
+#   - 发送超时或出错的连接直接关闭清理；定时心跳 (空文本帧) 让半开的死连接也能尽快暴露出来
+#   - 多 worker 部署时，消息经跨进程通道送到持有该连接的进程：
+#       EVENT_TRANSPORT=local  单进程 (默认)
+#       EVENT_TRANSPORT=unix   同一台机器的多个 worker，每个进程在 EVENT_SOCKET_DIR 下绑一个 Unix 数据报套接字
+#       EVENT_TRANSPORT=redis  跨机器，走 Redis pub/sub (需要 redis 包，REDIS_URL 指定地址)
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import weakref
+from collections import deque
+
+import metrics
+
+EVENT_TRANSPORT = os.getenv("EVENT_TRANSPORT", "local")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))          # 每个连接最多积压的消息数
+EVENT_SEND_TIMEOUT = float(os.getenv("EVENT_SEND_TIMEOUT", "10"))     # 秒，单条消息发不出去就认为连接已死
+EVENT_HEARTBEAT = float(os.getenv("EVENT_HEARTBEAT", "30"))           # 秒
+EVENT_SOCKET_DIR = os.getenv("EVENT_SOCKET_DIR", "/tmp/photo-events")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+EVENT_CHANNEL = os.getenv("EVENT_CHANNEL", "photo:events")
+HEARTBEAT = ""  # 前端收到空消息直接忽略
+HEARTBEAT_KEY = "__heartbeat__"
+
+dropped = metrics.Counter("photo_ws_dropped_messages", "没有发给客户端的消息数", "reason")
+_buses = weakref.WeakSet()
+metrics.Gauge("photo_ws_connections", "本进程的 WebSocket 连接数", None, lambda: {"": sum(len(c) for bus in _buses for c in bus.connections.values())})
+
+class Connection:
+    def __init__(self, websocket, client_id: str, queue_size: int = EVENT_QUEUE_SIZE):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.queue_size = queue_size
+        self.pending: deque = deque()  # (key, message)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task: asyncio.Task = None
+
+    def put(self, message: str, key: str = None):
+        if self.closed: return
+        if key is not None:
+            for i, (pending_key, _) in enumerate(self.pending):
+                if pending_key == key:
+                    self.pending[i] = (key, message); dropped.inc("coalesced"); return
+        if len(self.pending) >= self.queue_size:
+            self.pending.popleft(); dropped.inc("overflow")
+        self.pending.append((key, message))
+        self.ready.set()
+
+    async def run(self, on_dead):
+        """发送协程：按顺序把队列里的消息发出去，超时或出错时关闭连接"""
+        try:
+            while True:
+                await self.ready.wait()
+                while self.pending:
+                    _, message = self.pending.popleft()
+                    await asyncio.wait_for(self.websocket.send_text(message), EVENT_SEND_TIMEOUT)
+                self.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            dropped.inc("dead", len(self.pending))
+            on_dead(self)
+            try: await self.websocket.close()
+            except Exception: pass
+
+# --- 跨进程通道：publish(数据) 发给其它进程，收到其它进程的数据时调用 deliver(数据) ---
+class LocalTransport:
+    async def start(self, deliver): pass
+    async def stop(self): pass
+    async def publish(self, data: bytes): pass
+
+class UnixTransport:
+    """每个进程绑 EVENT_SOCKET_DIR/<pid>.sock，发布时发给目录里其它所有套接字；进程退出后留下的套接字发送失败时顺手删掉"""
+    def __init__(self, directory: str = EVENT_SOCKET_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self.sock = None
+        self._peers, self._peers_at = [], 0.0
+
+    async def start(self, deliver):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path): os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        def on_readable():
+            while True:
+                try: data = self.sock.recv(65536)
+                except (BlockingIOError, InterruptedError): return
+                deliver(data)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), on_readable)
+
+    async def stop(self):
+        if self.sock is None: return
+        asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close(); self.sock = None
+        try: os.remove(self.path)
+        except FileNotFoundError: pass
+
+    def peers(self) -> list[str]:
+        # 目录列表缓存一秒，worker 增减时最多晚一秒生效
+        if time.monotonic() - self._peers_at > 1.0:
+            self._peers = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith(".sock")]
+            self._peers_at = time.monotonic()
+        return [p for p in self._peers if p != self.path]
+
+    async def publish(self, data: bytes):
+        for peer in self.peers():
+            try: self.sock.sendto(data, peer)
+            except (BlockingIOError, InterruptedError): dropped.inc("transport")  # 对方接收缓冲区满了
+            except (ConnectionRefusedError, FileNotFoundError):
+                try: os.remove(peer)
+                except FileNotFoundError: pass
+                self._peers_at = 0.0
+
+class RedisTransport:
+    def __init__(self, url: str = REDIS_URL, channel: str = EVENT_CHANNEL):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.channel = channel
+        self.task = None
+
+    async def start(self, deliver):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        async def listen():
+            async for message in pubsub.listen():
+                if message["type"] == "message": deliver(message["data"])
+        self.task = asyncio.create_task(listen())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.client.aclose()
+
+    async def publish(self, data: bytes):
+        await self.client.publish(self.channel, data)
+
+def make_transport(name: str = EVENT_TRANSPORT):
+    transports = {"local": LocalTransport, "unix": UnixTransport, "redis": RedisTransport}
+    if name not in transports: raise ValueError(f"EVENT_TRANSPORT 只能是 {', '.join(transports)}")
+    return transports[name]()
+
+class EventBus:
+    """
+    替代原来的 ConnectionManager，send_log(message, client_id) 的用法不变。
+    客户端连在本进程时直接入队；不在本进程时交给跨进程通道，由持有连接的进程入队。
+    """
+    def __init__(self, transport=None):
+        self.connections: dict[str, set[Connection]] = {}
+        self.transport = transport or make_transport()
+        self.origin = uuid.uuid4().hex  # 区分自己发出的消息 (Redis 会把消息也发回给发布者)
+        self._heartbeat: asyncio.Task = None
+        _buses.add(self)
+
+    async def start(self):
+        await self.transport.start(self._receive)
+        if self._heartbeat is None: self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        for conns in list(self.connections.values()):
+            for conn in list(conns): self.disconnect(conn)
+        await self.transport.stop()
+
+    async def connect(self, websocket, client_id: str) -> Connection:
+        await websocket.accept()
+        conn = Connection(websocket, client_id)
+        self.connections.setdefault(client_id, set()).add(conn)
+        conn.task = asyncio.create_task(conn.run(self.disconnect))
+        return conn
+
+    def disconnect(self, conn: Connection):
+        if conn.closed: return
+        conn.closed = True
+        conns = self.connections.get(conn.client_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns: del self.connections[conn.client_id]
+        if conn.task is not None and conn.task is not asyncio.current_task(): conn.task.cancel()
+
+    def _deliver(self, client_id: str, message: str, key: str = None):
+        for conn in list(self.connections.get(client_id, ())): conn.put(message, key)
+
+    def _receive(self, data: bytes):
+        try: origin, client_id, message, key = json.loads(data)
+        except (ValueError, TypeError): return
+        if origin != self.origin: self._deliver(client_id, message, key)
+
+    async def send_log(self, message: str, client_id: str, key: str = None):
+        """只入队不等发送；key 相同的待发消息会被替换 (用于任务状态这类只关心最新值的消息)"""
+        if client_id in self.connections:
+            self._deliver(client_id, message, key)
+        else:
+            await self.transport.publish(json.dumps([self.origin, client_id, message, key], ensure_ascii=False).encode("utf-8"))
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(EVENT_HEARTBEAT)
+            for conns in list(self.connections.values()):
+                for conn in list(conns): conn.put(HEARTBEAT, HEARTBEAT_KEY)
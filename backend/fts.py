@@ -0,0 +1,86 @@
+# backend/fts.py
+# SQLite FTS5 全文索引：替代 search_images 里的四个 LIKE '%q%' 全表扫描
+# 中文没有空格分词，入库前把每个汉字拆成单独的词元，查询时用短语匹配相邻汉字，
+# 效果等价于子串匹配，但走的是倒排索引；英文标签按单词切分，最后一个词支持前缀匹配。
+import re
+from types import SimpleNamespace
+from sqlalchemy import event, text
+
+import models
+
+FTS_TABLE = "images_fts"
+CONTENT_COLUMNS = ("description", "ai_tags", "location", "filename")
+# bm25 权重，顺序同建表列：owner 不参与打分，标签/地点比描述更能代表图片
+BM25_WEIGHTS = "0.0, 1.0, 2.0, 2.0, 0.5"
+
+_CJK = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])")  # 假名、汉字、谚文
+_WORD = re.compile(r"\w")
+
+enabled = False  # init_fts 成功后置为 True；非 SQLite 或不支持 FTS5 时退回 LIKE 查询
+
+def segment(value) -> str:
+    """汉字两侧补空格，交给 unicode61 分词器按单字切分"""
+    return _CJK.sub(r" \1 ", value or "")
+
+def build_match_query(user_id: int, query_str: str):
+    """把搜索框输入转成 FTS5 查询；没有有效词时返回 None"""
+    phrases = []
+    for word in query_str.split():
+        tokens = segment(word.replace('"', " ")).split()
+        if tokens and any(_WORD.search(t) for t in tokens):
+            phrases.append('"' + " ".join(tokens) + '"')
+    if not phrases: return None
+    phrases[-1] += "*"  # 边输入边搜索：最后一个词按前缀匹配
+    return f"owner : u{user_id} AND {{{' '.join(CONTENT_COLUMNS)}}} : ({' '.join(phrases)})"
+
+def _row_params(image):
+    params = {"id": image.id, "owner": f"u{image.user_id}"}
+    for col in CONTENT_COLUMNS: params[col] = segment(getattr(image, col))
+    return params
+
+_INSERT = text(f"INSERT INTO {FTS_TABLE}(rowid, owner, {', '.join(CONTENT_COLUMNS)}) VALUES (:id, :owner, {', '.join(':' + c for c in CONTENT_COLUMNS)})")
+_DELETE = text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id")
+
+def init_fts(engine):
+    """建索引表，行数对不上时从 images 表整体重建 (首次启用或历史数据)"""
+    global enabled
+    if engine.dialect.name != "sqlite": return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(owner, {', '.join(CONTENT_COLUMNS)}, tokenize='unicode61 remove_diacritics 2')"))
+            indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+            total = conn.execute(text("SELECT count(*) FROM images")).scalar()
+            if indexed != total:
+                print(f"🔎 重建全文索引 ({indexed} -> {total})...")
+                conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+                rows = conn.execute(text(f"SELECT id, user_id, {', '.join(CONTENT_COLUMNS)} FROM images"))
+                for row in rows.mappings():
+                    conn.execute(_INSERT, _row_params(SimpleNamespace(**row)))
+        enabled = True
+    except Exception as e:
+        print(f"全文索引不可用，退回 LIKE 查询: {e}")
+
+# --- 与 models.Image 的增删改保持同步 (同一事务内完成) ---
+@event.listens_for(models.Image, "after_insert")
+def _after_insert(mapper, connection, target):
+    if enabled: connection.execute(_INSERT, _row_params(target))
+
+@event.listens_for(models.Image, "after_update")
+def _after_update(mapper, connection, target):
+    if enabled:
+        connection.execute(_DELETE, {"id": target.id})
+        connection.execute(_INSERT, _row_params(target))
+
+@event.listens_for(models.Image, "after_delete")
+def _after_delete(mapper, connection, target):
+    if enabled: connection.execute(_DELETE, {"id": target.id})
+
+def search_ids(connection, user_id: int, query_str: str, skip: int, limit: int):
+    """按 BM25 排序返回命中的图片 id"""
+    match = build_match_query(user_id, query_str)
+    if match is None: return []
+    rows = connection.execute(
+        text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q ORDER BY bm25({FTS_TABLE}, {BM25_WEIGHTS}) LIMIT :limit OFFSET :skip"),
+        {"q": match, "limit": limit, "skip": skip},
+    )
+    return [r[0] for r in rows]
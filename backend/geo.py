@@ -0,0 +1,136 @@
+# backend/geo.py
+# 地图和时间线：都在数据库里聚合，只把结果传给前端。
+#   images.latitude/longitude  EXIF GPS 坐标 (location 字段可能被描述里的地名覆盖，不能拿来查询)
+#   images.gx/gy               Web 墨卡托投影到第 GRID_ZOOM 级的像素坐标，(user_id, gx, gy) 索引；
+#                              第 z 级的瓦片号就是 gx >> (GRID_ZOOM - z)，瓦片内聚类直接 GROUP BY 右移后的坐标
+#   images_geo                 SQLite R*Tree (用户 id 作为第三维)，框选查询用；非 SQLite 时退回 gx/gy 索引
+# gx/gy 和 R*Tree 都随 models.Image 的增删改由映射事件同步 (同 fts.py 的做法)。
+import math
+from types import SimpleNamespace
+
+from sqlalchemy import event, func, or_, text, column
+
+import models, database
+
+GRID_ZOOM = 24         # 2^24 像素宽的世界地图，约 2.4 米一个像素，32 位整数放得下
+CLUSTER_BITS = 3       # 每个瓦片再切成 8x8 个格子做聚类
+MAX_LAT = 85.05112878  # Web 墨卡托的纬度范围
+GEO_TABLE = "images_geo"
+TIMELINE_FORMATS = {  # 粒度 -> (SQLite strftime, Postgres to_char)
+    "year": ("%Y", "YYYY"),
+    "month": ("%Y-%m", "YYYY-MM"),
+    "day": ("%Y-%m-%d", "YYYY-MM-DD"),
+}
+
+enabled = False  # init_geo 成功后置为 True，框选走 R*Tree
+
+def project(lat: float, lon: float) -> tuple[int, int]:
+    """经纬度 -> 第 GRID_ZOOM 级的墨卡托像素坐标"""
+    size = 1 << GRID_ZOOM
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - math.log(math.tan(math.radians(lat)) + 1.0 / math.cos(math.radians(lat))) / math.pi) / 2.0
+    return min(size - 1, max(0, int(x * size))), min(size - 1, max(0, int(y * size)))
+
+def _lon_ranges(west: float, east: float):
+    """跨 180° 经线的框拆成两段"""
+    return [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+# --- 与 models.Image 的增删改保持同步 ---
+_INSERT = text(f"INSERT INTO {GEO_TABLE} (id, min_uid, max_uid, min_lat, max_lat, min_lon, max_lon) VALUES (:id, :uid, :uid, :lat, :lat, :lon, :lon)")
+_DELETE = text(f"DELETE FROM {GEO_TABLE} WHERE id = :id")
+
+def _row_params(image):
+    return {"id": image.id, "uid": image.user_id, "lat": image.latitude, "lon": image.longitude}
+
+def init_geo(engine):
+    """建 R*Tree，行数对不上时从 images 表整体重建 (首次启用或历史数据)"""
+    global enabled
+    if engine.dialect.name != "sqlite": return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {GEO_TABLE} USING rtree(id, min_uid, max_uid, min_lat, max_lat, min_lon, max_lon)"))
+            indexed = conn.execute(text(f"SELECT count(*) FROM {GEO_TABLE}")).scalar()
+            total = conn.execute(text("SELECT count(*) FROM images WHERE latitude IS NOT NULL AND longitude IS NOT NULL")).scalar()
+            if indexed != total:
+                print(f"🗺️ 重建地理索引 ({indexed} -> {total})...")
+                conn.execute(text(f"DELETE FROM {GEO_TABLE}"))
+                rows = conn.execute(text("SELECT id, user_id, latitude, longitude FROM images WHERE latitude IS NOT NULL AND longitude IS NOT NULL"))
+                params = [_row_params(SimpleNamespace(**row)) for row in rows.mappings()]
+                if params: conn.execute(_INSERT, params)
+        enabled = True
+    except Exception as e:
+        print(f"地理索引不可用，框选改走 gx/gy 索引: {e}")
+
+def _sync_grid(mapper, connection, target):
+    has_coords = target.latitude is not None and target.longitude is not None
+    target.gx, target.gy = project(target.latitude, target.longitude) if has_coords else (None, None)
+
+event.listen(models.Image, "before_insert", _sync_grid)
+event.listen(models.Image, "before_update", _sync_grid)
+
+@event.listens_for(models.Image, "after_insert")
+def _after_insert(mapper, connection, target):
+    if enabled and target.latitude is not None and target.longitude is not None: connection.execute(_INSERT, _row_params(target))
+
+@event.listens_for(models.Image, "after_update")
+def _after_update(mapper, connection, target):
+    if enabled:
+        connection.execute(_DELETE, {"id": target.id})
+        if target.latitude is not None and target.longitude is not None: connection.execute(_INSERT, _row_params(target))
+
+@event.listens_for(models.Image, "after_delete")
+def _after_delete(mapper, connection, target):
+    if enabled: connection.execute(_DELETE, {"id": target.id})
+
+# --- 查询 ---
+def images_in_bbox(db, user_id: int, south: float, west: float, north: float, east: float, limit: int = 500):
+    """框内有 GPS 坐标的图片，新的在前"""
+    query = db.query(models.Image).filter(models.Image.user_id == user_id, models.Image.latitude.between(south, north))
+    lon_filter = or_(*[models.Image.longitude.between(w, e) for w, e in _lon_ranges(west, east)])
+    if enabled:
+        # R*Tree 里存的是 float32，边界上可能多出一点，上面按原始坐标再精确过滤一次
+        boxes = " UNION ALL ".join(
+            f"SELECT id FROM {GEO_TABLE} WHERE min_uid <= :uid AND max_uid >= :uid AND max_lat >= :s AND min_lat <= :n AND max_lon >= :w{i} AND min_lon <= :e{i}"
+            for i in range(len(_lon_ranges(west, east)))
+        )
+        params = {"uid": user_id, "s": south, "n": north}
+        for i, (w, e) in enumerate(_lon_ranges(west, east)): params.update({f"w{i}": w, f"e{i}": e})
+        query = query.filter(models.Image.id.in_(text(boxes).bindparams(**params).columns(column("id"))))
+    else:
+        x_ranges = []
+        for w, e in _lon_ranges(west, east): x_ranges.append(models.Image.gx.between(project(0, w)[0], project(0, e)[0]))
+        query = query.filter(or_(*x_ranges))
+    return query.filter(lon_filter).order_by(models.Image.id.desc()).limit(limit).all()
+
+def tile_clusters(db, user_id: int, z: int, x: int, y: int):
+    """
+    第 z 级 (x, y) 瓦片内的聚类：瓦片切成 2^CLUSTER_BITS 见方的格子，每格一个点，
+    返回 [{"count", "latitude", "longitude", "image_id", "thumbnail"}]，坐标是格内图片的平均位置，image_id 是格内最新的一张。
+    """
+    shift = GRID_ZOOM - z
+    cell_shift = max(0, shift - CLUSTER_BITS)
+    cx, cy = models.Image.gx.op(">>")(cell_shift), models.Image.gy.op(">>")(cell_shift)
+    rows = db.query(
+        cx.label("cx"), cy.label("cy"), func.count().label("count"),
+        func.avg(models.Image.latitude).label("latitude"), func.avg(models.Image.longitude).label("longitude"), func.max(models.Image.id).label("image_id"),
+    ).filter(
+        models.Image.user_id == user_id,
+        models.Image.gx.between(x << shift, ((x + 1) << shift) - 1),
+        models.Image.gy.between(y << shift, ((y + 1) << shift) - 1),
+    ).group_by(cx, cy).all()
+    if not rows: return []
+    thumbs = dict(db.query(models.Image.id, models.Image.thumbnail).filter(models.Image.id.in_([r.image_id for r in rows])))
+    return [
+        {"count": r.count, "latitude": r.latitude, "longitude": r.longitude, "image_id": r.image_id, "thumbnail": thumbs.get(r.image_id)}
+        for r in sorted(rows, key=lambda r: -r.count)
+    ]
+
+def timeline(db, user_id: int, granularity: str = "month", start=None, end=None):
+    """按拍摄时间分桶计数，走 (user_id, capture_date) 索引；没有拍摄时间的图片不计入"""
+    sqlite_format, pg_format = TIMELINE_FORMATS[granularity]
+    period = func.strftime(sqlite_format, models.Image.capture_date) if database.IS_SQLITE else func.to_char(models.Image.capture_date, pg_format)
+    query = db.query(period.label("period"), func.count().label("count")).filter(models.Image.user_id == user_id, models.Image.capture_date.isnot(None))
+    if start is not None: query = query.filter(models.Image.capture_date >= start)
+    if end is not None: query = query.filter(models.Image.capture_date < end)
+    return [{"period": p, "count": c} for p, c in query.group_by(period).order_by(period)]
@@ -0,0 +1,241 @@
+# backend/imaging.py
+# 图片处理：EXIF 解析 + 多尺寸/多格式衍生图 (一次解码生成全部尺寸，AVIF 这类慢格式按需生成) + 感知哈希
+import os
+import math
+import time
+import uuid
+from datetime import datetime
+from PIL import Image as PILImage, ImageOps
+
+# 配置：衍生图边长 (最长边)、输出格式 (按浏览器偏好顺序)、目录
+DERIVATIVE_SIZES = sorted({int(s) for s in os.getenv("DERIVATIVE_SIZES", "150,300,1024,2048").split(",")})
+DERIVATIVE_FORMATS = [f.strip().lower() for f in os.getenv("DERIVATIVE_FORMATS", "webp,jpeg").split(",")]
+# 延迟生成的格式：上传时不编码，第一次有浏览器要这种格式、这个尺寸时再从原图编码 (AVIF 编码比 WebP+JPEG 加起来还慢几倍)。
+# 设为空则不提供；想上传时就全部生成，把它挪到 DERIVATIVE_FORMATS 里
+LAZY_DERIVATIVE_FORMATS = [f.strip().lower() for f in os.getenv("LAZY_DERIVATIVE_FORMATS", "avif").split(",") if f.strip()]
+VARIANT_DIR = "static/variants"
+THUMB_SIZE = 300  # 兼容旧的 static/thumbnails 缩略图
+# 给模型用的内存预览图：短边缩到 DETR 预处理的目标尺寸，ViT/CLIP 会在此基础上再缩到 224
+MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE", "800"))
+
+# 格式 -> (Pillow 格式名, 扩展名, MIME, 保存参数)
+FORMAT_INFO = {
+    "avif": ("AVIF", "avif", "image/avif", {"quality": 60, "speed": 8}),
+    "webp": ("WEBP", "webp", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "jpg", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+PILImage.init()
+# 当前 Pillow 编不出来的格式 (如缺 libavif) 直接跳过，jpeg 始终保留作为兜底
+SUPPORTED_FORMATS = [f for f in DERIVATIVE_FORMATS if f in FORMAT_INFO and FORMAT_INFO[f][0] in PILImage.SAVE]
+if "jpeg" not in SUPPORTED_FORMATS: SUPPORTED_FORMATS.append("jpeg")
+LAZY_FORMATS = [f for f in LAZY_DERIVATIVE_FORMATS if f in FORMAT_INFO and FORMAT_INFO[f][0] in PILImage.SAVE and f not in SUPPORTED_FORMATS]
+
+os.makedirs(VARIANT_DIR, exist_ok=True)
+
+def _convert_to_degrees(value):
+    d = float(value[0]); m = float(value[1]); s = float(value[2])
+    return d + (m / 60.0) + (s / 3600.0)
+
+def get_gps_coordinates(exif_data):
+    """EXIF GPS -> (纬度, 经度)，没有或无效时返回 None"""
+    if not exif_data: return None
+    gps_info = exif_data.get(34853)
+    if not gps_info: return None
+    try:
+        lat_ref = gps_info.get(1); lat_dms = gps_info.get(2)
+        lon_ref = gps_info.get(3); lon_dms = gps_info.get(4)
+        if lat_dms and lon_dms and lat_ref and lon_ref:
+            lat = _convert_to_degrees(lat_dms); lon = _convert_to_degrees(lon_dms)
+            if lat_ref == "S": lat = -lat
+            if lon_ref == "W": lon = -lon
+            if -90 <= lat <= 90 and -180 <= lon <= 180: return lat, lon
+    except Exception: pass
+    return None
+
+def variant_path(name: str) -> str:
+    return os.path.join(VARIANT_DIR, name)
+
+def _decode_for_derivatives(img, target: int = None, min_short: int = 0):
+    """
+    按需要的最大尺寸解码：JPEG 用 draft() 让解码器直接按 1/2、1/4、1/8 缩放输出，
+    再按 EXIF 方向摆正 (衍生图不带 EXIF，浏览器没法替我们旋转)。
+    衍生图限制的是最长边，draft 要求两条边都不小于给定框，所以框按原图比例从最长边算；
+    min_short 是短边至少要保留的像素 (模型预览图用)。
+    """
+    target = target or max(DERIVATIVE_SIZES)
+    scale = min(1.0, max(target / max(img.size), min_short / min(img.size)))
+    img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"): img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    return img
+
+def make_derivatives(img, stem: str, thumb_path: str = None) -> dict:
+    """
+    从大到小逐级缩放 (thumbnail 内部用 reduce() 先做整数倍快速缩小)，
+    每一级从上一级结果继续缩，而不是每次都从原图开始。
+    比原图还大的尺寸不生成。返回 {"300": {"webp": "xxx_300.webp", ...}, ...}
+    """
+    variants = {}
+    current = img
+    for size in sorted(DERIVATIVE_SIZES, reverse=True):
+        if size >= max(img.size) and size != DERIVATIVE_SIZES[0]: continue
+        current = current.copy()
+        current.thumbnail((size, size), PILImage.LANCZOS, reducing_gap=2.0)
+        variants[str(size)] = {}
+        for fmt in SUPPORTED_FORMATS:
+            pil_format, ext, _, params = FORMAT_INFO[fmt]
+            out = current.convert("RGB") if pil_format == "JPEG" and current.mode != "RGB" else current
+            name = f"{stem}_{size}.{ext}"
+            os.makedirs(os.path.dirname(variant_path(name)), exist_ok=True)
+            out.save(variant_path(name), pil_format, **params)
+            variants[str(size)][fmt] = name
+        if thumb_path and size == THUMB_SIZE:
+            save_thumbnail(current, thumb_path)
+    if thumb_path and str(THUMB_SIZE) not in variants:
+        thumb = img.copy(); thumb.thumbnail((THUMB_SIZE, THUMB_SIZE)); save_thumbnail(thumb, thumb_path)
+    return variants
+
+def _lazy_name(formats: dict, fmt: str) -> str:
+    """同一尺寸的延迟格式文件名：和已生成的衍生图同名，只换扩展名"""
+    return f"{os.path.splitext(next(iter(formats.values())))[0]}.{FORMAT_INFO[fmt][1]}"
+
+def is_lazy(name: str) -> bool:
+    return any(name.endswith("." + FORMAT_INFO[fmt][1]) for fmt in LAZY_FORMATS)
+
+def ensure_variant(file_path: str, name: str):
+    """
+    延迟格式的衍生图不存在时从原图编码出来 (尺寸取自文件名里的 _<size>)。
+    先写临时文件再改名：并发请求同一张图最多重复编码一次，不会读到写了一半的文件。原图不在本地时抛 FileNotFoundError
+    """
+    path = variant_path(name)
+    if os.path.exists(path): return
+    stem, ext = os.path.splitext(name)
+    size = int(stem.rsplit("_", 1)[1])
+    pil_format, _, _, params = next(FORMAT_INFO[f] for f in LAZY_FORMATS if FORMAT_INFO[f][1] == ext[1:])
+    with PILImage.open(file_path) as img:
+        decoded = _decode_for_derivatives(img, size)
+        decoded.thumbnail((size, size), PILImage.LANCZOS, reducing_gap=2.0)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            decoded.save(tmp, pil_format, **params)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+
+def make_preview(img):
+    """短边缩到 MODEL_INPUT_SIZE 的 RGB 图 (原图更小时不放大)，模型直接拿它推理，不再各自读盘解码原图"""
+    scale = MODEL_INPUT_SIZE / min(img.size)
+    preview = img if scale >= 1 else img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), PILImage.BILINEAR, reducing_gap=2.0)
+    return preview.convert("RGB") if preview.mode != "RGB" else preview.copy()
+
+def dhash(img) -> str:
+    """
+    差值哈希 (dHash)：缩成 9x8 灰度，每行相邻像素比较亮暗得到 64 位，返回 16 位十六进制。
+    缩放、重新压缩、轻微调色后汉明距离很小，用来找连拍/编辑副本这类近似重复。
+    """
+    small = img.resize((9, 8), PILImage.BILINEAR, reducing_gap=2.0).convert("L").tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (small[row * 9 + col] > small[row * 9 + col + 1])
+    return f"{value:016x}"
+
+def compute_dhash(file_path):
+    """给老图片补算哈希：按小尺寸解码，不生成任何文件"""
+    with PILImage.open(file_path) as img:
+        img.draft("RGB", (64, 64))
+        return dhash(ImageOps.exif_transpose(img))
+
+def save_thumbnail(img, thumb_path: str):
+    """旧版缩略图：沿用原图扩展名"""
+    if thumb_path.lower().endswith((".jpg", ".jpeg")) and img.mode != "RGB": img = img.convert("RGB")
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    img.save(thumb_path)
+
+def remove_derivatives(variants: dict):
+    for formats in (variants or {}).values():
+        for name in list(formats.values()) + [_lazy_name(formats, fmt) for fmt in LAZY_FORMATS if formats]:
+            try: os.remove(variant_path(name))
+            except FileNotFoundError: pass
+
+def _read_metadata(img, info: dict):
+    width, height = img.size
+    info["resolution"] = f"{width}x{height}"
+    exif_raw = img._getexif() if hasattr(img, "_getexif") else None
+    if exif_raw:
+        date_str = exif_raw.get(36867)
+        if date_str:
+            try: info["date"] = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
+            except ValueError: pass
+        coords = get_gps_coordinates(exif_raw)
+        if coords:
+            info["latitude"], info["longitude"] = coords
+            info["location"] = f"{coords[0]:.4f}, {coords[1]:.4f}"
+
+# PIL 识别出的格式 → 原图存储用的扩展名
+ORIGINAL_EXTS = {"JPEG": "jpg", "MPO": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif", "BMP": "bmp", "TIFF": "tif", "HEIF": "heic", "AVIF": "avif"}
+
+def sniff_ext(file_path):
+    """按文件内容 (只读文件头) 判断图片格式，返回扩展名；认不出时返回 None"""
+    try:
+        with PILImage.open(file_path) as img: return ORIGINAL_EXTS.get(img.format)
+    except Exception: return None
+
+def read_metadata(file_path):
+    """只读文件头里的分辨率和 EXIF，不解码像素"""
+    info = {"resolution": "Unknown", "date": None, "location": "Unknown", "latitude": None, "longitude": None, "timings": {}}
+    try:
+        started = time.perf_counter()
+        with PILImage.open(file_path) as img: _read_metadata(img, info)
+        info["timings"]["exif"] = time.perf_counter() - started
+    except Exception as e: print(f"Error: {e}")
+    return info
+
+def process_image(file_path, thumb_path, stem: str = None, preview: bool = False, on_preview=None):
+    """
+    读 EXIF (分辨率/拍摄时间/GPS 坐标)，同一次解码生成缩略图、全部衍生图和感知哈希 (info["phash"])。
+    preview=True 时顺带返回给模型用的预览图 (info["preview"]，解码失败时为 None)。
+    on_preview(预览图, 感知哈希) 在预览图做好、开始编码衍生图之前调用 (在当前线程里)，调用方可以先把预览图交给模型。
+    各步骤耗时放在 info["timings"] (秒)，由调用方计入 metrics —— 这里可能跑在进程池里，没法直接记。
+    """
+    info = {"resolution": "Unknown", "date": None, "location": "Unknown", "latitude": None, "longitude": None, "variants": {}, "phash": None, "timings": {}}
+    if preview: info["preview"] = None
+    stem = stem or os.path.splitext(os.path.basename(file_path))[0]
+    timings = info["timings"]
+    try:
+        started = time.perf_counter()
+        with PILImage.open(file_path) as img:
+            _read_metadata(img, info)
+            timings["exif"] = time.perf_counter() - started; started = time.perf_counter()
+            decoded = _decode_for_derivatives(img, min_short=MODEL_INPUT_SIZE if preview else 0)
+            decode_seconds = time.perf_counter() - started; started = time.perf_counter()
+            # 预览图和哈希只要几十毫秒，先做出来；衍生图编码是大头，放在最后
+            info["phash"] = dhash(decoded)
+            if preview: info["preview"] = make_preview(decoded)
+            timings["preview"] = time.perf_counter() - started
+            if preview and on_preview: on_preview(info["preview"], info["phash"])
+            started = time.perf_counter()
+            info["variants"] = make_derivatives(decoded, stem, thumb_path)
+            timings["thumbnail"] = decode_seconds + time.perf_counter() - started
+    except Exception as e: print(f"Error: {e}")
+    return info
+
+def pick_variant(variants: dict, width: int = None, accept: str = "", lazy: bool = True):
+    """
+    按请求宽度选不小于它的最小尺寸 (没有就取最大的)，按 Accept 头选浏览器支持的最优格式。
+    浏览器接受延迟格式时优先返回它 (lazy=False 时不考虑)，文件可能还没生成，调用方用 ensure_variant 补上。
+    返回 (文件名, MIME)，没有可用衍生图时返回 (None, None)。
+    """
+    if not variants: return None, None
+    sizes = sorted(int(s) for s in variants)
+    size = next((s for s in sizes if width and s >= width), sizes[-1])
+    formats = variants[str(size)]
+    if lazy and formats:
+        for fmt in LAZY_FORMATS:
+            if FORMAT_INFO[fmt][2] in accept: return _lazy_name(formats, fmt), FORMAT_INFO[fmt][2]
+    for fmt in SUPPORTED_FORMATS:
+        if fmt in formats and (fmt == "jpeg" or FORMAT_INFO[fmt][2] in accept):
+            return formats[fmt], FORMAT_INFO[fmt][2]
+    fmt = next(iter(formats))
+    return formats[fmt], FORMAT_INFO[fmt][2]
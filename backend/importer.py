@@ -0,0 +1,202 @@
+# backend/importer.py
+# 批量导入：多文件上传 / 服务器目录 / zip 包
+# 按块处理：EXIF+衍生图走进程池并行 (顺带产出模型用的预览图和感知哈希) → 视觉模型整块一起提交 (自动攒批，近似重复只识别一张) → 一个事务批量入库 → 语义向量
+import os
+import json
+import asyncio
+import zipfile
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import ai, crud, database, imaging, metrics, similar, storage, uploads, vectors
+
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "64"))                          # 每块多少张，一块一个入库事务
+IMPORT_PROCESSES = int(os.getenv("IMPORT_PROCESSES", str(os.cpu_count() or 2)))
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "1"))               # 同时进行的导入任务数
+IMPORT_ROOT = os.getenv("IMPORT_ROOT", "imports")                             # 管理员只能导入这个目录下的文件
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff", ".heic", ".avif"}
+
+def is_image_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTS
+
+def resolve_import_path(path: str) -> str:
+    """限制在 IMPORT_ROOT 之内，防止借导入读取服务器任意文件"""
+    root = os.path.realpath(IMPORT_ROOT)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root or not os.path.exists(full): raise FileNotFoundError(path)
+    return full
+
+def collect_sources(full_path: str) -> list[dict]:
+    """目录或 zip 包里的图片清单，文件内容推迟到处理该块时再读取"""
+    if os.path.isdir(full_path):
+        sources = []
+        for dirpath, _, names in os.walk(full_path):
+            for name in sorted(names):
+                if is_image_name(name):
+                    path = os.path.join(dirpath, name)
+                    sources.append({"name": os.path.relpath(path, full_path), "path": path})
+        return sources
+    if zipfile.is_zipfile(full_path):
+        with zipfile.ZipFile(full_path) as zf:
+            return [{"name": i.filename, "zip": full_path} for i in zf.infolist() if not i.is_dir() and is_image_name(i.filename)]
+    raise ValueError("只支持目录或 zip 包")
+
+def _save_source(source: dict):
+    tmp = storage.temp_path()
+    with metrics.timed("save"):
+        if "zip" in source:
+            with zipfile.ZipFile(source["zip"]) as zf, zf.open(source["name"]) as f:
+                content_hash = uploads.save_stream(f, tmp)
+        else:
+            with open(source["path"], "rb") as f:
+                content_hash = uploads.save_stream(f, tmp)
+        return storage.place(tmp, content_hash, source["name"]), content_hash
+
+def _insert_rows(user_id: int, rows: list[dict]):
+    db = database.SessionLocal()
+    try: return crud.create_user_images_bulk(db, user_id, rows)
+    finally: db.close()
+
+class BatchImporter:
+    """
+    items: 已存入内容寻址目录的 {"name", "stored_name", "content_hash"}，或 collect_sources 给出的待读取来源
+    进度按文件推送到 notify(message, client_id)，结果汇总在 job["report"]；
+    任务状态每次变化后 await track(job) (写库，别的 worker 的 /jobs 也能查到)。
+    """
+    def __init__(self, vision_worker, embed_worker, text_worker, notify, track):
+        self.vision_worker = vision_worker
+        self.embed_worker = embed_worker
+        self.text_worker = text_worker
+        self.notify = notify
+        self.track = track
+        self._pool = None
+        self._semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        self._tasks = set()
+
+    @property
+    def pool(self):
+        # spawn 方式启动子进程：不继承主进程里的线程和模型，子进程只加载 imaging
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(IMPORT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def shutdown(self):
+        if self._pool is not None: self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def start(self, job: dict, user_id: int, client_id: str, items: list[dict], description: str = None):
+        job["report"] = {"total": len(items), "succeeded": 0, "failed": []}
+        task = asyncio.create_task(self._run(job, user_id, client_id, items, description))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job, user_id, client_id, items, description):
+        report = job["report"]
+        try:
+            async with self._semaphore:
+                job["status"] = "processing"
+                for start in range(0, len(items), IMPORT_CHUNK):
+                    job["stage"] = f"{start}/{len(items)}"
+                    await self.track(job)
+                    chunk = items[start:start + IMPORT_CHUNK]
+                    try: await self._run_chunk(user_id, client_id, chunk, description, report)
+                    finally:
+                        # 不管块内哪一步出错 (含取消)，没入库的文件都要归还引用
+                        for item in chunk:
+                            item.pop("preview", None)
+                            await self._release(item)
+            job["status"] = "done"; job["stage"] = None
+            await self.track(job)
+            await self.notify(f"✅ 导入完成：成功 {report['succeeded']}，失败 {len(report['failed'])}", client_id)
+        except Exception as e:
+            job["status"] = "failed"; job["error"] = str(e) or e.__class__.__name__
+            await self.track(job)
+            await self.notify(f"❌ 导入中断: {job['error']}", client_id)
+        finally:
+            # 中断后没轮到的块：多文件上传的条目在接口里就已落盘
+            for item in items: await self._release(item)
+
+    def _fail(self, report, item, reason):
+        report["failed"].append({"filename": item["name"], "error": reason})
+
+    async def _release(self, item):
+        """归还落盘时 place() 占的引用，每个条目只还一次；没入库的文件随之删除"""
+        if "stored_name" in item and not item.get("released"):
+            item["released"] = True
+            await asyncio.to_thread(storage.release, item["stored_name"])
+
+    async def _run_chunk(self, user_id, client_id, chunk, description, report):
+        loop = asyncio.get_running_loop()
+        total = report["total"]
+
+        # 1. 落盘 (目录/zip 来源在这里才读取)
+        saved = []
+        for item in chunk:
+            if "stored_name" not in item:
+                try: item["stored_name"], item["content_hash"] = await asyncio.to_thread(_save_source, item)
+                except Exception as e: self._fail(report, item, f"读取失败: {e}"); continue
+            saved.append(item)
+
+        # 2. EXIF + 缩略图 + 衍生图：进程池并行
+        infos = await asyncio.gather(*[
+            loop.run_in_executor(self.pool, functools.partial(
+                imaging.process_image, storage.original_path(i["stored_name"]), storage.thumbnail_path(i["stored_name"]), storage.variant_stem(i["stored_name"]), preview=True))
+            for i in saved
+        ], return_exceptions=True)
+        ok = []
+        for item, info in zip(saved, infos):
+            if isinstance(info, Exception) or info["resolution"] == "Unknown":
+                self._fail(report, item, "无法解析图片"); await self._release(item)
+                await self.notify(f"❌ {item['name']}: 无法解析图片", client_id)
+            else:
+                metrics.record_timings(info.pop("timings"))
+                item["preview"] = info.pop("preview"); item["info"] = info; ok.append(item)
+        if not ok: return
+
+        # 3. 视觉标签：先查内容哈希的结果缓存；再看图库里已有的近似重复 (开启复用时)；块内的近似重复 (连拍) 只识别第一张；
+        #    其余整块同时提交，由推理服务按批次合并
+        phashes = [i["info"]["phash"] for i in ok]
+        cached = await asyncio.to_thread(lambda: [ai.image_cache.get(i["content_hash"]) for i in ok])
+        near = await database.run_sync(similar.near_duplicate_labels_many, user_id, [p if c is None else None for p, c in zip(phashes, cached)])
+        known = [c if c is not None else n for c, n in zip(cached, near)]
+        lead = similar.leaders(phashes)
+        run = [k for k in range(len(ok)) if lead[k] == k and known[k] is None]
+        results = dict(zip(run, await asyncio.gather(*[self.vision_worker.submit((ok[k]["preview"] or storage.original_path(ok[k]["stored_name"]), ok[k]["content_hash"])) for k in run])))
+        labels = [known[k] if known[k] is not None else known[lead[k]] if known[lead[k]] is not None else results[lead[k]] for k in range(len(ok))]
+
+        # 4. 文本分析：同一批导入共用一段描述，只分析一次 (和同时在处理的上传合批)
+        text_info = await self.text_worker.submit(description) if description else {}
+
+        # 5. 一个事务批量入库
+        rows = []
+        for item, item_labels in zip(ok, labels):
+            info = item["info"]
+            location = info["location"] if info["location"] != "Unknown" else (text_info.get("location") or "Unknown")
+            rows.append({
+                "filename": item["stored_name"], "thumbnail": item["stored_name"], "content_hash": item["content_hash"], "description": description,
+                "resolution": info["resolution"], "capture_date": info["date"] or text_info.get("date"), "location": location,
+                "latitude": info["latitude"], "longitude": info["longitude"],
+                "variants": json.dumps(info["variants"]), "phash": info["phash"], "ai_tags": ai.format_tags(item_labels), "labels": item_labels,
+            })
+        try:
+            image_ids = await asyncio.to_thread(_insert_rows, user_id, rows)
+        except Exception as e:
+            for item in ok:
+                self._fail(report, item, f"入库失败: {e}"); await self._release(item)
+                item.pop("preview", None)
+            return
+        for item in ok:
+            # 已入库：归还 place() 占的引用之后再同步到远端
+            await self._release(item)
+            await asyncio.to_thread(storage.publish, item["stored_name"])
+        for item, item_labels in zip(ok, labels):
+            report["succeeded"] += 1
+            await self.notify(f"[{report['succeeded']}/{total}] ✅ {item['name']} 🤖 {ai.format_tags(item_labels)}", client_id)
+
+        # 6. 语义向量
+        vecs = await asyncio.gather(*[self.embed_worker.submit(i.pop("preview") or storage.original_path(i["stored_name"])) for i in ok])
+        for image_id, vector in zip(image_ids, vecs):
+            if vector is not None: await asyncio.to_thread(vectors.add, user_id, image_id, vector)
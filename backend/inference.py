@@ -0,0 +1,80 @@
+# backend/inference.py
+# 进程内批量推理服务：把并发到达的请求攒成小批次，模型对整批只跑一次
+import os
+import asyncio
+import time
+
+import metrics
+
+# 配置：单批最大张数、凑批最长等待时间 (毫秒)
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "8"))
+AI_BATCH_WAIT_MS = int(os.getenv("AI_BATCH_WAIT_MS", "50"))
+
+batch_sizes = metrics.Histogram("photo_inference_batch_size", "每次推理实际凑到的批大小", "worker", buckets=(1, 2, 4, 8, 16, 32, 64))
+
+class BatchInferenceWorker:
+    """
+    batch_fn 接收一个输入列表，返回等长的结果列表 (在线程里执行)。
+    每个 submit() 拿到一个 future，整批跑完后逐个 resolve。
+    同一时刻只有一个批次在推理，避免多个线程抢同一个模型。
+    """
+    def __init__(self, batch_fn, max_batch_size: int = AI_BATCH_SIZE, max_wait_ms: int = AI_BATCH_WAIT_MS, name: str = "batch"):
+        self.batch_fn = batch_fn
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self.queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+    def start(self):
+        if self._task is None:
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        # 还在排队的请求直接取消，避免调用方永远等下去
+        while self.queue is not None and not self.queue.empty():
+            _, fut = self.queue.get_nowait()
+            if not fut.done(): fut.cancel()
+
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def submit(self, item):
+        """提交一个输入，等待它所在批次的结果"""
+        if self._task is None: self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        # 先阻塞等第一个请求，再在截止时间内尽量凑满一批
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            try: batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError: break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # 等待期间已被取消的请求 (如客户端断开) 不再占用推理
+            batch = [(item, fut) for item, fut in batch if not fut.done()]
+            if not batch: continue
+            batch_sizes.observe(self.name, len(batch))
+            try:
+                results = await asyncio.to_thread(self.batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                if not fut.done(): fut.set_result(result)
@@ -0,0 +1,37 @@
+# backend/locks.py
+# 跨进程文件锁：多个 uvicorn worker 读写同一批文件 (向量库、断点续传的分片) 时用 flock 串行化。
+# 没有 fcntl 的平台 (Windows) 退化为进程内的线程锁，只保证单 worker 部署正确。
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class LockBusy(Exception):
+    """非阻塞加锁时锁已被占用"""
+
+_thread_locks: dict[str, threading.Lock] = {}
+_guard = threading.Lock()
+
+@contextmanager
+def file_lock(path: str, shared: bool = False, blocking: bool = True):
+    """
+    对锁文件 path 加锁 (不存在时创建)；shared=True 为读锁，可与其它读锁共存。
+    blocking=False 时锁被占用直接抛 LockBusy，协程里用这种方式，不会卡住事件循环。
+    """
+    if fcntl is None:
+        with _guard: lock = _thread_locks.setdefault(path, threading.Lock())
+        if not lock.acquire(blocking): raise LockBusy(path)
+        try: yield
+        finally: lock.release()
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try: fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError: raise LockBusy(path) from None
+        yield
+    finally:
+        os.close(fd)  # 关闭即释放锁
@@ -1,59 +1,46 @@
 # backend/main.py
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Request
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from datetime import timedelta, datetime
 from typing import Optional
-from PIL import Image as PILImage
-from jose import JWTError, jwt
+from datetime import datetime, timedelta
 import os
-import uuid
-import shutil
+import json
 import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
-import models, schemas, crud, security, database
+import models, schemas, crud, security, database, fts, geo, vectors, migrations, auth, media, storage, similar, metrics, events
 import ai
+import imaging
+import uploads
+import importer
+from inference import BatchInferenceWorker, AI_BATCH_SIZE
+from pipeline import IngestPipeline, INGEST_JOB_RETENTION_DAYS
 
 # 初始化
-models.Base.metadata.create_all(bind=database.engine)
-os.makedirs("static/originals", exist_ok=True)
-os.makedirs("static/thumbnails", exist_ok=True)
+migrations.run_migrations(database.engine)
+fts.init_fts(database.engine)
+geo.init_geo(database.engine)
 
 app = FastAPI()
 
-# --- 强制给静态资源加 CORS 头 (解决 Canvas 保存报错) ---
-@app.middleware("http")
-async def force_static_cors(request: Request, call_next):
-    response = await call_next(request)
-    if request.url.path.startswith("/static/"):
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, HEAD, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-    return response
-
-# WebSocket Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-
-    async def send_log(self, message: str, client_id: str):
-        if client_id in self.active_connections:
-            try:
-                await self.active_connections[client_id].send_text(message)
-            except Exception:
-                pass 
-
-manager = ConnectionManager()
+# WebSocket 进度推送：每个连接独立的有界发送队列，多 worker 时经跨进程通道转发 (见 events.py)
+manager = events.EventBus()
+
+# 视觉模型批量推理服务：每个请求是 (预览图或图片路径, 内容哈希)
+def analyze_batch(items):
+    return ai.analyze_images([image for image, _ in items], [h for _, h in items])
+
+vision_worker = BatchInferenceWorker(analyze_batch, name="vision")
+# 语义向量同样按批计算
+embed_worker = BatchInferenceWorker(ai.embed_images, name="embed")
+# 描述文本分析：同时到达的多条描述合成一批，NER 只跑一次
+text_worker = BatchInferenceWorker(ai.analyze_texts, name="text")
+SEMANTIC_BACKFILL = os.getenv("SEMANTIC_BACKFILL", "1") == "1"  # 启动时给还没有向量的旧图片补算
+PHASH_BACKFILL = os.getenv("PHASH_BACKFILL", "1") == "1"        # 启动时给还没有感知哈希的旧图片补算
 
 # API 跨域配置
 app.add_middleware(
@@ -62,10 +49,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# 挂载静态目录
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# 挂载静态目录：长期缓存 + ETag + Range，跨域头直接写在文件响应上 (见 media.py)
+app.mount("/static", media.MediaFiles(directory="static"), name="static")
 
 # 依赖
 def get_db():
@@ -77,72 +65,25 @@ def get_db():
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="无法验证凭证",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = crud.get_user_by_username(db, username=username)
-    if user is None:
-        raise credentials_exception
-    return user
-
-# 工具函数
-def _convert_to_degrees(value):
-    d = float(value[0]); m = float(value[1]); s = float(value[2])
-    return d + (m / 60.0) + (s / 3600.0)
-
-def get_gps_location(exif_data):
-    if not exif_data: return None
-    gps_info = exif_data.get(34853)
-    if not gps_info: return None
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        lat_ref = gps_info.get(1); lat_dms = gps_info.get(2)
-        lon_ref = gps_info.get(3); lon_dms = gps_info.get(4)
-        if lat_dms and lon_dms and lat_ref and lon_ref:
-            lat = _convert_to_degrees(lat_dms); lon = _convert_to_degrees(lon_dms)
-            if lat_ref == "S": lat = -lat
-            if lon_ref == "W": lon = -lon
-            return f"{lat:.4f}, {lon:.4f}"
-    except Exception: pass
-    return None
-
-def process_image(file_path, thumb_path):
-    info = {"resolution": "Unknown", "date": None, "location": "Unknown"}
-    try:
-        with PILImage.open(file_path) as img:
-            width, height = img.size
-            info["resolution"] = f"{width}x{height}"
-            exif_raw = img._getexif()
-            if exif_raw:
-                date_str = exif_raw.get(36867) 
-                if date_str:
-                    try: info["date"] = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
-                    except ValueError: pass
-                gps_loc = get_gps_location(exif_raw)
-                if gps_loc: info["location"] = gps_loc
-            img.thumbnail((300, 300))
-            img.save(thumb_path)
-    except Exception as e: print(f"Error: {e}")
-    return info
+        return await auth.authenticate(token)
+    except auth.InvalidToken:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无法验证凭证",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
 # --- 接口定义 ---
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+    conn = await manager.connect(websocket, client_id)
     try:
         while True: await websocket.receive_text()
-    except WebSocketDisconnect: manager.disconnect(client_id)
+    except WebSocketDisconnect: pass
+    finally: manager.disconnect(conn)
 
 @app.post("/register", response_model=schemas.UserResponse)
 def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
@@ -152,70 +93,459 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return crud.create_user(db=db, user=user)
 
 @app.post("/token", response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, form_data.username)
-    if not user or not security.verify_password(form_data.password, user.password_hash):
-        raise HTTPException(status_code=401, detail="Auth Failed")
-    token = security.create_access_token(data={"sub": user.username}, expires_delta=timedelta(minutes=30))
-    return {"access_token": token, "token_type": "bearer"}
-
-@app.post("/upload/", response_model=schemas.ImageResponse)
-async def upload_image(file: UploadFile = File(...), description: str = Form(None), client_id: str = Form(...), current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await database.run_sync(crud.get_user_by_username, form_data.username)
+    if not user: raise HTTPException(status_code=401, detail="Auth Failed")
+    # bcrypt 故意很慢，放到线程里算，登录高峰时不卡住事件循环
+    valid, new_hash = await asyncio.to_thread(security.verify_and_update, form_data.password, user.password_hash)
+    if not valid: raise HTTPException(status_code=401, detail="Auth Failed")
+    if new_hash: await database.run_sync(crud.update_password_hash, user.id, new_hash)
+    return {"access_token": auth.create_token(user), "token_type": "bearer"}
+
+# 退出所有设备：已签发的 token 全部作废
+@app.post("/token/revoke", status_code=204)
+async def revoke_tokens(u: models.User = Depends(get_current_user)):
+    await database.run_sync(crud.bump_token_version, u.id)
+    auth.invalidate(u.id)
+    return Response(status_code=204)
+
+def save_image_fields(image_id: int, fields: dict):
+    db = database.SessionLocal()
+    try: crud.update_image_fields(db, image_id, fields)
+    finally: db.close()
+
+async def save_job(job):
+    await database.run_sync(crud.save_job, job)
+
+def save_image_tags(image_id: int, labels: list, ai_tags: str):
+    db = database.SessionLocal()
+    try: crud.set_ai_tags(db, image_id, labels, ai_tags)
+    finally: db.close()
+
+# --- 后台入库流水线：EXIF/缩略图 → 视觉标签 → 文本分析 ---
+async def stage_exif(job):
+    await manager.send_log("📸 处理图片...", job["client_id"], key=f"status:{job['job_id']}")
+    duplicate = await database.run_sync(crud.get_processed_duplicate, job["stored_name"], job["image_id"])
+    if duplicate:
+        # 同样的内容已经存过并处理过：衍生图是共用的，只需读一下 EXIF
+        info = await asyncio.to_thread(imaging.read_metadata, job["file_path"])
+        info["variants"] = json.loads(duplicate.variants)
+        info["phash"] = duplicate.phash
+    else:
+        loop = asyncio.get_running_loop()
+        def on_preview(preview, phash):
+            # 预览图一出来就去查标签/排队识别，和衍生图编码并行：视觉请求到得早、到得密，攒批窗口里才会有不止一张
+            loop.call_soon_threadsafe(start_label_lookup, job, preview, phash)
+        info = await loop.run_in_executor(imaging_pool, functools.partial(
+            imaging.process_image, job["file_path"], job["thumb_path"], storage.variant_stem(job["stored_name"]), preview=True, on_preview=on_preview))
+        job["preview"] = info["preview"]  # 视觉和向量阶段共用这一份解码结果
+    metrics.record_timings(info.pop("timings"))
+    job["location"] = info["location"]; job["date"] = info["date"]; job["phash"] = info["phash"]
+    await asyncio.to_thread(save_image_fields, job["image_id"], {
+        "resolution": info["resolution"], "capture_date": info["date"], "location": info["location"], "variants": json.dumps(info["variants"]), "phash": info["phash"],
+        "latitude": info["latitude"], "longitude": info["longitude"],
+    })
+    if not duplicate: await asyncio.to_thread(storage.publish, job["stored_name"])
+
+async def lookup_labels(job):
+    # 先查内容哈希的结果缓存 (完全相同的图片)；没有时再看连拍、导出的副本等近似重复 (NEAR_DUPLICATE_DISTANCE > 0 时)，
+    # 直接沿用已识别过的那张的标签，不再跑模型
+    labels = await asyncio.to_thread(ai.image_cache.get, job["content_hash"]) if job["content_hash"] else None
+    if labels is None:
+        labels = await database.run_sync(similar.near_duplicate_labels, job["user_id"], job.get("phash"), exclude_id=job["image_id"])
+        if labels: await manager.send_log("🧠 沿用相似图片的识别结果", job["client_id"])
+    if labels is None:
+        await manager.send_log("🧠 AI 识别中...", job["client_id"], key=f"status:{job['job_id']}")
+        labels = await vision_worker.submit((job.get("preview") or job["file_path"], job["content_hash"]))
+    return labels
+
+def start_label_lookup(job, preview, phash):
+    job["preview"] = preview; job["phash"] = phash
+    job["labels_task"] = asyncio.ensure_future(lookup_labels(job))
+
+async def stage_vision(job):
+    # EXIF 阶段已经提前发起的就等它的结果 (重复内容走不到那一步，在这里查)
+    task = job.pop("labels_task", None)
+    labels = await task if task else await lookup_labels(job)
+    ai_tags = ai.format_tags(labels)
+    await manager.send_log(f"🤖 标签: {ai_tags}", job["client_id"])
+    if labels is not None: await asyncio.to_thread(save_image_tags, job["image_id"], labels, ai_tags)
+
+async def stage_embed(job):
+    preview = job.pop("preview", None)  # 最后一个用到预览图的阶段，用完即释放
+    vector = await embed_worker.submit(preview or job["file_path"])
+    if vector is not None: await asyncio.to_thread(vectors.add, job["user_id"], job["image_id"], vector)
+
+async def stage_text(job):
+    if job["description"]:
+        await manager.send_log("📝 分析文本...", job["client_id"], key=f"status:{job['job_id']}")
+        text_info = await text_worker.submit(job["description"])
+        fields = {}
+        if job["location"] == "Unknown" and text_info.get("location"): fields["location"] = text_info["location"]
+        if job["date"] is None and text_info.get("date"): fields["capture_date"] = text_info["date"]
+        if fields: await asyncio.to_thread(save_image_fields, job["image_id"], fields)
+    await manager.send_log("✅ 完成", job["client_id"])
+
+async def on_job_failed(job):
+    job.pop("preview", None)
+    task = job.pop("labels_task", None)
+    if task: task.cancel()
+    await manager.send_log(f"❌ 处理失败: {job['error']}", job["client_id"])
+
+# EXIF/衍生图阶段是视觉阶段的上游：只有两三个 worker 时图片一张张地流过去，50ms 的攒批窗口里几乎总是只有一张
+INGEST_EXIF_CONCURRENCY = int(os.getenv("INGEST_EXIF_CONCURRENCY", str(AI_BATCH_SIZE)))
+# 解码/生成衍生图用单独的线程池，不占默认线程池：上传落盘、数据库读写都在那里排队，被图片处理占满时上传接口会跟着变慢
+imaging_pool = ThreadPoolExecutor(INGEST_EXIF_CONCURRENCY, thread_name_prefix="imaging")
+INGEST_VISION_CONCURRENCY = int(os.getenv("INGEST_VISION_CONCURRENCY", str(AI_BATCH_SIZE)))  # 并发数 >= 批大小才能攒满一批
+INGEST_TEXT_CONCURRENCY = int(os.getenv("INGEST_TEXT_CONCURRENCY", str(AI_BATCH_SIZE)))
+
+ingest = IngestPipeline([
+    ("exif", stage_exif, INGEST_EXIF_CONCURRENCY),
+    ("vision", stage_vision, INGEST_VISION_CONCURRENCY),
+    ("embed", stage_embed, INGEST_VISION_CONCURRENCY),
+    ("text", stage_text, INGEST_TEXT_CONCURRENCY),
+], on_failed=on_job_failed, on_update=save_job)
+
+async def backfill_vectors():
+    db = database.SessionLocal()
+    try: rows = db.query(models.Image.id, models.Image.user_id, models.Image.filename).all()
+    finally: db.close()
+    missing = [r for r in rows if not vectors.contains(r.user_id, r.id) and os.path.exists(storage.original_path(r.filename))]
+    if not missing: return
+    print(f"🧭 补算语义向量: {len(missing)} 张")
+    async def embed_one(r):
+        vector = await embed_worker.submit(storage.original_path(r.filename))
+        if vector is not None: await asyncio.to_thread(vectors.add, r.user_id, r.id, vector)
+    for start in range(0, len(missing), embed_worker.max_batch_size):
+        await asyncio.gather(*[embed_one(r) for r in missing[start:start + embed_worker.max_batch_size]])
+
+async def backfill_phash():
+    db = database.SessionLocal()
+    try: rows = db.query(models.Image.id, models.Image.filename).filter(models.Image.phash.is_(None)).all()
+    finally: db.close()
+    missing = [r for r in rows if os.path.exists(storage.original_path(r.filename))]
+    if not missing: return
+    print(f"🧬 补算感知哈希: {len(missing)} 张")
+    for r in missing:
+        try: phash = await asyncio.to_thread(imaging.compute_dhash, storage.original_path(r.filename))
+        except Exception as e: print(f"感知哈希失败 {r.filename}: {e}"); continue
+        await asyncio.to_thread(save_image_fields, r.id, {"phash": phash})
+
+batch_importer = importer.BatchImporter(vision_worker, embed_worker, text_worker, manager.send_log, ingest.update)
+# Starlette 解析 multipart 时默认最多 1000 个文件 (超出直接 400)，这里的上限不能比它大
+MAX_BATCH_FILES = min(int(os.getenv("MAX_BATCH_FILES", "1000")), 1000)
+BATCH_STORE_CONCURRENCY = int(os.getenv("BATCH_STORE_CONCURRENCY", "4"))  # 批量上传时同时落盘的文件数
+ADMIN_USERS = {name for name in os.getenv("ADMIN_USERS", "").split(",") if name}  # 允许从服务器目录导入的用户名
+
+@app.on_event("startup")
+async def start_workers():
+    await manager.start()
+    if ai.AI_PRELOAD: ai.start_background_loading()
+    vision_worker.start()
+    embed_worker.start()
+    text_worker.start()
+    ingest.start()
+    await database.run_sync(crud.prune_jobs, datetime.now() - timedelta(days=INGEST_JOB_RETENTION_DAYS))
+    # 模型版本在 ai 模块导入时就定了：换模型/推理后端后，旧版本的缓存条目再也不会命中，启动时清掉
+    for cache in (ai.image_cache, ai.text_cache):
+        purged = await asyncio.to_thread(cache.purge_stale)
+        if purged: print(f"🧹 清理旧模型版本的 {cache.kind} 缓存 {purged} 条")
+    if SEMANTIC_BACKFILL: app.state.backfill = asyncio.create_task(backfill_vectors())
+    if PHASH_BACKFILL: app.state.phash_backfill = asyncio.create_task(backfill_phash())
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await ingest.stop()
+    await vision_worker.stop()
+    await embed_worker.stop()
+    await text_worker.stop()
+    batch_importer.shutdown()
+    imaging_pool.shutdown(wait=False, cancel_futures=True)
+    await manager.stop()
+
+@app.get("/health")
+def health():
+    """存活检查：进程在就返回 200，附带模型加载状态和队列深度"""
+    return {"status": "ok", "models": ai.model_status, "load_seconds": ai.load_seconds, "errors": ai.load_errors, "queues": ingest.depths()}
+
+# Prometheus 抓取：各步骤耗时直方图、队列深度、模型加载耗时
+metrics.Gauge("photo_queue_depth", "排队中的任务数", "queue", lambda: {
+    **{f"ingest_{name}": depth for name, depth in ingest.depths().items()},
+    "vision_batch": vision_worker.depth(), "embed_batch": embed_worker.depth(), "text_batch": text_worker.depth(), "import_jobs": batch_importer.pending(),
+})
+metrics.Gauge("photo_model_load_seconds", "模型加载耗时 (秒)", "model", lambda: dict(ai.load_seconds))
+metrics.Gauge("photo_model_ready", "模型是否已加载 (1/0)", "model", lambda: {name: int(status == "ready") for name, status in ai.model_status.items()})
+
+@app.get("/metrics")
+def read_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health/ready")
+def readiness(response: Response):
+    """就绪检查：打标签需要的模型加载完成前返回 503，负载均衡据此决定是否转发上传"""
+    ready = ai.is_ready()
+    if not ready: response.status_code = 503
+    return {"ready": ready, "models": ai.model_status}
+
+def store_upload(src, filename: str):
+    """边写临时文件边算哈希，再收进内容寻址目录，返回 (文件名, 内容哈希)；和断点续传一样受 MAX_UPLOAD_BYTES 限制"""
+    tmp = storage.temp_path()
+    with metrics.timed("save"):
+        try: content_hash = uploads.save_stream(src, tmp, uploads.MAX_UPLOAD_BYTES)
+        except uploads.UploadError as e: raise upload_error(e)
+        return storage.place(tmp, content_hash, filename), content_hash
+
+def create_pending_image(db: Session, user_id: int, stored_name: str, content_hash: str, description: Optional[str]) -> int:
+    """先建一条分辨率未知的图片行，其余字段由流水线回填"""
+    return crud.create_user_image(db, schemas.ImageBase(description=description), user_id, stored_name, stored_name, "Unknown", content_hash=content_hash).id
+
+def discard_image(db: Session, image_id: int):
+    db_image = db.get(models.Image, image_id)
+    if db_image: crud.delete_image_by_id(db, db_image)
+
+async def enqueue_image(user_id: int, stored_name: str, content_hash: str, description: Optional[str], client_id: str):
+    """原图已落盘：建档并交给后台流水线，返回任务。数据库提交和文件清理都不在事件循环上做"""
+    media.remember_etag(storage.original_path(stored_name), content_hash)
+    try: image_id = await database.run_sync(create_pending_image, user_id, stored_name, content_hash, description)
+    finally: await asyncio.to_thread(storage.release, stored_name)  # 图片行已提交 (或没建成)，归还 place() 占的引用
+    try:
+        return await ingest.submit(image_id=image_id, user_id=user_id, client_id=client_id, stored_name=stored_name, file_path=storage.original_path(stored_name), thumb_path=storage.thumbnail_path(stored_name), content_hash=content_hash, description=description)
+    except asyncio.QueueFull:
+        await database.run_sync(discard_image, image_id)
+        raise HTTPException(status_code=503, detail="处理队列已满，请稍后重试")
+
+@app.post("/upload/", response_model=schemas.JobResponse, status_code=202)
+async def upload_image(file: UploadFile = File(...), description: str = Form(None), client_id: str = Form(...), current_user: models.User = Depends(get_current_user)):
+    if ingest.full(): raise HTTPException(status_code=503, detail="处理队列已满，请稍后重试")
     await manager.send_log(f"🚀 接收: {file.filename}...", client_id)
-    file_ext = file.filename.split(".")[-1]
-    unique_name = f"{uuid.uuid4()}.{file_ext}"
-    file_path = f"static/originals/{unique_name}"
-    thumb_path = f"static/thumbnails/{unique_name}"
-    with open(file_path, "wb") as buffer: shutil.copyfileobj(file.file, buffer)
+    stored_name, content_hash = await asyncio.to_thread(store_upload, file.file, file.filename)
     await manager.send_log("💾 保存成功", client_id)
-    
+    job = await enqueue_image(current_user.id, stored_name, content_hash, description, client_id)
+    await manager.send_log("⏳ 已进入处理队列", client_id)
+    return job
+
+# --- 批量上传 / 导入：立即返回任务号，逐张进度走 WebSocket，结果报告通过 /jobs 查询 ---
+@app.post("/upload/batch", response_model=schemas.JobResponse, status_code=202)
+async def upload_batch(files: list[UploadFile] = File(...), description: str = Form(None), client_id: str = Form(...), current_user: models.User = Depends(get_current_user)):
+    if ingest.full(): raise HTTPException(status_code=503, detail="处理队列已满，请稍后重试")
+    if len(files) > MAX_BATCH_FILES: raise HTTPException(status_code=413, detail=f"一次最多上传 {MAX_BATCH_FILES} 个文件")
+    await manager.send_log(f"🚀 接收 {len(files)} 个文件...", client_id)
+    # 请求结束后临时文件就没了，必须在返回前收进存储；几个文件同时收，不逐个排队
+    semaphore = asyncio.Semaphore(BATCH_STORE_CONCURRENCY)
+    async def store(file):
+        async with semaphore: return await asyncio.to_thread(store_upload, file.file, file.filename)
+    results = await asyncio.gather(*[store(file) for file in files], return_exceptions=True)
+    items = [{"name": file.filename, "stored_name": r[0], "content_hash": r[1]} for file, r in zip(files, results) if not isinstance(r, BaseException)]
+    try:
+        error = next((r for r in results if isinstance(r, BaseException)), None)
+        if error: raise error
+        job = await ingest.register(user_id=current_user.id)
+    except BaseException:
+        # 已经收下的文件还占着 place() 的引用，整批作废时要归还
+        for item in items: await asyncio.to_thread(storage.release, item["stored_name"])
+        raise
+    batch_importer.start(job, current_user.id, client_id, items, description)
+    return job
+
+@app.post("/admin/import", response_model=schemas.JobResponse, status_code=202)
+async def admin_import(data: schemas.ImportRequest, current_user: models.User = Depends(get_current_user)):
+    if current_user.username not in ADMIN_USERS: raise HTTPException(status_code=403, detail="需要管理员权限")
+    try:
+        full_path = importer.resolve_import_path(data.path)
+        sources = await asyncio.to_thread(importer.collect_sources, full_path)
+    except (FileNotFoundError, ValueError) as e: raise HTTPException(status_code=400, detail=f"无法导入: {e}")
+    job = await ingest.register(user_id=current_user.id)
+    batch_importer.start(job, current_user.id, data.client_id or "", sources, data.description)
+    return job
+
+# --- 断点续传 (tus 风格)：POST 创建 → HEAD 查偏移 → PATCH 追加 → finalize ---
+def upload_error(e: uploads.UploadError):
+    return HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.post("/uploads/", response_model=schemas.UploadStatus, status_code=201)
+def create_upload(data: schemas.UploadCreate, response: Response, u: models.User = Depends(get_current_user)):
+    try: session = uploads.create(u.id, data.filename, data.length, data.description, data.client_id)
+    except uploads.UploadError as e: raise upload_error(e)
+    response.headers["Location"] = f"/uploads/{session.upload_id}"
+    return session
+
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str, u: models.User = Depends(get_current_user)):
+    # 偏移就是部分文件当前的大小；有 PATCH 正在写时返回已落盘的部分，不等它结束
+    try: session = await uploads.get(upload_id, u.id)
+    except uploads.UploadError as e: raise upload_error(e)
+    return Response(headers={"Upload-Offset": str(session.offset), "Upload-Length": str(session.length), "Cache-Control": "no-store"})
+
+@app.patch("/uploads/{upload_id}", status_code=204)
+async def upload_chunk(upload_id: str, request: Request, u: models.User = Depends(get_current_user)):
     try:
-        await manager.send_log("📸 处理图片...", client_id)
-        img_info = await asyncio.to_thread(process_image, file_path, thumb_path)
-    except Exception: raise HTTPException(status_code=400, detail="处理失败")
+        session = await uploads.get(upload_id, u.id)
+        with session.writing():
+            # 客户端声明的偏移必须和服务端一致，否则先 HEAD 查询再续传
+            if request.headers.get("Upload-Offset") != str(session.offset):
+                raise uploads.UploadError(409, f"偏移不一致，当前为 {session.offset}")
+            await session.append(request.stream())
+    except uploads.UploadError as e: raise upload_error(e)
+    return Response(status_code=204, headers={"Upload-Offset": str(session.offset)})
 
-    await manager.send_log("🧠 AI 识别中...", client_id)
-    ai_tags = await asyncio.to_thread(ai.analyze_image, file_path)
-    await manager.send_log(f"🤖 标签: {ai_tags}", client_id)
+@app.post("/uploads/{upload_id}/finalize", response_model=schemas.JobResponse, status_code=202)
+async def finalize_upload(upload_id: str, u: models.User = Depends(get_current_user)):
+    if ingest.full(): raise HTTPException(status_code=503, detail="处理队列已满，请稍后重试")
+    try:
+        session = await uploads.get(upload_id, u.id)
+        with session.writing():
+            # 哈希在上传过程中已经算好 (别的 worker 写入的部分才需要补读)
+            tmp = storage.temp_path()
+            content_hash = await asyncio.to_thread(uploads.finish, session, tmp)
+    except uploads.UploadError as e: raise upload_error(e)
+    stored_name = await asyncio.to_thread(storage.place, tmp, content_hash, session.filename)
+    client_id = session.client_id or ""
+    await manager.send_log(f"💾 已接收: {session.filename}", client_id)
+    return await enqueue_image(u.id, stored_name, content_hash, session.description, client_id)
 
-    final_loc = img_info["location"]; final_date = img_info["date"]
-    if description:
-        await manager.send_log("📝 分析文本...", client_id)
-        text_info = await asyncio.to_thread(ai.analyze_text, description)
-        if final_loc == "Unknown" and text_info.get("location"): final_loc = text_info["location"]
-        if final_date is None and text_info.get("date"): final_date = text_info["date"]
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def abort_upload(upload_id: str, u: models.User = Depends(get_current_user)):
+    try:
+        session = await uploads.get(upload_id, u.id)
+        with session.writing(): uploads.remove(session)
+    except uploads.UploadError as e: raise upload_error(e)
 
-    await manager.send_log("✅ 完成", client_id)
-    return crud.create_user_image(db, schemas.ImageBase(description=description), current_user.id, unique_name, unique_name, img_info["resolution"], final_date, ai_tags, final_loc)
+@app.get("/jobs/{job_id}", response_model=schemas.JobResponse)
+async def read_job(job_id: str, u: models.User = Depends(get_current_user)):
+    # 本进程跑的任务直接读内存；多 worker 时任务可能在别的进程里，从库里读它最近一次写入的状态
+    job = ingest.get(job_id) or await database.run_sync(crud.get_job, job_id)
+    if not job or job["user_id"] != u.id: raise HTTPException(status_code=404, detail="Not Found")
+    return job
 
-@app.get("/my-images/", response_model=list[schemas.ImageResponse])
-def read_images(skip: int=0, limit: int=100, u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return crud.get_images_by_user(db, u.id, skip, limit)
+# 图库列表：下一页游标放在 X-Next-Cursor 响应头里，返回体保持数组格式
+# fields=lite 时只返回网格视图需要的 id/缩略图/日期
+@app.get("/my-images/", response_model=None)
+async def read_images(response: Response, limit: int=100, cursor: Optional[str]=None, sort: str="upload_time", fields: str="full", u: models.User = Depends(get_current_user)):
+    if sort not in crud.SORT_COLUMNS: raise HTTPException(status_code=400, detail=f"sort 只能是 {', '.join(crud.SORT_COLUMNS)}")
+    lite = fields == "lite"
+    try: rows, next_cursor = await database.run_sync(crud.get_images_by_user, u.id, sort, cursor, max(1, min(limit, 500)), lite)
+    except (ValueError, TypeError): raise HTTPException(status_code=400, detail="无效的游标")
+    if next_cursor: response.headers["X-Next-Cursor"] = next_cursor
+    schema = schemas.ImageThumb if lite else schemas.ImageResponse
+    return [schema.model_validate(r) for r in rows]
 
 @app.get("/search/", response_model=list[schemas.ImageResponse])
-def search(q: str, u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return crud.search_images(db, u.id, q)
+async def search(q: str, skip: int=0, limit: int=50, u: models.User = Depends(get_current_user)):
+    return await database.run_sync(crud.search_images, u.id, q, skip, min(limit, 200))
+
+# 语义检索：自由文本或以图搜图，二者给一个即可
+@app.get("/search/semantic", response_model=list[schemas.ImageResponse])
+async def search_semantic(q: Optional[str] = None, image_id: Optional[int] = None, k: int = 20, u: models.User = Depends(get_current_user)):
+    if image_id is not None:
+        vector = await asyncio.to_thread(vectors.get, u.id, image_id)
+        if vector is None: raise HTTPException(status_code=404, detail="该图片还没有语义向量")
+    elif q:
+        vector = await asyncio.to_thread(ai.embed_text, q)
+        if vector is None: raise HTTPException(status_code=503, detail="语义模型不可用")
+    else:
+        raise HTTPException(status_code=400, detail="需要 q 或 image_id")
+    hits = await asyncio.to_thread(vectors.search, u.id, vector, min(k, 100), (image_id,) if image_id is not None else ())
+    return await database.run_sync(crud.get_images_by_ids, u.id, [image_id for image_id, _ in hits])
 
 @app.get("/images/{image_id}", response_model=schemas.ImageResponse)
-def read_one(image_id: int, u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    img = crud.get_image_by_id(db, image_id, u.id)
+async def read_one(image_id: int, u: models.User = Depends(get_current_user)):
+    img = await database.run_sync(crud.get_image_by_id, image_id, u.id)
     if not img: raise HTTPException(status_code=404, detail="Not Found")
     return img
 
+# --- 地图 / 时间线：聚合都在数据库里完成 ---
+@app.get("/map/images", response_model=list[schemas.MapImage])
+async def map_images(south: float, west: float, north: float, east: float, limit: int = 500, u: models.User = Depends(get_current_user)):
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise HTTPException(status_code=400, detail="无效的经纬度范围")
+    return await database.run_sync(geo.images_in_bbox, u.id, south, west, north, east, min(limit, 2000))
+
+@app.get("/map/tiles/{z}/{x}/{y}", response_model=list[schemas.MapCluster])
+async def map_tile(z: int, x: int, y: int, u: models.User = Depends(get_current_user)):
+    if not (0 <= z <= geo.GRID_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(status_code=400, detail="无效的瓦片坐标")
+    return await database.run_sync(geo.tile_clusters, u.id, z, x, y)
+
+@app.get("/timeline", response_model=list[schemas.TimelineBucket])
+async def read_timeline(granularity: str = "month", start: Optional[datetime] = None, end: Optional[datetime] = None, u: models.User = Depends(get_current_user)):
+    if granularity not in geo.TIMELINE_FORMATS: raise HTTPException(status_code=400, detail=f"granularity 只能是 {', '.join(geo.TIMELINE_FORMATS)}")
+    return await database.run_sync(geo.timeline, u.id, granularity, start, end)
+
+# --- 近似重复：感知哈希距离 ---
+@app.get("/images/{image_id}/similar", response_model=list[schemas.SimilarImage])
+async def similar_images(image_id: int, max_distance: int = similar.SIMILAR_DISTANCE, limit: int = 50, u: models.User = Depends(get_current_user)):
+    img = await database.run_sync(crud.get_image_by_id, image_id, u.id)
+    if not img: raise HTTPException(status_code=404, detail="Not Found")
+    if not img.phash: raise HTTPException(status_code=404, detail="该图片还没有感知哈希")
+    hits = await database.run_sync(similar.find_similar, u.id, img.phash, max_distance, image_id, min(limit, 200))
+    return [schemas.SimilarImage(**schemas.ImageResponse.model_validate(hit).model_dump(), distance=d) for hit, d in hits]
+
+@app.get("/duplicates/", response_model=list[schemas.DuplicateCluster])
+async def duplicate_report(max_distance: int = similar.DUPLICATE_DISTANCE, limit: int = 100, u: models.User = Depends(get_current_user)):
+    clusters = await database.run_sync(similar.duplicate_clusters, u.id, max_distance, min(limit, 500))
+    return [{"size": len(images), "images": images} for images in clusters]
+
 @app.put("/images/{image_id}/content")
-async def update_content(image_id: int, file: UploadFile = File(...), u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    img = crud.get_image_by_id(db, image_id, u.id)
+async def update_content(image_id: int, file: UploadFile = File(...), u: models.User = Depends(get_current_user)):
+    img = await database.run_sync(crud.get_image_by_id, image_id, u.id)
     if not img: raise HTTPException(status_code=404)
-    path = f"static/originals/{img.filename}"
-    thumb = f"static/thumbnails/{img.thumbnail}"
-    with open(path, "wb") as buffer: shutil.copyfileobj(file.file, buffer)
+    # 新内容按哈希存成新文件：文件按 immutable 长期缓存，原地覆盖会让浏览器/CDN 一直拿到旧图
+    stored_name, content_hash = await asyncio.to_thread(store_upload, file.file, file.filename if "." in (file.filename or "") else img.filename)
     try:
-        with PILImage.open(path) as pi:
-            img.resolution = f"{pi.width}x{pi.height}"
-            pi.thumbnail((300, 300)); pi.save(thumb)
-        db.commit()
-    except Exception: raise HTTPException(status_code=500)
-    return {"status": "ok"}
+        info = await asyncio.to_thread(imaging.process_image, storage.original_path(stored_name), storage.thumbnail_path(stored_name), storage.variant_stem(stored_name), preview=True)
+        metrics.record_timings(info.pop("timings"))
+        preview = info.pop("preview")
+        if info["resolution"] == "Unknown": raise HTTPException(status_code=400, detail="无法解析图片")
+        media.remember_etag(storage.original_path(stored_name), content_hash)
+        old_name, old_thumb, old_variants, old_hash = img.filename, img.thumbnail, img.variants, img.content_hash
+        updated = await database.run_sync(crud.update_image_fields, image_id, {
+            "filename": stored_name, "thumbnail": stored_name, "content_hash": content_hash,
+            "resolution": info["resolution"], "variants": json.dumps(info["variants"]), "phash": info["phash"],
+        })
+        if updated is None: raise HTTPException(status_code=404)  # 处理期间图片被删了
+    finally:
+        # 新图片行已提交时只是归还 place() 占的引用；失败时没有别的引用，文件随之删除
+        await asyncio.to_thread(storage.release, stored_name)
+    await asyncio.to_thread(storage.publish, stored_name)
+    # 语义向量按新内容重算 (add 会替换旧的那一行)，否则语义搜索和相似图还按旧图排序
+    try:
+        vector = await embed_worker.submit(preview or storage.original_path(stored_name))
+        if vector is not None: await asyncio.to_thread(vectors.add, u.id, image_id, vector)
+    except Exception as e: print(f"语义向量重算失败 {image_id}: {e}")
+    if old_hash:
+        if old_name != stored_name: await asyncio.to_thread(storage.sweep, [old_name])
+    else:
+        for old in (storage.original_path(old_name), storage.thumbnail_path(old_thumb)):
+            try: os.remove(old)
+            except FileNotFoundError: pass
+        imaging.remove_derivatives(json.loads(old_variants or "{}"))
+    return {"status": "ok", "filename": stored_name}
+
+# --- 衍生图：按宽度和 Accept 头挑最合适的尺寸/格式 ---
+@app.get("/variants/{filename:path}")
+async def serve_variant(filename: str, request: Request, w: Optional[int] = None):
+    img = await database.run_sync(crud.get_image_by_filename, filename)
+    if not img: raise HTTPException(status_code=404)
+    variants, accept = json.loads(img.variants or "{}"), request.headers.get("accept", "")
+    name, media_type = imaging.pick_variant(variants, w, accept)
+    if name and imaging.is_lazy(name):
+        # AVIF 之类第一次被请求时才编码；原图不在本地 (远端存储) 或编码失败就退回上传时生成的格式
+        try: await asyncio.to_thread(imaging.ensure_variant, storage.original_path(img.filename), name)
+        except Exception as e:
+            if not isinstance(e, FileNotFoundError): print(f"衍生图生成失败 {name}: {e}")
+            name, media_type = imaging.pick_variant(variants, w, accept, lazy=False)
+    # 远端存储时本地目录只是缓存：本地没有的文件重定向到对象存储
+    if name:
+        try: return await media.serve(imaging.variant_path(name), request.headers, media_type, {"Vary": "Accept"})
+        except FileNotFoundError:
+            url = storage.remote_url(imaging.variant_path(name))
+            if url: return RedirectResponse(url, headers={"Vary": "Accept", "Cache-Control": media.NO_CACHE})
+    # 还没生成衍生图 (后台处理中或旧数据) 时退回原图，且不让浏览器缓存，处理完后再取就是衍生图
+    try: return await media.serve(storage.original_path(img.filename), request.headers, headers={"Vary": "Accept"}, cache_control=media.NO_CACHE)
+    except FileNotFoundError:
+        url = storage.remote_url(storage.original_path(img.filename))
+        if url: return RedirectResponse(url, headers={"Vary": "Accept", "Cache-Control": media.NO_CACHE})
+        raise HTTPException(status_code=404)
 
 # --- 修改图片元数据接口 ---
 # 这个接口负责接收前端发来的描述、地点、时间修改
@@ -226,6 +556,34 @@ def update_metadata(image_id: int, data: schemas.ImageUpdate, u: models.User = D
     return crud.update_image_metadata(db, img, data)
 # ------------------------------
 
+# --- 标签接口 ---
+@app.get("/tags/", response_model=list[schemas.TagFacet])
+async def tag_facets(limit: int = 100, u: models.User = Depends(get_current_user)):
+    return await database.run_sync(crud.get_tag_facets, u.id, min(limit, 1000))
+
+@app.get("/tags/{tag_name}/images", response_model=list[schemas.ImageResponse])
+async def images_by_tag(tag_name: str, skip: int = 0, limit: int = 100, u: models.User = Depends(get_current_user)):
+    return await database.run_sync(crud.get_images_by_tag, u.id, tag_name, skip, limit)
+
+@app.get("/images/{image_id}/tags", response_model=list[schemas.TagResponse])
+def read_image_tags(image_id: int, u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    img = crud.get_image_by_id(db, image_id, u.id)
+    if not img: raise HTTPException(status_code=404, detail="Not Found")
+    return crud.get_image_tags(db, img.id)
+
+@app.post("/images/{image_id}/tags", response_model=schemas.TagResponse)
+def add_image_tag(image_id: int, data: schemas.TagCreate, u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    img = crud.get_image_by_id(db, image_id, u.id)
+    if not img: raise HTTPException(status_code=404, detail="Not Found")
+    if not data.tag_name.strip(): raise HTTPException(status_code=400, detail="标签不能为空")
+    return crud.add_user_tag(db, img, data.tag_name)
+
+@app.delete("/images/{image_id}/tags/{tag_name}", status_code=204)
+def delete_image_tag(image_id: int, tag_name: str, u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    img = crud.get_image_by_id(db, image_id, u.id)
+    if not img: raise HTTPException(status_code=404, detail="Not Found")
+    if not crud.remove_tag(db, img, tag_name): raise HTTPException(status_code=404, detail="Not Found")
+
 @app.delete("/images/{image_id}", status_code=204)
 def delete_img(image_id: int, u: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
     img = crud.get_image_by_id(db, image_id, u.id)
@@ -0,0 +1,102 @@
+# backend/media.py
+# 图片文件的下载：原图/缩略图/衍生图的文件名由内容哈希 (老数据为 UUID) 决定，内容变了文件名就变，
+# 所以可以让浏览器和 CDN 长期缓存，不再反复回源校验。
+#   Cache-Control: immutable        一年内直接用本地缓存
+#   ETag: 内容 SHA-256               强校验，配合 If-None-Match 返回 304
+#   Range / If-Range                 由 FileResponse 处理，大图可以断点/分段加载
+# MEDIA_ACCEL_PREFIX 配置后只返回 X-Accel-Redirect 头，由前面的 nginx 直接发文件，例如：
+#   location /_media/ { internal; alias /app/static/; }   并设置 MEDIA_ACCEL_PREFIX=/_media/
+import os
+import stat
+import hashlib
+import threading
+from collections import OrderedDict
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+import storage
+
+MEDIA_ROOT = "static"
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "")
+IMMUTABLE = "public, max-age=31536000, immutable"
+NO_CACHE = "no-cache"
+CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}  # 前端 Canvas 编辑需要跨域读取像素
+ETAG_CACHE_SIZE = 100_000
+
+_etags: OrderedDict[tuple, str] = OrderedDict()
+_lock = threading.Lock()
+
+def _key(path: str, st: os.stat_result):
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+def remember_etag(path: str, content_hash: str):
+    """上传时已经边写边算出了哈希，直接登记，不必再读一遍文件"""
+    try: st = os.stat(path)
+    except FileNotFoundError: return
+    _store(_key(path, st), content_hash)
+
+def _store(key, content_hash):
+    with _lock:
+        _etags[key] = content_hash
+        while len(_etags) > ETAG_CACHE_SIZE: _etags.popitem(last=False)
+
+def etag_for(path: str, st: os.stat_result) -> str:
+    """按 (路径, 大小, 修改时间) 记住文件内容的 SHA-256，文件被替换后自动重算"""
+    key = _key(path, st)
+    with _lock: content_hash = _etags.get(key)
+    if content_hash is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""): h.update(chunk)
+        content_hash = h.hexdigest()
+        _store(key, content_hash)
+    return f'"{content_hash}"'
+
+def is_not_modified(etag: str, request_headers: Headers) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    return bool(if_none_match) and (if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")])
+
+def file_response(full_path: str, st: os.stat_result, request_headers: Headers, media_type: str = None, headers: dict = None, cache_control: str = IMMUTABLE) -> Response:
+    """调用前需先 warm() 过 (或 MEDIA_ACCEL_PREFIX 已配置)，这里不再做磁盘读取"""
+    headers = {**CORS_HEADERS, "Cache-Control": cache_control, **(headers or {})}
+    if MEDIA_ACCEL_PREFIX:
+        rel = os.path.relpath(full_path, MEDIA_ROOT).replace(os.sep, "/")
+        if media_type: headers["Content-Type"] = media_type
+        return Response(headers={**headers, "X-Accel-Redirect": MEDIA_ACCEL_PREFIX + rel})
+    headers["ETag"] = etag_for(full_path, st)
+    response = FileResponse(full_path, stat_result=st, media_type=media_type, headers=headers)
+    if is_not_modified(headers["ETag"], request_headers): return NotModifiedResponse(response.headers)
+    return response
+
+def warm(full_path: str, st: os.stat_result):
+    """首次访问某个文件时要读一遍算哈希，放在线程里做"""
+    if not MEDIA_ACCEL_PREFIX: etag_for(full_path, st)
+
+async def serve(full_path: str, request_headers: Headers, media_type: str = None, headers: dict = None, cache_control: str = IMMUTABLE) -> Response:
+    """供普通路由使用 (如 /variants)：文件不存在时抛 FileNotFoundError"""
+    st = await anyio.to_thread.run_sync(os.stat, full_path)
+    await anyio.to_thread.run_sync(warm, full_path, st)
+    return file_response(full_path, st, request_headers, media_type, headers, cache_control)
+
+class MediaFiles(StaticFiles):
+    """挂在 /static：在 StaticFiles 的路径解析之上换成上面的缓存头/ETag/X-Accel-Redirect"""
+    def lookup_path(self, path: str):
+        # StaticFiles 在线程里调用它，首次访问的文件顺带算好 ETag
+        full_path, st = super().lookup_path(path)
+        if st is not None and stat.S_ISREG(st.st_mode): warm(full_path, st)
+        return full_path, st
+
+    async def get_response(self, path: str, scope) -> Response:
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            # 远端存储时本地目录只是缓存，缺失的文件交给对象存储
+            if e.status_code == 404 and storage.backend.remote and ".." not in path.split("/"): return RedirectResponse(storage.backend.url(path))
+            raise
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        return file_response(str(full_path), stat_result, Headers(scope=scope))
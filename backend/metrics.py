@@ -0,0 +1,102 @@
+# backend/metrics.py
+# 热路径指标：进程内的直方图/计数器/采样值，由 /metrics 按 Prometheus 文本格式输出 (不依赖 prometheus_client)。
+# 多进程部署时每个进程各自统计，由 Prometheus 按实例分别抓取。
+# 可选链路追踪：OTEL_TRACING=1 且装了 opentelemetry-api 时，timed()/record() 同时产生同名 span；
+# 导出到哪里由 opentelemetry-instrument 和 OTEL_* 环境变量决定，这里只负责打点。
+import os
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+OTEL_TRACING = os.getenv("OTEL_TRACING", "0") == "1"
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # 秒
+
+def _labels(name: str, value) -> str:
+    return f'{{{name}="{value}"}}' if name else ""
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str, buckets=STAGE_BUCKETS):
+        self.name, self.help, self.label, self.buckets = name, help, label, tuple(buckets)
+        self._series = {}  # 标签值 -> [各桶计数..., 总数, 总和]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, label_value: str, value: float):
+        with self._lock:
+            series = self._series.setdefault(label_value, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[i] += 1
+            series[-2] += 1; series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock: snapshot = {k: list(v) for k, v in self._series.items()}
+        for value, series in sorted(snapshot.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {series[-2]}")
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {series[-1]:.6f}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str, label: str):
+        self.name, self.help, self.label = name, help, label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, label_value: str, amount: float = 1):
+        with self._lock: self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock: snapshot = dict(self._values)
+        lines += [f"{self.name}_total{_labels(self.label, k)} {v}" for k, v in sorted(snapshot.items())]
+        return lines
+
+class Gauge:
+    """抓取时才调用 collect() 取当前值 (队列长度、模型加载耗时这类本来就存在别处的状态)"""
+    def __init__(self, name: str, help: str, label: str, collect):
+        self.name, self.help, self.label, self.collect = name, help, label, collect
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try: values = self.collect()
+        except Exception: values = {}
+        lines += [f"{self.name}{_labels(self.label, k)} {v}" for k, v in sorted(values.items())]
+        return lines
+
+_registry = []
+
+stage_seconds = Histogram("photo_stage_seconds", "各处理步骤耗时 (秒)", "stage")
+
+_tracer = None
+if OTEL_TRACING:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("photo-backend")
+    except ImportError:
+        print("未安装 opentelemetry-api，链路追踪关闭")
+
+@contextmanager
+def timed(stage: str):
+    """计时一个步骤，计入 photo_stage_seconds{stage=...}；开了追踪时包一层同名 span"""
+    started = time.perf_counter()
+    with _tracer.start_as_current_span(stage) if _tracer else nullcontext():
+        try: yield
+        finally: stage_seconds.observe(stage, time.perf_counter() - started)
+
+def record(stage: str, seconds: float):
+    """别处量好的耗时 (如进程池里的图片处理)：计入直方图，开了追踪时补一个刚结束、同样长度的 span"""
+    stage_seconds.observe(stage, seconds)
+    if _tracer:
+        end = time.time_ns()
+        _tracer.start_span(stage, start_time=end - int(seconds * 1e9)).end(end_time=end)
+
+def record_timings(timings: dict):
+    for stage, seconds in (timings or {}).items(): record(stage, seconds)
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
@@ -0,0 +1,120 @@
+# backend/migrations.py
+# 轻量数据库迁移：建表、旧表的新列、新索引、数据回填都在这里完成 (启动时不再调用 create_all)
+# 全新的数据库直接按当前模型建表并记为最新版本；已有数据库按顺序补齐未执行的迁移
+# 每个迁移只执行一次，执行过的版本号记在 schema_version 表里。SQL 只用 SQLite 和 Postgres 都支持的写法
+import re
+from sqlalchemy import inspect, text
+
+import models, geo
+
+def _add_columns(conn, table: str, columns: list[tuple[str, str]]):
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    for name, ddl in columns:
+        if name not in existing: conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+def _create_tables(conn, *tables):
+    for table in tables: table.create(conn, checkfirst=True)
+
+def _create_indexes(conn, table):
+    """按当前模型建索引；列还没加上的索引 (由后面的迁移加列) 先跳过"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    for index in table.indexes:
+        if all(c.name in existing for c in index.columns): index.create(conn, checkfirst=True)
+
+# --- 迁移步骤 ---
+def _tags_normalized(conn):
+    """tags 表增加 user_id/confidence/source，并把已有 ai_tags 字符串拆成标签行"""
+    _add_columns(conn, "tags", [("user_id", "INTEGER REFERENCES users(id)"), ("confidence", "FLOAT"), ("source", "VARCHAR")])
+    _create_indexes(conn, models.Tag.__table__)
+    rows = conn.execute(text(
+        "SELECT id, user_id, ai_tags FROM images WHERE ai_tags IS NOT NULL AND ai_tags != '' "
+        "AND NOT EXISTS (SELECT 1 FROM tags WHERE tags.image_id = images.id)"
+    )).all()
+    params = []
+    for image_id, user_id, ai_tags in rows:
+        for name in dict.fromkeys(t.strip().lower() for t in ai_tags.split(",")):
+            if name: params.append({"image_id": image_id, "user_id": user_id, "tag_name": name})
+    if params:
+        conn.execute(text("INSERT INTO tags (image_id, user_id, tag_name, source) VALUES (:image_id, :user_id, :tag_name, 'legacy')"), params)
+    print(f"   - 回填标签 {len(params)} 条")
+
+def _images_listing_indexes(conn):
+    """图库游标分页用的复合索引"""
+    _create_indexes(conn, models.Image.__table__)
+
+def _images_variants(conn):
+    """多尺寸衍生图记录，以及按文件名查图用的索引"""
+    _add_columns(conn, "images", [("variants", "TEXT")])
+    _create_indexes(conn, models.Image.__table__)
+
+def _ai_cache_table(conn):
+    """推理结果缓存表 (之前依赖 create_all 建出来)"""
+    _create_tables(conn, models.AICache.__table__)
+
+def _users_token_version(conn):
+    """token 里带上版本号，改密码/退出所有设备时加一即可吊销旧 token"""
+    _add_columns(conn, "users", [("token_version", "INTEGER NOT NULL DEFAULT 0")])
+
+def _content_addressed_storage(conn):
+    """内容寻址存储的引用计数表；老图片 content_hash 为空，仍按平铺文件处理"""
+    _create_tables(conn, models.Blob.__table__)
+    _add_columns(conn, "images", [("content_hash", "VARCHAR")])
+    _create_indexes(conn, models.Image.__table__)
+
+def _images_phash(conn):
+    """感知哈希及其四段索引；老图片的哈希在启动后台补算"""
+    _add_columns(conn, "images", [("phash", "VARCHAR(16)"), ("ph0", "INTEGER"), ("ph1", "INTEGER"), ("ph2", "INTEGER"), ("ph3", "INTEGER")])
+    _create_indexes(conn, models.Image.__table__)
+
+_GPS_LOCATION = re.compile(r"^(-?\d+\.\d+), (-?\d+\.\d+)$")
+
+def _images_geo(conn):
+    """数值经纬度和墨卡托网格坐标；老图片从 EXIF 写入的 "lat, lon" 格式 location 回填 (地名无法还原坐标，跳过)"""
+    _add_columns(conn, "images", [("latitude", "FLOAT"), ("longitude", "FLOAT"), ("gx", "INTEGER"), ("gy", "INTEGER")])
+    params = []
+    for image_id, location in conn.execute(text("SELECT id, location FROM images WHERE location IS NOT NULL AND latitude IS NULL")):
+        m = _GPS_LOCATION.match(location.strip())
+        if not m: continue
+        lat, lon = float(m.group(1)), float(m.group(2))
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180): continue
+        gx, gy = geo.project(lat, lon)
+        params.append({"id": image_id, "lat": lat, "lon": lon, "gx": gx, "gy": gy})
+    if params:
+        conn.execute(text("UPDATE images SET latitude = :lat, longitude = :lon, gx = :gx, gy = :gy WHERE id = :id"), params)
+    print(f"   - 回填坐标 {len(params)} 张")
+    _create_indexes(conn, models.Image.__table__)
+
+def _jobs_table(conn):
+    """任务状态存库，多 worker 时 /jobs 不再只能查到本进程的任务"""
+    _create_tables(conn, models.Job.__table__)
+
+MIGRATIONS = [
+    (1, "tags_normalized", _tags_normalized),
+    (2, "images_listing_indexes", _images_listing_indexes),
+    (3, "images_variants", _images_variants),
+    (4, "ai_cache_table", _ai_cache_table),
+    (5, "users_token_version", _users_token_version),
+    (6, "content_addressed_storage", _content_addressed_storage),
+    (7, "images_phash", _images_phash),
+    (8, "images_geo", _images_geo),
+    (9, "jobs_table", _jobs_table),
+]
+
+_STAMP = text("INSERT INTO schema_version (version, name) VALUES (:v, :n)")
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name VARCHAR, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"))
+        done = {r[0] for r in conn.execute(text("SELECT version FROM schema_version"))}
+        if not inspect(conn).has_table("users"):
+            print("🛠️ 初始化数据库")
+            models.Base.metadata.create_all(conn)
+            conn.execute(_STAMP, [{"v": version, "n": name} for version, name, _ in MIGRATIONS])
+            return
+    for version, name, step in MIGRATIONS:
+        if version in done: continue
+        print(f"🛠️ 数据库迁移 {version}: {name}")
+        # 每一步单独一个事务，失败时不会留下半截的修改
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(_STAMP, {"v": version, "n": name})
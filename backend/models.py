@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -11,6 +11,7 @@ class User(Base):
     username = Column(String, unique=True, index=True) # 用户名唯一
     email = Column(String, unique=True, index=True)    # 邮箱唯一
     password_hash = Column(String)                     # 存加密后的密码
+    token_version = Column(Integer, default=0, nullable=False)  # 加一即让该用户已签发的全部 token 失效
     created_at = Column(DateTime, default=datetime.datetime.now)
 
     # 关联：一个用户有多张图片
@@ -23,13 +24,26 @@ class Image(Base):
     user_id = Column(Integer, ForeignKey("users.id")) # 外键关联用户
     
     # 文件存储信息
-    filename = Column(String)      # 原图文件名 (如 uuid.jpg)
+    filename = Column(String, index=True)  # 原图文件名：内容寻址的 ab/cd/<sha256>.jpg，老数据为 uuid.jpg
     thumbnail = Column(String)     # 缩略图文件名
+    content_hash = Column(String, nullable=True, index=True)  # 原图 SHA-256；为空表示存储改造前的老文件
+    variants = Column(Text, nullable=True) # 衍生图 JSON: {"尺寸": {"格式": 文件名}}
+    phash = Column(String(16), nullable=True)  # 64 位感知哈希 (dHash，十六进制)
+    # phash 按 16 位切成四段分别建索引 (多索引哈希)，由 similar.py 的映射事件同步，找近似图时按段精确/邻近匹配
+    ph0 = Column(Integer, nullable=True)
+    ph1 = Column(Integer, nullable=True)
+    ph2 = Column(Integer, nullable=True)
+    ph3 = Column(Integer, nullable=True)
     
     # EXIF 信息 
     upload_time = Column(DateTime, default=datetime.datetime.now)
     capture_date = Column(DateTime, nullable=True) # 拍摄时间
-    location = Column(String, nullable=True)       # 拍摄地点
+    location = Column(String, nullable=True)       # 拍摄地点 (GPS 或从描述里识别出的地名，仅用于展示和搜索)
+    latitude = Column(Float, nullable=True)        # EXIF GPS 纬度
+    longitude = Column(Float, nullable=True)       # EXIF GPS 经度
+    # Web 墨卡托投影到第 geo.GRID_ZOOM 级的像素坐标，由 geo.py 的映射事件同步；右移即得任意缩放级别的瓦片号
+    gx = Column(Integer, nullable=True)
+    gy = Column(Integer, nullable=True)
     resolution = Column(String, nullable=True)     # 分辨率 (如 1920x1080)
     
     # 增强功能字段
@@ -40,11 +54,62 @@ class Image(Base):
     owner = relationship("User", back_populates="images")
     tags = relationship("Tag", back_populates="image", cascade="all, delete-orphan")
 
+    # 图库列表按 (user_id, 排序列, id) 做游标分页，每种排序一个复合索引
+    __table_args__ = (
+        Index("ix_images_user_id", "user_id", "id"),
+        Index("ix_images_user_upload", "user_id", "upload_time", "id"),
+        Index("ix_images_user_capture", "user_id", "capture_date", "id"),
+        Index("ix_images_user_geo", "user_id", "gx", "gy"),
+        Index("ix_images_user_ph0", "user_id", "ph0"),
+        Index("ix_images_user_ph1", "user_id", "ph1"),
+        Index("ix_images_user_ph2", "user_id", "ph2"),
+        Index("ix_images_user_ph3", "user_id", "ph3"),
+    )
+
 class Tag(Base):
     __tablename__ = "tags"
     
     id = Column(Integer, primary_key=True, index=True)
-    image_id = Column(Integer, ForeignKey("images.id"))
-    tag_name = Column(String, index=True) # 自定义标签名 
+    image_id = Column(Integer, ForeignKey("images.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))  # 冗余存一份，按用户筛选/统计不用连表
+    tag_name = Column(String, index=True) # 标签名 (统一小写)
+    confidence = Column(Float, nullable=True)          # 模型置信度，用户手动添加的为空
+    source = Column(String, default="user")            # scene / object / user / legacy
     
-    image = relationship("Image", back_populates="tags")
\ No newline at end of file
+    image = relationship("Image", back_populates="tags")
+
+    # (user_id, tag_name) 打头的复合索引：按标签筛图和标签计数都只走索引
+    __table_args__ = (Index("ix_tags_user_tag", "user_id", "tag_name", "image_id"),)
+
+class AICache(Base):
+    __tablename__ = "ai_cache"
+
+    key = Column(String, primary_key=True)         # 类型:内容哈希 (如 image:sha256)
+    kind = Column(String, index=True)              # image / text
+    model_version = Column(String)                 # 产出该结果的模型版本
+    value = Column(Text)                           # JSON 结果
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+class Job(Base):
+    """后台任务 (单张入库、批量导入) 的状态：多 worker 部署时 /jobs 可能落到别的进程，所以每次状态变化都写库 (见 pipeline.py)"""
+    __tablename__ = "jobs"
+
+    job_id = Column(String, primary_key=True)
+    user_id = Column(Integer, index=True)
+    image_id = Column(Integer)                     # 批量导入任务为空
+    status = Column(String)                        # pending / processing / done / failed
+    stage = Column(String)
+    error = Column(Text)
+    report = Column(Text)                          # 批量导入结果 (JSON)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now)
+
+class Blob(Base):
+    """内容寻址存储里的一份原图，refcount 为引用它的图片数 (见 storage.py)"""
+    __tablename__ = "blobs"
+
+    name = Column(String, primary_key=True)        # 相对 originals 的路径，如 ab/cd/<sha256>.jpg
+    content_hash = Column(String, index=True)
+    size = Column(Integer)
+    refcount = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
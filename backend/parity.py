@@ -0,0 +1,86 @@
+# backend/parity.py
+# 推理后端精度对比：拿 float32 PyTorch 的输出当基准，看量化 / ONNX 后端差了多少、快了多少
+#   python parity.py --backend quantized
+#   python parity.py --backend onnx --images static/originals --limit 200 --min-agreement 0.95
+# 图片默认取 static/originals，文本默认取库里已有的图片描述；标签一致率低于阈值时退出码为 1
+import os
+import sys
+import time
+import argparse
+
+import ai, runtimes, database, models
+from importer import is_image_name
+
+def _timed(fn, inputs):
+    started = time.perf_counter()
+    outputs = [fn(x) for x in inputs]
+    return outputs, (time.perf_counter() - started) * 1000 / max(len(inputs), 1)
+
+def _build(backend):
+    print(f"加载 {backend} 后端...")
+    return {
+        "scene": runtimes.build_pipeline("image-classification", ai.SCENE_MODEL, backend),
+        "object": runtimes.build_pipeline("object-detection", ai.OBJECT_MODEL, backend),
+        "ner": runtimes.build_pipeline("token-classification", ai.NER_MODEL, backend),
+    }
+
+def _run(pipes, images, texts):
+    scene, scene_ms = _timed(pipes["scene"], images)
+    objects, object_ms = _timed(pipes["object"], images)
+    ner, ner_ms = _timed(lambda t: pipes["ner"](t, aggregation_strategy="simple"), texts)
+    tags = [{label["name"] for label in ai._merge_tags(s, o)} for s, o in zip(scene, objects)]
+    locations = ["".join(e["word"] for e in r if e["entity_group"] in ("LOC", "address", "ORG")) for r in ner]
+    return {"scene": scene, "tags": tags, "locations": locations, "image_ms": scene_ms + object_ms, "text_ms": ner_ms}
+
+def _jaccard(a, b):
+    return 1.0 if not a and not b else len(a & b) / len(a | b)
+
+def _mean(values):
+    return sum(values) / len(values) if values else float("nan")
+
+def load_inputs(image_dir, limit):
+    # 内容寻址存储按 ab/cd/<哈希> 分目录存放，要递归找 (老图片是平铺在顶层的)
+    images = sorted(os.path.join(dirpath, n) for dirpath, _, names in os.walk(image_dir) for n in names if is_image_name(n))[:limit]
+    db = database.SessionLocal()
+    try:
+        rows = db.query(models.Image.description).filter(models.Image.description.isnot(None)).distinct().limit(limit).all()
+    finally: db.close()
+    return images, [r.description for r in rows if r.description.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="对比推理后端与 float32 PyTorch 的输出")
+    parser.add_argument("--backend", choices=[b for b in runtimes.BACKENDS if b != "torch"], default="quantized")
+    parser.add_argument("--images", default="static/originals")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--min-agreement", type=float, default=0.95, help="标签集合完全一致的图片占比下限")
+    args = parser.parse_args()
+
+    images, texts = load_inputs(args.images, args.limit)
+    if not images and not texts: sys.exit("没有可对比的图片或描述")
+    print(f"图片 {len(images)} 张，描述 {len(texts)} 条")
+
+    base = _run(_build("torch"), images, texts)
+    cand = _run(_build(args.backend), images, texts)
+
+    top1 = [b[0]["label"] == c[0]["label"] for b, c in zip(base["scene"], cand["scene"]) if b and c]
+    score_diff = [abs(b[0]["score"] - c[0]["score"]) for b, c in zip(base["scene"], cand["scene"]) if b and c]
+    tag_exact = [b == c for b, c in zip(base["tags"], cand["tags"])]
+    tag_jaccard = [_jaccard(b, c) for b, c in zip(base["tags"], cand["tags"])]
+    loc_exact = [b == c for b, c in zip(base["locations"], cand["locations"])]
+
+    print(f"\n{'指标':<24}{'torch':>12}{args.backend:>12}")
+    print(f"{'图片耗时 (ms/张)':<24}{base['image_ms']:>12.1f}{cand['image_ms']:>12.1f}")
+    print(f"{'文本耗时 (ms/条)':<24}{base['text_ms']:>12.1f}{cand['text_ms']:>12.1f}")
+    print(f"\n场景 top-1 一致率        {_mean(top1):.3f}")
+    print(f"场景 top-1 分数平均偏差  {_mean(score_diff):.4f}")
+    print(f"标签集合完全一致率      {_mean(tag_exact):.3f}")
+    print(f"标签集合平均 Jaccard     {_mean(tag_jaccard):.3f}")
+    print(f"地点提取一致率          {_mean(loc_exact):.3f}")
+    for path, b, c in zip(images, base["tags"], cand["tags"]):
+        if b != c: print(f"  ≠ {os.path.basename(path)}: {sorted(b)} -> {sorted(c)}")
+
+    if tag_exact and _mean(tag_exact) < args.min_agreement:
+        sys.exit(f"标签一致率低于 {args.min_agreement}")
+
+if __name__ == "__main__":
+    main()
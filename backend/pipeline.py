@@ -0,0 +1,124 @@
+# backend/pipeline.py
+# 后台分阶段入库流水线：上传接口只负责落盘建档，其余处理在这里排队完成
+# 队列和进行中的任务只在本进程内存里；任务状态每次变化都交给 on_update 落库，别的 worker 也能查到
+import os
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import metrics
+
+# 配置：每个阶段的队列深度、内存里保留的历史任务数 (各阶段并发数由调用方传入)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+INGEST_JOB_RETENTION_DAYS = int(os.getenv("INGEST_JOB_RETENTION_DAYS", "7"))  # 库里已结束的任务保留天数，启动时清理
+
+jobs_finished = metrics.Counter("photo_ingest_jobs", "结束的入库任务数", "status")
+
+class IngestPipeline:
+    """
+    stages: [(阶段名, async handler(job), 并发数), ...]
+    每个阶段一个有界队列 + 若干 worker，handler 直接修改 job 字典，
+    成功后交给下一阶段；任一阶段抛异常则任务标记为 failed。
+    on_update(job) 是 async 回调，任务登记、进入每个阶段、结束时各调用一次 (用来把状态写库)。
+    """
+    def __init__(self, stages, queue_size: int = INGEST_QUEUE_SIZE, on_failed=None, on_update=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_failed = on_failed
+        self.on_update = on_update
+        self.queues: list[asyncio.Queue] = []
+        self.jobs: OrderedDict[str, dict] = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        if self._tasks: return
+        self.queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for index, (name, handler, concurrency) in enumerate(self.stages):
+            for _ in range(max(1, concurrency)):
+                self._tasks.append(asyncio.create_task(self._worker(index)))
+
+    async def stop(self):
+        for task in self._tasks: task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def full(self) -> bool:
+        return bool(self.queues) and self.queues[0].full()
+
+    def depths(self) -> dict:
+        return {name: q.qsize() for (name, _, _), q in zip(self.stages, self.queues)}
+
+    def _new_job(self, **fields) -> dict:
+        job = {"job_id": uuid.uuid4().hex, "status": "pending", "stage": None, "error": None,
+               "created_at": datetime.now(), **fields}
+        self.jobs[job["job_id"]] = job
+        self._trim()
+        return job
+
+    async def update(self, job: dict):
+        """
+        把任务当前状态交给 on_update；写库失败不影响任务本身。
+        同一个任务的写入逐个进行 (登记时的写入可能和第一阶段的写入同时发生)，后写的总是更新的状态
+        """
+        if self.on_update is None: return
+        async with job.setdefault("save_lock", asyncio.Lock()):
+            try: await self.on_update(job)
+            except Exception as e: print(f"任务状态保存失败 {job['job_id']}: {e}")
+
+    async def register(self, **fields) -> dict:
+        """只登记任务 (供不走流水线的任务，如批量导入，复用 /jobs 查询)"""
+        job = self._new_job(**fields)
+        await self.update(job)
+        return job
+
+    async def submit(self, **fields) -> dict:
+        """登记任务并放入第一阶段；队列已满时抛 asyncio.QueueFull"""
+        if not self._tasks: self.start()
+        if self.queues[0].full(): raise asyncio.QueueFull()
+        # 先入队再落库：检查和入队之间不能让出事件循环，否则别的请求可能把队列塞满
+        job = self._new_job(**fields)
+        self.queues[0].put_nowait(job)
+        await self.update(job)
+        return job
+
+    def get(self, job_id: str):
+        """本进程的任务 (内存里的最新状态)；别的 worker 的任务调用方去库里查"""
+        return self.jobs.get(job_id)
+
+    def _trim(self):
+        # 只淘汰已结束的旧任务，进行中的任务始终可查
+        if len(self.jobs) <= INGEST_JOB_HISTORY: return
+        for job_id in [k for k, j in self.jobs.items() if j["status"] in ("done", "failed")]:
+            if len(self.jobs) <= INGEST_JOB_HISTORY: break
+            del self.jobs[job_id]
+
+    async def _worker(self, index: int):
+        name, handler, _ = self.stages[index]
+        queue = self.queues[index]
+        while True:
+            job = await queue.get()
+            try:
+                job["status"] = "processing"; job["stage"] = name
+                await self.update(job)
+                with metrics.timed(f"ingest_{name}"): await handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job["status"] = "failed"; job["error"] = str(e) or e.__class__.__name__
+                jobs_finished.inc("failed")
+                await self.update(job)
+                if self.on_failed:
+                    try: await self.on_failed(job)
+                    except Exception: pass
+                continue
+            finally:
+                queue.task_done()
+            if index + 1 < len(self.stages):
+                # 下游满了就在这里等，背压一路传回上传接口
+                await self.queues[index + 1].put(job)
+            else:
+                job["status"] = "done"; job["stage"] = None
+                jobs_finished.inc("done")
+                await self.update(job)
@@ -0,0 +1,78 @@
+# backend/runtimes.py
+# 推理后端：同一个模型可以用三种方式运行，对外都是 transformers pipeline 的调用方式
+#   torch     原始 float32 PyTorch (默认，精度基准)
+#   quantized 对 Linear 层做 int8 动态量化，CPU 上更快、内存约减半
+#   onnx      导出为 ONNX 交给 onnxruntime 运行 (需要 optimum[onnxruntime])；
+#             optimum 不支持的任务 (DETR 物体检测) 退回 quantized
+import os
+
+BACKENDS = ("torch", "quantized", "onnx")
+AI_BACKEND = os.getenv("AI_BACKEND", "torch")
+AI_NUM_THREADS = int(os.getenv("AI_NUM_THREADS", "0"))              # 单个算子内的线程数，0 = 框架默认 (物理核数)
+AI_INTEROP_THREADS = int(os.getenv("AI_INTEROP_THREADS", "0"))      # 算子间并行的线程数，0 = 框架默认
+ONNX_TASKS = ("image-classification", "token-classification")
+
+if AI_BACKEND not in BACKENDS: raise ValueError(f"AI_BACKEND 只能是 {', '.join(BACKENDS)}")
+
+def onnx_dir() -> str:
+    """导出的 ONNX 模型和模型缓存放在一起，第二次启动直接加载"""
+    return os.path.join(os.environ.get("HF_HOME", "models"), "onnx")
+
+def version_suffix(backend: str = AI_BACKEND) -> str:
+    """非默认后端的输出会有细微差别，结果缓存按后端分开"""
+    return "" if backend == "torch" else f"#{backend}"
+
+_threads_configured = False
+
+def configure_threads():
+    global _threads_configured
+    if _threads_configured or not (AI_NUM_THREADS or AI_INTEROP_THREADS): return
+    import torch
+    if AI_NUM_THREADS: torch.set_num_threads(AI_NUM_THREADS)
+    if AI_INTEROP_THREADS:
+        try: torch.set_num_interop_threads(AI_INTEROP_THREADS)
+        except RuntimeError: pass  # 已经跑过并行算子后不允许再改
+    _threads_configured = True
+
+def quantize(model):
+    """int8 动态量化：权重离线量化，激活值运行时按批量化，不需要校准数据"""
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def _onnx_pipeline(task: str, model_name: str):
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForImageClassification, ORTModelForTokenClassification
+    from optimum.pipelines import pipeline as ort_pipeline
+    from transformers import AutoImageProcessor, AutoTokenizer
+
+    model_cls, processor_cls = {
+        "image-classification": (ORTModelForImageClassification, AutoImageProcessor),
+        "token-classification": (ORTModelForTokenClassification, AutoTokenizer),
+    }[task]
+    options = onnxruntime.SessionOptions()
+    if AI_NUM_THREADS: options.intra_op_num_threads = AI_NUM_THREADS
+    if AI_INTEROP_THREADS: options.inter_op_num_threads = AI_INTEROP_THREADS
+
+    path = os.path.join(onnx_dir(), model_name.replace("/", "--"))
+    if not os.path.isdir(path):
+        print(f"   - 导出 ONNX: {model_name} -> {path}")
+        model_cls.from_pretrained(model_name, export=True).save_pretrained(path)
+        processor_cls.from_pretrained(model_name).save_pretrained(path)
+    model = model_cls.from_pretrained(path, session_options=options)
+    processor = processor_cls.from_pretrained(path)
+    if task == "token-classification":
+        return ort_pipeline(task, model=model, tokenizer=processor, accelerator="ort")
+    return ort_pipeline(task, model=model, image_processor=processor, accelerator="ort")
+
+def build_pipeline(task: str, model_name: str, backend: str = AI_BACKEND):
+    """按后端构建 pipeline；ONNX 不可用时退回 int8 量化的 PyTorch"""
+    from transformers import pipeline
+    configure_threads()
+    if backend == "onnx":
+        if task in ONNX_TASKS:
+            try: return _onnx_pipeline(task, model_name)
+            except Exception as e: print(f"ONNX 后端不可用，{model_name} 改用 int8 量化: {e}")
+        backend = "quantized"
+    pipe = pipeline(task, model=model_name)
+    if backend == "quantized": pipe.model = quantize(pipe.model)
+    return pipe
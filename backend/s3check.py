@@ -0,0 +1,110 @@
+# backend/s3check.py
+# STORAGE_BACKEND=s3 的冒烟检查：对着本地的 S3 替身跑一遍存储流程，不碰真实数据和真实的桶。
+#   python s3check.py                                   用 moto 在本进程里起一个 S3 替身 (pip install "moto[server]")
+#   python s3check.py --endpoint http://localhost:9000  用已经在跑的 MinIO 之类 (AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY 自行设置)
+# 检查的内容：publish 同步原图/缩略图/衍生图；本地缓存缺失时 /variants 和 /static 指向的远端地址可用；
+# 同内容文件 place 之后、入库之前，删掉最后一张引用它的图片不会删掉文件；引用归零后远端对象 (含本地已不存在的衍生图) 全部删除。
+# 需要 boto3；全部通过时退出码为 0。
+import os
+import sys
+import glob
+import shutil
+import argparse
+import tempfile
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def check(condition, message):
+    print(("  ✅ " if condition else "  ❌ ") + message)
+    if not condition: raise SystemExit(1)
+
+def make_image(path):
+    from PIL import Image as PILImage
+    img = PILImage.new("RGB", (2400, 1600))
+    for x in range(0, 2400, 100): img.paste((x % 255, 80, 255 - x % 255), (x, 0, x + 50, 1600))
+    img.save(path, "JPEG")
+
+def run(endpoint: str, bucket: str):
+    # 存储、数据库都用相对路径，先切到临时目录再导入
+    os.environ.update(STORAGE_BACKEND="s3", S3_BUCKET=bucket, S3_ENDPOINT_URL=endpoint, DATABASE_URL="sqlite:///./photos.db")
+    sys.path.insert(0, BACKEND_DIR)
+    from sqlalchemy import text
+    import database, migrations, models, schemas, crud, storage, imaging, uploads
+
+    migrations.run_migrations(database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+    client = storage.backend.client
+    client.create_bucket(Bucket=bucket)
+    def keys(): return {obj["Key"] for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket) for obj in page.get("Contents", [])}
+
+    db = database.SessionLocal()
+    user = crud.create_user(db, schemas.UserCreate(username="s3check", email="s3check@example.com", password="s3check-password"))
+
+    def store():
+        src = "source.jpg"
+        if not os.path.exists(src): make_image(src)
+        tmp = storage.temp_path()
+        with open(src, "rb") as f: content_hash = uploads.save_stream(f, tmp)
+        return storage.place(tmp, content_hash, src), content_hash
+
+    print("1. 上传、处理、同步到对象存储")
+    name, content_hash = store()
+    info = imaging.process_image(storage.original_path(name), storage.thumbnail_path(name), storage.variant_stem(name))
+    first = crud.create_user_image(db, schemas.ImageBase(description=None), user.id, name, name, info["resolution"], content_hash=content_hash)
+    storage.release(name)
+    storage.publish(name)
+    local_variants = glob.glob(glob.escape(storage._variant_prefix(name)) + "*")
+    remote = keys()
+    check(f"originals/{name}" in remote and f"thumbnails/{name}" in remote, "原图和缩略图已上传")
+    check(len(local_variants) > 0 and all(os.path.relpath(p, storage.STORAGE_ROOT).replace(os.sep, "/") in remote for p in local_variants), f"{len(local_variants)} 个衍生图已上传")
+
+    print("2. 本地缓存缺失时从远端读取")
+    for path in local_variants + [storage.original_path(name)]: os.remove(path)
+    for path in (local_variants[0], storage.original_path(name)):
+        with urllib.request.urlopen(storage.remote_url(path)) as response: body = response.read()
+        check(response.status == 200 and len(body) > 0, f"远端地址可读: {os.path.basename(path)}")
+
+    print("3. place 之后、入库之前删掉最后一张引用它的图片")
+    again, _ = store()  # 同内容：只占一个引用
+    crud.delete_image_by_id(db, first)  # 引用数 2 -> 1，collect 不会删
+    check(f"originals/{name}" in keys() and os.path.exists(storage.original_path(again)), "文件仍在 (本地和远端)")
+    second = crud.create_user_image(db, schemas.ImageBase(description=None), user.id, again, again, info["resolution"], content_hash=content_hash)
+    storage.release(again)
+    check(db.execute(text("SELECT refcount FROM blobs WHERE name = :n"), {"n": again}).scalar() == 1, "引用数为 1")
+
+    print("4. 引用归零后删除")
+    crud.delete_image_by_id(db, second)
+    prefix = f"{name.rsplit('.', 1)[0]}"
+    check(not any(prefix in key for key in keys()), "远端的原图、缩略图、衍生图都已删除")
+    check(not os.path.exists(storage.original_path(name)), "本地文件已删除")
+    db.close()
+    print("全部通过")
+
+def main():
+    parser = argparse.ArgumentParser(description="对本地 S3 替身跑一遍内容寻址存储的同步/删除流程")
+    parser.add_argument("--endpoint", help="已在运行的 S3 兼容服务地址；不给则用 moto 起一个")
+    parser.add_argument("--bucket", default="photo-s3check")
+    args = parser.parse_args()
+
+    server = None
+    if not args.endpoint:
+        from moto.server import ThreadedMotoServer
+        server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+        server.start()
+        host, port = server.get_host_and_port()
+        args.endpoint = f"http://{host}:{port}"
+        for key in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"): os.environ.setdefault(key, "testing")
+        os.environ.setdefault("S3_REGION", "us-east-1")
+
+    workdir = tempfile.mkdtemp(prefix="s3check-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try: run(args.endpoint, args.bucket)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if server: server.stop()
+
+if __name__ == "__main__":
+    main()
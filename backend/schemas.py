@@ -33,11 +33,92 @@ class ImageResponse(ImageBase):
     thumbnail: str
     capture_date: Optional[datetime]
     location: Optional[str]
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     resolution: Optional[str]
     ai_tags: Optional[str]
     class Config:
         from_attributes = True
 
+# 图库网格视图用的精简字段
+class ImageThumb(BaseModel):
+    id: int
+    thumbnail: str
+    upload_time: Optional[datetime] = None
+    capture_date: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
+# --- 地图 / 时间线 ---
+class MapImage(ImageThumb):
+    latitude: float
+    longitude: float
+
+# 瓦片内的一个聚类点：坐标是格内图片的平均位置，image_id/thumbnail 是格内最新的一张
+class MapCluster(BaseModel):
+    count: int
+    latitude: float
+    longitude: float
+    image_id: int
+    thumbnail: Optional[str] = None
+
+class TimelineBucket(BaseModel):
+    period: str  # 2024 / 2024-05 / 2024-05-01
+    count: int
+
+# 相似图片：带上与查询图片的感知哈希距离 (0 为几乎一样)
+class SimilarImage(ImageResponse):
+    distance: int
+
+# 一组近似重复，images[0] 分辨率最高
+class DuplicateCluster(BaseModel):
+    size: int
+    images: list[ImageResponse]
+
+# --- 标签模型 ---
+class TagCreate(BaseModel):
+    tag_name: str
+
+class TagResponse(TagCreate):
+    confidence: Optional[float] = None
+    source: Optional[str] = None
+    class Config:
+        from_attributes = True
+
+class TagFacet(BaseModel):
+    tag_name: str
+    count: int
+    class Config:
+        from_attributes = True
+
+# --- 后台任务模型 ---
+class JobResponse(BaseModel):
+    job_id: str
+    image_id: Optional[int] = None  # 批量导入任务没有单张图片
+    status: str                   # pending / processing / done / failed
+    stage: Optional[str] = None   # 当前所处阶段
+    error: Optional[str] = None
+    report: Optional[dict] = None # 批量导入结果：{total, succeeded, failed: [{filename, error}]}
+
+class ImportRequest(BaseModel):
+    path: str                     # IMPORT_ROOT 下的目录或 zip 包
+    client_id: Optional[str] = None
+    description: Optional[str] = None
+
+# --- 断点续传模型 ---
+class UploadCreate(BaseModel):
+    filename: str
+    length: int                   # 文件总字节数
+    description: Optional[str] = None
+    client_id: Optional[str] = None  # 用于 WebSocket 推送进度
+
+class UploadStatus(BaseModel):
+    upload_id: str
+    offset: int
+    length: int
+    class Config:
+        from_attributes = True
+
 # --- Token 模型 ---
 class Token(BaseModel):
     access_token: str
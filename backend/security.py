@@ -1,4 +1,5 @@
 # backend/security.py
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -8,9 +9,10 @@ from passlib.context import CryptContext
 SECRET_KEY = "my_secret_key_for_photo_project_change_this"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # Token 有效期30分钟
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # 每加 1 哈希耗时翻倍；调整后旧密码在下次登录时自动按新强度重算
 
 # 密码哈希上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 # 1. 验证密码：比较用户输入的明文密码和数据库里的哈希密码是否匹配
 def verify_password(plain_password, hashed_password):
@@ -20,6 +22,10 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# 验证密码的同时检查哈希强度是否过时：返回 (是否匹配, 需要更新时的新哈希或 None)
+def verify_and_update(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 # 3. 创建 Token：把用户信息（比如 user_id）打包加密成一个字符串
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -0,0 +1,125 @@
+# backend/similar.py
+# 近似重复：按感知哈希 (imaging.dhash) 的汉明距离找相似图片。
+# 多索引哈希：64 位哈希切成 4 段 16 位 (images.ph0..ph3，各有 (user_id, phN) 索引)。
+# 两张图距离 <= d 时，按抽屉原理至少有一段的距离 <= d // 4，所以只查这些段值的邻域，再精确算距离。
+# 分段字段随 phash 的写入由映射事件同步 (同 fts.py / storage.py 的做法)。
+import os
+from itertools import combinations
+
+from sqlalchemy import event, or_
+
+import models
+
+BANDS = 4
+BAND_BITS = 16
+SIMILAR_DISTANCE = int(os.getenv("SIMILAR_DISTANCE", "10"))               # 相似图片接口的默认距离
+DUPLICATE_DISTANCE = int(os.getenv("DUPLICATE_DISTANCE", "6"))            # 重复分组报告的默认距离
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "0"))  # 距离在此之内直接沿用已有图片的 AI 标签，0 = 不复用 (默认)，建议 4
+MAX_DISTANCE = 15  # 段内邻域随距离组合增长，再大就不划算了
+MIN_HASH_BITS = 8  # 纯色、低纹理图片的哈希几乎全 0 (或全 1)，彼此距离都很近却毫不相干，不参与标签复用
+REUSABLE_SOURCES = ("scene", "object")
+
+def bands(phash: str) -> list[int]:
+    value = int(phash, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * (BANDS - 1 - i))) & mask for i in range(BANDS)]
+
+def distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def distinctive(phash: str) -> bool:
+    """哈希里 0 和 1 都足够多，才能说明“距离近 = 画面像”"""
+    if not phash: return False
+    ones = bin(int(phash, 16)).count("1")
+    return MIN_HASH_BITS <= ones <= BANDS * BAND_BITS - MIN_HASH_BITS
+
+def _neighbors(value: int, radius: int) -> list[int]:
+    """与 value 汉明距离 <= radius 的全部 16 位值"""
+    out = [value]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), r):
+            flipped = value
+            for b in bits: flipped ^= 1 << b
+            out.append(flipped)
+    return out
+
+def _sync_bands(mapper, connection, target):
+    values = bands(target.phash) if target.phash else [None] * BANDS
+    for i, value in enumerate(values): setattr(target, f"ph{i}", value)
+
+event.listen(models.Image, "before_insert", _sync_bands)
+event.listen(models.Image, "before_update", _sync_bands)
+
+def find_similar(db, user_id: int, phash: str, max_distance: int = SIMILAR_DISTANCE, exclude_id: int = None, limit: int = 50):
+    """同一用户下与 phash 距离 <= max_distance 的图片，按距离从近到远，返回 [(image, distance), ...]"""
+    max_distance = max(0, min(max_distance, MAX_DISTANCE))
+    radius = max_distance // BANDS
+    query = db.query(models.Image).filter(
+        models.Image.user_id == user_id,
+        or_(*[getattr(models.Image, f"ph{i}").in_(_neighbors(value, radius)) for i, value in enumerate(bands(phash))]),
+    )
+    if exclude_id is not None: query = query.filter(models.Image.id != exclude_id)
+    hits = [(img, distance(phash, img.phash)) for img in query]
+    hits = sorted((h for h in hits if h[1] <= max_distance), key=lambda h: (h[1], -h[0].id))
+    return hits[:limit]
+
+def near_duplicate_labels(db, user_id: int, phash: str, max_distance: int = NEAR_DUPLICATE_DISTANCE, exclude_id: int = None):
+    """最近的、已有 AI 标签的近似重复图片的识别结果 ([{name, confidence, source}, ...])，没有则返回 None"""
+    if max_distance <= 0 or not distinctive(phash): return None
+    for img, _ in find_similar(db, user_id, phash, max_distance, exclude_id, limit=20):
+        labels = [{"name": t.tag_name, "confidence": t.confidence, "source": t.source} for t in img.tags if t.source in REUSABLE_SOURCES]
+        if labels: return labels
+    return None
+
+def near_duplicate_labels_many(db, user_id: int, phashes: list, max_distance: int = NEAR_DUPLICATE_DISTANCE):
+    return [near_duplicate_labels(db, user_id, phash, max_distance) for phash in phashes]
+
+def leaders(phashes: list, max_distance: int = NEAR_DUPLICATE_DISTANCE) -> list[int]:
+    """同一批里的近似重复：每项指向批内第一张与它足够接近的图片 (自己就是第一张时指向自己)"""
+    lead = list(range(len(phashes)))
+    if max_distance <= 0: return lead
+    for k, phash in enumerate(phashes):
+        if not distinctive(phash): continue
+        for j in range(k):
+            if lead[j] == j and distinctive(phashes[j]) and distance(phash, phashes[j]) <= max_distance:
+                lead[k] = j; break
+    return lead
+
+def _pixels(resolution: str) -> int:
+    try:
+        w, h = resolution.split("x"); return int(w) * int(h)
+    except (AttributeError, ValueError): return 0
+
+def duplicate_clusters(db, user_id: int, max_distance: int = DUPLICATE_DISTANCE, limit: int = 100):
+    """
+    用户图库里的近似重复分组 (并查集，距离传递)：只比较分段落在邻域内的候选对，不做两两全比较。
+    每组按像素数从大到小排，第一张通常就是该保留的；组按大小从大到小返回。
+    """
+    max_distance = max(0, min(max_distance, MAX_DISTANCE))
+    radius = max_distance // BANDS
+    rows = db.query(models.Image.id, models.Image.phash).filter(models.Image.user_id == user_id, models.Image.phash.isnot(None)).all()
+    hashes = [int(phash, 16) for _, phash in rows]
+    buckets = {}
+    for idx, (_, phash) in enumerate(rows):
+        for i, value in enumerate(bands(phash)): buckets.setdefault((i, value), []).append(idx)
+
+    parent = list(range(len(rows)))
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]; x = parent[x]
+        return x
+
+    for idx, (_, phash) in enumerate(rows):
+        for i, value in enumerate(bands(phash)):
+            for neighbor in _neighbors(value, radius):
+                for other in buckets.get((i, neighbor), ()):
+                    if other <= idx: continue
+                    a, b = find(idx), find(other)
+                    if a != b and bin(hashes[idx] ^ hashes[other]).count("1") <= max_distance: parent[b] = a
+
+    groups = {}
+    for idx in range(len(rows)): groups.setdefault(find(idx), []).append(rows[idx][0])
+    clusters = sorted((ids for ids in groups.values() if len(ids) > 1), key=len, reverse=True)[:limit]
+    if not clusters: return []
+    by_id = {img.id: img for img in db.query(models.Image).filter(models.Image.id.in_([i for ids in clusters for i in ids]))}
+    return [sorted((by_id[i] for i in ids), key=lambda img: (-_pixels(img.resolution), img.id)) for ids in clusters]
@@ -0,0 +1,198 @@
+# backend/storage.py
+# 内容寻址存储：原图按 SHA-256 存成 originals/ab/cd/<sha256>.jpg，同样的内容只存一份，
+# 每个目录的文件数也有上限；缩略图、衍生图沿用同一个分片路径。
+# blobs 表记录每份原图被多少张图片引用，随 models.Image 的增删改在同一事务里维护 (同 fts.py 的做法)，
+# 引用数归零后 collect() 才删除原图、缩略图和衍生图。
+# place() 收下文件时先替调用方占一个引用 (pin)，建档提交后再 release()：这样从“发现同内容的文件已存在”
+# 到“新图片行入库”之间，别的请求删掉最后一张引用它的图片也不会把文件删掉。
+# place() 和 collect() 在同一把跨进程文件锁里进行，文件的存在与否和 blobs 表始终一致。
+# 存储改造前的老图片 (content_hash 为空) 仍是平铺的 uuid 文件，删除时单独处理。
+#
+# STORAGE_BACKEND=s3 时处理完的文件再同步到 S3 兼容的对象存储 (本地用 s3check.py 对着 moto / MinIO 替身检查)，
+# 本地目录只作为处理和读取的缓存，缺失时 /static 重定向到对象存储。
+import os
+import glob
+import uuid
+import mimetypes
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import attributes
+
+import models
+import imaging
+import database
+from locks import file_lock
+
+STORAGE_ROOT = "static"
+ORIGINALS_DIR = os.path.join(STORAGE_ROOT, "originals")
+THUMBNAILS_DIR = os.path.join(STORAGE_ROOT, "thumbnails")
+# 上传过程中的临时文件，算完哈希后移入 originals：不能在 /static 下面 (会被公开访问)，但要和它在同一个文件系统上
+TMP_DIR = os.getenv("STORAGE_TMP_DIR", "tmp")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local / s3
+
+BLOB_LOCK = os.path.join(TMP_DIR, "blobs.lock")
+
+for d in (ORIGINALS_DIR, THUMBNAILS_DIR, TMP_DIR): os.makedirs(d, exist_ok=True)
+
+# --- 路径 ---
+def normalize_ext(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lstrip(".").lower()
+    ext = {"jpeg": "jpg", "tiff": "tif"}.get(ext, ext)
+    return ext if ext.isalnum() and len(ext) <= 5 else "jpg"
+
+def blob_name(content_hash: str, ext: str) -> str:
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.{ext}"
+
+def original_path(name: str) -> str:
+    return os.path.join(ORIGINALS_DIR, name)
+
+def thumbnail_path(name: str) -> str:
+    return os.path.join(THUMBNAILS_DIR, name)
+
+def variant_stem(name: str) -> str:
+    """衍生图文件名前缀，和原图同一个分片目录"""
+    return os.path.splitext(name)[0]
+
+def temp_path() -> str:
+    return os.path.join(TMP_DIR, uuid.uuid4().hex)
+
+_BLOB_BY_HASH = text("SELECT name FROM blobs WHERE content_hash = :hash ORDER BY refcount DESC LIMIT 1")
+
+def place(tmp_path: str, content_hash: str, filename: str) -> str:
+    """
+    把已写完并算好哈希的临时文件收进内容寻址目录，返回文件名；同内容已存在时直接丢掉临时文件。
+    扩展名按文件内容判断，客户端的文件名只在认不出格式时兜底：改了扩展名或没有扩展名的同一份内容也只存一份。
+    返回时已替调用方占了一个引用，图片行提交 (或放弃) 之后必须调用 release()。
+    """
+    ext = imaging.sniff_ext(tmp_path) or normalize_ext(filename)
+    with file_lock(BLOB_LOCK):
+        with database.engine.begin() as connection:
+            # 同内容已有文件 (包括以前按客户端扩展名存下的文件) 就沿用它的名字
+            name = connection.execute(_BLOB_BY_HASH, {"hash": content_hash}).scalar() or blob_name(content_hash, ext)
+            dst = original_path(name)
+            if os.path.exists(dst):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(tmp_path, dst)
+            _incref(connection, name, content_hash)
+    return name
+
+# --- 后端 ---
+class LocalBackend:
+    remote = False
+    def put(self, path: str): pass
+    def delete(self, path: str): pass
+    def delete_prefix(self, path: str): pass
+    def url(self, rel: str): return None
+
+class S3Backend:
+    """S3 兼容对象存储，对象键与 static/ 下的相对路径一致"""
+    remote = True
+
+    def __init__(self):
+        import boto3
+        self.bucket = os.environ["S3_BUCKET"]
+        self.public_url = os.getenv("S3_PUBLIC_URL", "").rstrip("/")  # 桶可公开读或前面有 CDN 时直接拼地址，否则用预签名链接
+        self.client = boto3.client("s3", endpoint_url=os.getenv("S3_ENDPOINT_URL") or None, region_name=os.getenv("S3_REGION") or None)
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(path, STORAGE_ROOT).replace(os.sep, "/")
+
+    def put(self, path: str):
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.client.upload_file(path, self.bucket, self._key(path), ExtraArgs={"ContentType": content_type, "CacheControl": "public, max-age=31536000, immutable"})
+
+    def delete(self, path: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(path))
+
+    def delete_prefix(self, path: str):
+        """删除键以 path 对应前缀开头的全部对象 (本地已经没有副本的衍生图也能删掉)"""
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self._key(path)):
+            keys = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if keys: self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys, "Quiet": True})
+
+    def url(self, rel: str):
+        if self.public_url: return f"{self.public_url}/{rel}"
+        return self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": rel}, ExpiresIn=3600)
+
+backend = S3Backend() if STORAGE_BACKEND == "s3" else LocalBackend()
+
+def remote_url(path: str):
+    """本地缺失的文件在对象存储上的地址；本地后端返回 None"""
+    if not backend.remote: return None
+    return backend.url(os.path.relpath(path, STORAGE_ROOT).replace(os.sep, "/"))
+
+def _variant_prefix(name: str) -> str:
+    return imaging.variant_path(variant_stem(name)) + "_"
+
+def _files(name: str) -> list[str]:
+    """一份原图对应的本地文件：原图、缩略图，以及同一前缀的各尺寸/格式衍生图"""
+    return [original_path(name), thumbnail_path(name)] + glob.glob(glob.escape(_variant_prefix(name)) + "*")
+
+def publish(name: str):
+    """处理完成后把原图、缩略图、衍生图同步到远端 (本地后端什么都不做)"""
+    if not backend.remote: return
+    for path in _files(name):
+        if os.path.exists(path): backend.put(path)
+
+def remove_files(name: str):
+    for path in _files(name):
+        try: os.remove(path)
+        except FileNotFoundError: pass
+    if not backend.remote: return
+    # 远端按对象键删除，不依赖本地缓存里还剩哪些文件
+    try:
+        for path in (original_path(name), thumbnail_path(name)): backend.delete(path)
+        backend.delete_prefix(_variant_prefix(name))
+    except Exception as e: print(f"远端删除失败 {name}: {e}")
+
+# --- 引用计数 (与 models.Image 的增删改同一事务) ---
+_INCREF = text(
+    "INSERT INTO blobs (name, content_hash, size, refcount, created_at) VALUES (:name, :hash, :size, 1, CURRENT_TIMESTAMP) "
+    "ON CONFLICT (name) DO UPDATE SET refcount = blobs.refcount + 1"
+)
+_DECREF = text("UPDATE blobs SET refcount = refcount - 1 WHERE name = :name")
+
+def _incref(connection, name, content_hash):
+    path = original_path(name)
+    connection.execute(_INCREF, {"name": name, "hash": content_hash, "size": os.path.getsize(path) if os.path.exists(path) else None})
+
+@event.listens_for(models.Image, "after_insert")
+def _after_insert(mapper, connection, target):
+    if target.content_hash: _incref(connection, target.filename, target.content_hash)
+
+@event.listens_for(models.Image, "after_update")
+def _after_update(mapper, connection, target):
+    name_hist = attributes.get_history(target, "filename")
+    hash_hist = attributes.get_history(target, "content_hash")
+    if not (name_hist.has_changes() or hash_hist.has_changes()): return
+    old_name = name_hist.deleted[0] if name_hist.deleted else target.filename
+    old_hash = hash_hist.deleted[0] if hash_hist.deleted else target.content_hash
+    if old_hash: connection.execute(_DECREF, {"name": old_name})
+    if target.content_hash: _incref(connection, target.filename, target.content_hash)
+
+@event.listens_for(models.Image, "after_delete")
+def _after_delete(mapper, connection, target):
+    if target.content_hash: connection.execute(_DECREF, {"name": target.filename})
+
+def collect(db, names) -> int:
+    """删除引用数已归零的原图及其缩略图/衍生图，返回实际删除的份数；仍被别的图片引用 (或被 place 占着) 的不动"""
+    removed = []
+    with file_lock(BLOB_LOCK):
+        for name in set(names):
+            if db.execute(text("DELETE FROM blobs WHERE name = :name AND refcount <= 0"), {"name": name}).rowcount: removed.append(name)
+        db.commit()
+        for name in removed: remove_files(name)
+    return len(removed)
+
+def sweep(names):
+    """用单独的会话执行 collect，供手里没有会话的调用方 (放在线程池里调用)"""
+    db = database.SessionLocal()
+    try: return collect(db, names)
+    finally: db.close()
+
+def release(name: str):
+    """归还 place() 占的引用；此时已没有图片引用它 (如入库前就失败) 则删除文件"""
+    with database.engine.begin() as connection: connection.execute(_DECREF, {"name": name})
+    sweep([name])
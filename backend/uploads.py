@@ -0,0 +1,168 @@
+# backend/uploads.py
+# 分片/断点续传 (tus 风格)：创建会话 → PATCH 按偏移追加 → finalize 交给入库流水线
+# 数据边收边写盘、边算 SHA-256，内存占用只有一个写缓冲；
+# 会话元数据落在 .json 里。多 worker 部署时同一个上传的请求可能落到不同进程，所以不在内存里记偏移：
+# 偏移永远是 .part 文件的实际大小，写入和 finalize 都在跨进程文件锁里进行；
+# 各进程只缓存自己算到哪里的哈希状态，别的进程写入的部分在下次用到时补读。
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from contextlib import contextmanager
+
+from locks import file_lock, LockBusy
+
+# 不能放在 /static 下面：部分文件和元数据 (用户 id、描述) 不应被公开访问。
+# 需要和 storage.ORIGINALS_DIR 在同一个文件系统上，finalize 时只改名不复制
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))  # 秒，过期未完成的上传会被清理
+WRITE_BUFFER = 1024 * 1024  # 攒够 1MB 再交给线程写盘，减少线程切换
+META_FIELDS = ("upload_id", "user_id", "filename", "length", "description", "client_id")
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+class UploadError(Exception):
+    """status_code 对应返回给客户端的 HTTP 状态码"""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+# 本进程已算到的哈希状态：upload_id -> (hasher, 已计入的字节数)
+_hashers: dict[str, tuple] = {}
+
+class UploadSession:
+    def __init__(self, upload_id: str, user_id: int, filename: str, length: int, description: str = None, client_id: str = None):
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.filename = filename
+        self.length = length
+        self.description = description
+        self.client_id = client_id
+
+    @property
+    def part_path(self): return os.path.join(UPLOAD_DIR, f"{self.upload_id}.part")
+
+    @property
+    def meta_path(self): return os.path.join(UPLOAD_DIR, f"{self.upload_id}.json")
+
+    @property
+    def lock_path(self): return os.path.join(UPLOAD_DIR, f"{self.upload_id}.lock")
+
+    @property
+    def offset(self) -> int:
+        try: return os.path.getsize(self.part_path)
+        except FileNotFoundError: return 0
+
+    def save_meta(self):
+        with open(self.meta_path, "w") as f: json.dump({k: getattr(self, k) for k in META_FIELDS}, f)
+
+    @contextmanager
+    def writing(self):
+        """同一个会话同时只允许一个请求写入 (跨 worker)；正被别的请求写入时返回 423，客户端稍后 HEAD 再续传"""
+        try:
+            with file_lock(self.lock_path, blocking=False):
+                # 拿到锁之前会话可能已被别的请求完成或取消
+                if not os.path.exists(self.meta_path): raise UploadError(404, "上传会话不存在")
+                yield
+        except LockBusy:
+            raise UploadError(423, "该上传正在被另一个请求写入")
+
+    def _hasher(self):
+        """把哈希状态补到 .part 的当前大小 (别的进程写入的部分从文件读)；持有写锁时调用"""
+        hasher, done = _hashers.get(self.upload_id) or (hashlib.sha256(), 0)
+        size = self.offset
+        if done > size: hasher, done = hashlib.sha256(), 0
+        if done < size:
+            with open(self.part_path, "rb") as f:
+                f.seek(done)
+                for chunk in iter(lambda: f.read(WRITE_BUFFER), b""): hasher.update(chunk)
+        _hashers[self.upload_id] = (hasher, size)
+        return hasher
+
+    def _write(self, data: bytes):
+        hasher = self._hasher()
+        with open(self.part_path, "ab") as f: f.write(data)
+        hasher.update(data)
+        _hashers[self.upload_id] = (hasher, self.offset)
+
+    async def append(self, stream):
+        """把请求体流追加到部分文件；连接中断时已写入的部分仍然有效。持有写锁时调用"""
+        offset = self.offset
+        buffer = bytearray()
+        try:
+            async for chunk in stream:
+                if offset + len(buffer) + len(chunk) > self.length:
+                    raise UploadError(413, "超出声明的文件大小")
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER:
+                    await asyncio.to_thread(self._write, bytes(buffer))
+                    offset += len(buffer); buffer.clear()
+        finally:
+            if buffer: await asyncio.to_thread(self._write, bytes(buffer))
+            await asyncio.to_thread(os.utime, self.meta_path)  # 过期清理按元数据的修改时间算
+
+    def discard(self):
+        for path in (self.part_path, self.meta_path, self.lock_path):
+            try: os.remove(path)
+            except FileNotFoundError: pass
+        _hashers.pop(self.upload_id, None)
+
+def save_stream(src, dst_path, max_bytes: int = None):
+    """边写盘边算 SHA-256，返回内容哈希；超过 max_bytes 时删掉已写的部分并抛 413"""
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(dst_path, "wb") as buffer:
+            for chunk in iter(lambda: src.read(WRITE_BUFFER), b""):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes: raise UploadError(413, f"文件超过 {max_bytes} 字节")
+                h.update(chunk); buffer.write(chunk)
+    except BaseException:
+        try: os.remove(dst_path)
+        except FileNotFoundError: pass
+        raise
+    return h.hexdigest()
+
+def create(user_id: int, filename: str, length: int, description: str = None, client_id: str = None) -> UploadSession:
+    if length <= 0 or length > MAX_UPLOAD_BYTES: raise UploadError(413, f"文件大小需在 1 ~ {MAX_UPLOAD_BYTES} 字节之间")
+    cleanup_expired()
+    session = UploadSession(uuid.uuid4().hex, user_id, filename, length, description, client_id)
+    open(session.part_path, "wb").close()
+    session.save_meta()
+    return session
+
+def _load(upload_id: str):
+    """每次都从磁盘读元数据：会话可能由别的 worker 创建、完成或取消"""
+    try:
+        with open(os.path.join(UPLOAD_DIR, f"{upload_id}.json")) as f: meta = json.load(f)
+    except (FileNotFoundError, ValueError): return None
+    return UploadSession(**{k: meta.get(k) for k in META_FIELDS})
+
+async def get(upload_id: str, user_id: int) -> UploadSession:
+    session = await asyncio.to_thread(_load, upload_id) if upload_id.isalnum() else None
+    if session is None or session.user_id != user_id: raise UploadError(404, "上传会话不存在")
+    return session
+
+def finish(session: UploadSession, dst_path: str) -> str:
+    """把完整文件移到正式目录 (同一文件系统内只是改名，不复制)，返回内容哈希。持有写锁时调用"""
+    if session.offset != session.length: raise UploadError(409, f"文件未传完 ({session.offset}/{session.length})")
+    content_hash = session._hasher().hexdigest()
+    os.replace(session.part_path, dst_path)
+    session.discard()
+    return content_hash
+
+def remove(session: UploadSession):
+    session.discard()
+
+def cleanup_expired():
+    now = time.time()
+    for name in os.listdir(UPLOAD_DIR):
+        if not name.endswith(".json"): continue
+        path = os.path.join(UPLOAD_DIR, name)
+        try: expired = now - os.path.getmtime(path) > UPLOAD_SESSION_TTL
+        except FileNotFoundError: continue
+        if expired: UploadSession(name[:-5], None, "", 0).discard()
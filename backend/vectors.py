@@ -0,0 +1,208 @@
+# backend/vectors.py
+# 每个用户一份向量库：float16 内存映射文件 + 倒排聚类 (IVF) 近似最近邻索引
+# 文件布局 (追加写)：
+#   {user_id}.f16  N x EMBED_DIM 的 float16 向量
+#   {user_id}.ids  N 个 int64 图片 id，-1 表示该行已删除
+#   {user_id}.gen  跨进程锁文件，内容是写入计数：多 worker 时每次增删都在锁内进行并把计数加一，
+#                  其它进程读写前发现计数变了就重新读入 ids (追加的行补进聚类，压缩过则重新训练)
+import os
+import threading
+import numpy as np
+
+from locks import file_lock
+
+VECTOR_DIR = os.getenv("VECTOR_DIR", "vectors")
+EMBED_DIM = int(os.getenv("EMBED_DIM", "512"))
+IVF_MIN_SIZE = int(os.getenv("IVF_MIN_SIZE", "5000"))  # 少于这个数量时直接暴力检索，本身就是毫秒级
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))         # 每次查询探测的聚类数
+
+os.makedirs(VECTOR_DIR, exist_ok=True)
+
+class UserIndex:
+    def __init__(self, user_id: int):
+        self.vec_path = os.path.join(VECTOR_DIR, f"{user_id}.f16")
+        self.ids_path = os.path.join(VECTOR_DIR, f"{user_id}.ids")
+        self.gen_path = os.path.join(VECTOR_DIR, f"{user_id}.gen")
+        self.lock = threading.Lock()
+        self.ids = np.empty(0, np.int64)
+        self.rows = {}
+        self._vecs = None
+        self._reset_ivf()
+        with self.lock, file_lock(self.gen_path):
+            self._gen = self._read_gen()
+            self._reload(repair=True)
+
+    def _read_gen(self) -> int:
+        try:
+            with open(self.gen_path, "rb") as f: data = f.read(8)
+        except FileNotFoundError: return 0
+        return int.from_bytes(data, "little") if len(data) == 8 else 0
+
+    def _bump_gen(self):
+        self._gen += 1
+        with open(self.gen_path, "wb") as f: f.write(self._gen.to_bytes(8, "little"))
+
+    def _reload(self, repair: bool = False):
+        """从文件重新读入 ids；持有文件锁时调用"""
+        ids = np.fromfile(self.ids_path, dtype=np.int64) if os.path.exists(self.ids_path) else np.empty(0, np.int64)
+        vec_rows = os.path.getsize(self.vec_path) // (2 * EMBED_DIM) if os.path.exists(self.vec_path) else 0
+        # 两个文件不是原子写入，异常退出后以较短的一方为准
+        n = min(len(ids), vec_rows)
+        if repair and (n < len(ids) or n < vec_rows): self._truncate(n)
+        old_n, old_ids = len(self.ids), self.ids
+        self.ids = ids[:n].copy()
+        self.rows = {int(image_id): row for row, image_id in enumerate(self.ids) if image_id >= 0}
+        self._vecs = None
+        if self.centroids is None: return
+        kept = self.ids[:old_n]
+        if n < old_n or np.any((kept >= 0) & (kept != old_ids)):
+            self._reset_ivf()  # 其它进程压缩过文件，行号全变了
+        else:
+            vecs = self._matrix()
+            for row in range(old_n, n):
+                if self.ids[row] >= 0: self.lists[int(np.argmax(self.centroids @ np.asarray(vecs[row], dtype=np.float32)))].append(row)
+
+    def _sync(self):
+        """其它进程改过文件时重新读入；持有文件锁时调用"""
+        gen = self._read_gen()
+        if gen != self._gen: self._gen = gen; self._reload()
+
+    def _truncate(self, n: int):
+        for path, width in ((self.ids_path, 8), (self.vec_path, 2 * EMBED_DIM)):
+            if os.path.exists(path):
+                with open(path, "r+b") as f: f.truncate(n * width)
+
+    def _reset_ivf(self):
+        self.centroids = None   # nlist x EMBED_DIM
+        self.lists = None       # 每个聚类包含的行号
+        self.trained_n = 0
+
+    def _matrix(self):
+        n = len(self.ids)
+        if self._vecs is None or self._vecs.shape[0] != n:
+            self._vecs = np.memmap(self.vec_path, dtype=np.float16, mode="r", shape=(n, EMBED_DIM)) if n else np.empty((0, EMBED_DIM), np.float16)
+        return self._vecs
+
+    # --- 增删 ---
+    def add(self, image_id: int, vector):
+        with self.lock, file_lock(self.gen_path):
+            self._sync()
+            if image_id in self.rows: self._remove(image_id)
+            with open(self.vec_path, "ab") as f: f.write(np.asarray(vector, dtype=np.float16).tobytes())
+            with open(self.ids_path, "ab") as f: f.write(np.int64(image_id).tobytes())
+            row = len(self.ids)
+            self.ids = np.append(self.ids, np.int64(image_id))
+            self.rows[image_id] = row
+            if self.centroids is not None:
+                self.lists[int(np.argmax(self.centroids @ np.asarray(vector, dtype=np.float32)))].append(row)
+            self._bump_gen()
+
+    def remove(self, image_id: int):
+        with self.lock, file_lock(self.gen_path):
+            self._sync()
+            if image_id not in self.rows: return
+            self._remove(image_id)
+            if len(self.ids) > 1000 and len(self.rows) < 0.75 * len(self.ids): self._compact()
+            self._bump_gen()
+
+    def _remove(self, image_id: int):
+        row = self.rows.pop(image_id, None)
+        if row is None: return
+        self.ids[row] = -1
+        with open(self.ids_path, "r+b") as f:
+            f.seek(row * 8); f.write(np.int64(-1).tobytes())
+
+    def _compact(self):
+        """删除过多时重写文件，只保留有效行"""
+        live = np.nonzero(self.ids >= 0)[0]
+        vecs = np.array(self._matrix()[live])
+        ids = self.ids[live]
+        self._vecs = None
+        for path, data in ((self.vec_path, vecs), (self.ids_path, ids)):
+            with open(path + ".tmp", "wb") as f: f.write(data.tobytes())
+            os.replace(path + ".tmp", path)
+        self.ids = ids
+        self.rows = {int(image_id): row for row, image_id in enumerate(ids)}
+        self._reset_ivf()
+
+    def contains(self, image_id: int) -> bool:
+        with self.lock, file_lock(self.gen_path, shared=True):
+            self._sync()
+            return image_id in self.rows
+
+    def get(self, image_id: int):
+        with self.lock, file_lock(self.gen_path, shared=True):
+            self._sync()
+            row = self.rows.get(image_id)
+            return None if row is None else np.asarray(self._matrix()[row], dtype=np.float32)
+
+    # --- 检索 ---
+    def _train(self):
+        """球面 k-means 训练聚类中心 (采样训练)，再把所有行分配到最近的中心"""
+        rng = np.random.default_rng(0)
+        vecs = self._matrix()
+        live = np.nonzero(self.ids >= 0)[0]
+        nlist = max(1, int(np.sqrt(len(live))))
+        sample = np.sort(rng.choice(live, min(len(live), nlist * 40), replace=False))
+        data = np.asarray(vecs[sample], dtype=np.float32)
+        centroids = data[rng.choice(len(data), nlist, replace=False)]
+        for _ in range(10):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        lists = [[] for _ in range(nlist)]
+        for start in range(0, len(live), 65536):
+            rows = live[start:start + 65536]
+            for row, c in zip(rows, np.argmax(np.asarray(vecs[rows], dtype=np.float32) @ centroids.T, axis=1)):
+                lists[c].append(int(row))
+        self.centroids, self.lists, self.trained_n = centroids, lists, len(live)
+
+    def search(self, vector, k: int, exclude=()):
+        """返回 [(image_id, 相似度), ...]，按相似度从高到低"""
+        q = np.asarray(vector, dtype=np.float32)
+        with self.lock, file_lock(self.gen_path, shared=True):
+            self._sync()
+            if not self.rows: return []
+            vecs = self._matrix()
+            if len(self.rows) < IVF_MIN_SIZE:
+                candidates = np.nonzero(self.ids >= 0)[0]
+            else:
+                # 库翻倍后重新训练，保证聚类大小大致均衡
+                if self.centroids is None or len(self.rows) > 2 * self.trained_n: self._train()
+                probe = np.argsort(-(self.centroids @ q))[:IVF_NPROBE]
+                candidates = np.array([row for c in probe for row in self.lists[c]], dtype=np.int64)
+                candidates = candidates[self.ids[candidates] >= 0]
+            ids = self.ids[candidates]
+            if exclude:
+                keep = ~np.isin(ids, list(exclude))
+                candidates, ids = candidates[keep], ids[keep]
+            if len(candidates) == 0: return []
+            scores = np.asarray(vecs[candidates], dtype=np.float32) @ q
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+_indexes: dict[int, UserIndex] = {}
+_registry_lock = threading.Lock()
+
+def _index(user_id: int) -> UserIndex:
+    with _registry_lock:
+        if user_id not in _indexes: _indexes[user_id] = UserIndex(user_id)
+        return _indexes[user_id]
+
+def add(user_id: int, image_id: int, vector):
+    _index(user_id).add(image_id, vector)
+
+def remove(user_id: int, image_id: int):
+    _index(user_id).remove(image_id)
+
+def get(user_id: int, image_id: int):
+    return _index(user_id).get(image_id)
+
+def contains(user_id: int, image_id: int) -> bool:
+    return _index(user_id).contains(image_id)
+
+def search(user_id: int, vector, k: int = 20, exclude=()):
+    return _index(user_id).search(vector, k, exclude)
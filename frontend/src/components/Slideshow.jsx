@@ -12,7 +12,7 @@ function Slideshow({ images, initialIndex, onClose }) {
     const protocol = window.location.protocol;
     const host = window.location.hostname;
     // 假设后端端口固定为 8000
-    return `${protocol}//${host}:8000/static/originals/${filename}`;
+    return `${protocol}//${host}:8000/variants/${filename}?w=2048`;
   };
 
   const nextSlide = useCallback(() => {
@@ -75,7 +75,7 @@ function Editor() {
   const imageObj = state?.image;
 
 // 1. 智能初始化图片地址
-  // 结合了自动 IP 识别 + 时间戳防缓存 (解决 Canvas Tainted 问题)
+  // 自动识别后端 IP；图片响应总是带 Access-Control-Allow-Origin，缓存里的副本也能给 Canvas 读取，不用加时间戳
   const [imgSrc] = useState(() => {
     if (!imageObj) return '';
 
@@ -84,12 +84,8 @@ function Editor() {
     const host = window.location.hostname;
     const port = '8000'; // 后端端口固定
 
-    // 拼接基础 URL
-    const baseUrl = `${protocol}//${host}:${port}/static/originals/${imageObj.filename}`;
-
-    // 添加随机时间戳参数 (?t=...)
-    // 迫使浏览器将其视为新资源请求，从而正确应用后端的 CORS 头，避免 "Canvas is empty" 错误
-    return `${baseUrl}?t=${Date.now()}`;
+    // 文件名由内容哈希决定，可以放心使用浏览器缓存
+    return `${protocol}//${host}:${port}/static/originals/${imageObj.filename}`;
   });
 
   const [crop, setCrop] = useState(); 
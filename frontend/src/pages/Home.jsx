@@ -13,7 +13,6 @@ function Home() {
   
   const [isSelectMode, setIsSelectMode] = useState(false);
   const [selectedIds, setSelectedIds] = useState(new Set());
-  const [timestamp, setTimestamp] = useState(Date.now());
 
   // --- 动态获取后端地址 ---
   // 这样无论是 localhost 还是 192.168.x.x，图片都能找到
@@ -26,7 +25,6 @@ function Home() {
       const url = query ? `/search/?q=${query}` : '/my-images/';
       const res = await api.get(url);
       setImages(res.data);
-      setTimestamp(Date.now());
     } catch (err) {
       console.error("获取失败", err);
     }
@@ -147,7 +145,8 @@ function Home() {
                   <div className="aspect-[4/3] overflow-hidden bg-gray-100 relative">
                     {/* 使用 getBaseUrl() 动态拼接地址 */}
                     <img 
-                      src={`${getBaseUrl()}/static/thumbnails/${img.thumbnail}?t=${timestamp}`} 
+                      src={`${getBaseUrl()}/variants/${img.filename}?w=300`}
+                      srcSet={`${getBaseUrl()}/variants/${img.filename}?w=300 1x, ${getBaseUrl()}/variants/${img.filename}?w=1024 2x`}
                       alt="photo" 
                       className={`object-cover w-full h-full transition-transform duration-700 ease-in-out
                         ${isSelectMode ? '' : 'group-hover:scale-110'}
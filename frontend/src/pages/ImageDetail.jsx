@@ -12,7 +12,6 @@ function ImageDetail() {
   
   const [image, setImage] = useState(null);
   const [loading, setLoading] = useState(true);
-  const [refreshKey, setRefreshKey] = useState(Date.now());
 
   const [isEditing, setIsEditing] = useState(false);
   const [editForm, setEditForm] = useState({
@@ -21,15 +20,14 @@ function ImageDetail() {
     capture_date: ''
   });
 
-  // 计算图片完整 URL
-  const imageUrl = image ? `http://${window.location.hostname}:8000/static/originals/${image.filename}?t=${refreshKey}` : '';
+  // 计算图片完整 URL (文件名由内容哈希决定，内容变了地址就变，不用加时间戳防缓存)
+  const imageUrl = image ? `http://${window.location.hostname}:8000/static/originals/${image.filename}` : '';
 
   useEffect(() => {
     const fetchImageDetail = async () => {
       try {
         const res = await api.get(`/images/${id}`);
         setImage(res.data);
-        setRefreshKey(Date.now());
         
         let dateStr = '';
         if (res.data.capture_date) {
@@ -109,7 +107,7 @@ function ImageDetail() {
             {/* 3. 图片容器：增加一点点倒影效果 (可选，看起来更高级) */}
             <div className="relative z-10 w-full h-full flex justify-center items-center">
                 <img 
-                  src={`http://${window.location.hostname}:8000/static/originals/${image.filename}?t=${refreshKey}`} 
+                  src={`http://${window.location.hostname}:8000/variants/${image.filename}?w=2048`} 
                   alt="full screen" 
                   className="max-w-full max-h-[75vh] object-contain shadow-[0_20px_50px_-12px_rgba(0,0,0,0.5)] rounded-md transition-transform duration-500 ease-out group-hover:scale-[1.01]"
                 />
@@ -23,7 +23,8 @@ function Upload() {
     const host = window.location.hostname;
     const wsUrl = `${protocol}//${host}:8000/ws/${id}`;
     ws.current = new WebSocket(wsUrl);
-    ws.current.onmessage = (event) => setLogs((prev) => [...prev, event.data]);
+    // 服务端心跳是空消息，不显示
+    ws.current.onmessage = (event) => { if (event.data) setLogs((prev) => [...prev, event.data]); };
     return () => { if (ws.current) ws.current.close(); };
   }, []);
 
@@ -57,9 +58,16 @@ function Upload() {
     setLogs(["⏳ 建立加密通道...", "🚀 准备上传请求..."]);
 
     try {
-      await api.post('/upload/', formData, {
+      const res = await api.post('/upload/', formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
+      // 上传接口立即返回任务号，后台处理完成后再跳转
+      let job = res.data;
+      while (job.status === 'pending' || job.status === 'processing') {
+        await new Promise((r) => setTimeout(r, 1000));
+        job = (await api.get(`/jobs/${job.job_id}`)).data;
+      }
+      if (job.status === 'failed') setLogs((prev) => [...prev, `⚠️ 后台处理失败: ${job.error}`]);
       setTimeout(() => { navigate('/'); }, 1500);
     } catch (err) {
       setLogs((prev) => [...prev, "❌ 上传过程发生错误！"]);